@@ -5,6 +5,7 @@ from flask_migrate import Migrate
 from flask_cors import CORS
 import os
 import logging
+from app.utils.db_config import configure_database, init_sqlite_pragmas
 from datetime import datetime, timedelta
 
 # Setup logging
@@ -23,9 +24,32 @@ def create_app():
     
     # Configure app
     app.config['SECRET_KEY'] = 'your-secret-key-goes-here'
-    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///../attendance.db'
+    configure_database(app)
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
     app.config['UPLOAD_FOLDER'] = os.path.join(app.static_folder, 'uploads/student_images')
+    # Maximum SQL statements per endpoint, enforced when app.testing is set
+    app.config['QUERY_BUDGETS'] = {
+        'api.recognize_face': 4,
+        'student_api.attendance_history': 3,
+        'api.attendance_report': 5,
+    }
+    # Concurrent requests and queued waiters per inference endpoint; overflow gets a 503
+    app.config['ADMISSION_LIMITS'] = {
+        'api.recognize_face': (2, 8),
+        'api.check_face': (4, 16),
+        'student_api.upload_faces': (2, 8),
+        'student_api.submit_attendance': (4, 32),
+    }
+    app.config['ADMISSION_QUEUE_TIMEOUT'] = float(os.environ.get('ADMISSION_QUEUE_TIMEOUT', 10))
+    # Inference requests allowed per student: (count, seconds)
+    app.config['STUDENT_RATE_LIMIT'] = (10, 60)
+    # Attendance marks are group-committed: (max marks per transaction, max wait in ms)
+    app.config['ATTENDANCE_WRITE_BATCH'] = (int(os.environ.get('ATTENDANCE_WRITE_BATCH_SIZE', 64)),
+                                            float(os.environ.get('ATTENDANCE_WRITE_WAIT_MS', 5)))
+    # Reject student API calls without a bearer token; off while older app builds send only student_id
+    app.config['STUDENT_API_REQUIRE_TOKEN'] = os.environ.get('STUDENT_API_REQUIRE_TOKEN', '').lower() in ('1', 'true', 'yes', 'on')
+    # Teachers allowed to use the /admin profiling and memory endpoints (comma-separated emails)
+    app.config['ADMIN_EMAILS'] = {email.strip().lower() for email in os.environ.get('ADMIN_EMAILS', '').split(',') if email.strip()}
     
     # Enable CORS for all routes
     CORS(app, resources={r"/api/*": {"origins": "*"}})
@@ -69,24 +93,45 @@ def create_app():
     login_manager.login_view = 'auth.login'
     
     # Import and register blueprints
+    from app.utils.query_counter import init_query_counter
+    from app.utils.admission import init_admission_control
+    from app.utils.attendance_writer import init_attendance_writer
+    from app.utils.profiling import init_request_profiler
     from app.routes.auth import auth as auth_blueprint
     from app.routes.main import main as main_blueprint
     from app.routes.classes import classes as classes_blueprint
     from app.routes.api import api as api_blueprint
     from app.routes.student_api import student_api as student_api_blueprint
+    from app.routes.admin import admin as admin_blueprint
     
     app.register_blueprint(auth_blueprint)
     app.register_blueprint(main_blueprint)
     app.register_blueprint(classes_blueprint)
     app.register_blueprint(api_blueprint)
     app.register_blueprint(student_api_blueprint, url_prefix='/api/student')
+    app.register_blueprint(admin_blueprint, url_prefix='/admin')
+    
+    # Bound concurrency on the inference endpoints
+    init_admission_control(app)
+    init_attendance_writer(app)
+    # Off until switched on through /admin/profiling
+    init_request_profiler(app)
+    
+    # Register flask CLI commands
+    from app.cli import init_cli
+    init_cli(app)
     
     # Ensure upload directory exists
     os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
     
     # Create database tables
     with app.app_context():
+        init_sqlite_pragmas(app, db.engine)
         db.create_all()
+        # Galleries saved before the catalog existed are registered on first start
+        from app.utils.gallery_store import init_gallery_catalog
+        init_gallery_catalog(echo=logger.info)
+        init_query_counter(app, db.engine)
     
     # Add template context processor for current year
     @app.context_processor
@@ -0,0 +1,108 @@
+from app import db
+from app.models import StudentPhoto
+from app.utils.photo_store import PROJECT_ROOT, store_photo
+from flask.cli import AppGroup
+import click
+import glob
+import os
+import re
+
+photos_cli = AppGroup('photos', help='Manage stored student photos.')
+embeddings_cli = AppGroup('embeddings', help='Manage class face embedding galleries.')
+students_cli = AppGroup('students', help='Manage students in bulk.')
+
+
+def find_legacy_photo(photo):
+    """Locate the original file of a StudentPhoto row written before the photo store"""
+    if os.path.isabs(photo.filename) or os.sep in photo.filename or '/' in photo.filename:
+        # add_students stored a full path under student_images/<teacher>/<class>/<name>
+        path = photo.filename if os.path.isabs(photo.filename) else os.path.join(PROJECT_ROOT, photo.filename)
+        return os.path.normpath(path) if os.path.exists(path) else None
+    # upload_faces stored a bare name under static/uploads/student_images/<class>/<student>
+    matches = glob.glob(os.path.join(PROJECT_ROOT, 'static', 'uploads', 'student_images', '*',
+                                     str(photo.student_id), glob.escape(photo.filename)))
+    return matches[0] if matches else None
+
+
+@photos_cli.command('migrate')
+@click.option('--delete-originals', is_flag=True, help='Remove legacy files once they are stored.')
+@click.option('--batch-size', default=200, show_default=True, help='Rows committed per transaction.')
+def migrate_photos(delete_originals, batch_size):
+    """Move photos from the legacy directory layouts into the content-addressed store."""
+    store_key = re.compile(r'^[0-9a-f]{2}/[0-9a-f]{64}\.jpg$')
+    migrated = missing = duplicates = 0
+    originals = []
+
+    photos = StudentPhoto.query.order_by(StudentPhoto.id).all()
+    for i, photo in enumerate(photos, 1):
+        if store_key.match(photo.filename):
+            continue
+
+        source = find_legacy_photo(photo)
+        if source is None:
+            missing += 1
+            click.echo(f"Missing file for photo {photo.id} (student {photo.student_id}): {photo.filename}")
+            continue
+
+        with open(source, 'rb') as f:
+            try:
+                key = store_photo(f.read())
+            except Exception as e:
+                click.echo(f"Could not read {source}: {e}")
+                continue
+
+        # Drop the row if the student already has this exact photo in the store
+        if StudentPhoto.query.filter_by(student_id=photo.student_id, filename=key).first():
+            db.session.delete(photo)
+            duplicates += 1
+        else:
+            photo.filename = key
+        originals.append(source)
+        migrated += 1
+
+        if i % batch_size == 0:
+            db.session.commit()
+    db.session.commit()
+
+    if delete_originals:
+        for source in originals:
+            if os.path.exists(source):
+                os.remove(source)
+
+    click.echo(f"Migrated {migrated} photos ({duplicates} duplicates merged), {missing} missing.")
+
+
+@embeddings_cli.command('rebuild')
+@click.option('--class-id', 'class_ids', multiple=True, type=int, help='Class to rebuild (repeatable); default all.')
+@click.option('--workers', type=int, default=None, help='Decode/detect processes (default: CPU count).')
+@click.option('--batch-size', default=64, show_default=True, help='Faces per FaceNet batch.')
+@click.option('--restart', is_flag=True, help='Ignore the checkpoint of an interrupted run.')
+def rebuild_embeddings(class_ids, workers, batch_size, restart):
+    """Recompute class galleries from stored student photos."""
+    from app.utils.gallery_rebuild import rebuild_galleries
+    rebuild_galleries(list(class_ids) or None, workers, batch_size, restart, echo=click.echo)
+
+
+@embeddings_cli.command('catalog')
+def catalog_embeddings():
+    """Register gallery files that predate the gallery catalog."""
+    from app.utils.gallery_store import sync_gallery_catalog
+    registered = sync_gallery_catalog(echo=click.echo)
+    click.echo(f"Registered {registered} galleries.")
+
+
+@students_cli.command('import')
+@click.argument('root', type=click.Path(exists=True, file_okay=False))
+@click.option('--workers', type=int, default=None, help='Processes for photo ingest and detection (default: CPU count).')
+@click.option('--commit-every', default=200, show_default=True, help='Students per database transaction.')
+@click.option('--no-embed', is_flag=True, help='Only create rows and store photos.')
+def import_students(root, workers, commit_every, no_embed):
+    """Import a <teacher id>/<class>/<student>/*.jpg photo tree."""
+    from app.utils.bulk_import import import_tree
+    import_tree(root, workers, commit_every, embed=not no_embed, echo=click.echo)
+
+
+def init_cli(app):
+    app.cli.add_command(photos_cli)
+    app.cli.add_command(embeddings_cli)
+    app.cli.add_command(students_cli)
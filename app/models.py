@@ -1,4 +1,5 @@
 from app import db, login_manager
+from flask import g
 from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime
@@ -6,12 +7,22 @@ import secrets
 
 @login_manager.user_loader
 def load_user(user_id):
-    # Try to load a teacher first
-    user = Teacher.query.get(int(user_id))
-    if user:
-        return user
-    # If no teacher found, try to load a student
-    return Student.query.get(int(user_id))
+    # Identities resolved earlier in this request are reused
+    cache = g.setdefault('identity_cache', {})
+    if user_id in cache:
+        return cache[user_id]
+
+    kind, _, raw_id = user_id.rpartition(':')
+    if kind == 'teacher':
+        user = Teacher.query.get(int(raw_id))
+    elif kind == 'student':
+        user = Student.query.get(int(raw_id))
+    else:
+        # Sessions created before ids were namespaced: try a teacher first
+        user = Teacher.query.get(int(user_id)) or Student.query.get(int(user_id))
+
+    cache[user_id] = user
+    return user
 
 class Teacher(db.Model, UserMixin):
     id = db.Column(db.Integer, primary_key=True)
@@ -21,6 +32,10 @@ class Teacher(db.Model, UserMixin):
     classes = db.relationship('Class', backref='teacher', lazy=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+    def get_id(self):
+        # Namespaced so load_user knows which table to hit
+        return f"teacher:{self.id}"
+
     def set_password(self, password):
         self.password_hash = generate_password_hash(password)
 
@@ -51,23 +66,32 @@ class Student(db.Model, UserMixin):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     face_encoding_complete = db.Column(db.Boolean, default=False)  # Flag to track if face encoding is complete
     
+    def get_id(self):
+        return f"student:{self.id}"
+    
     def set_password(self, password):
         self.password_hash = generate_password_hash(password)
         
     def check_password(self, password):
         return check_password_hash(self.password_hash, password)
     
-    @property
-    def last_attendance_time(self):
-        # Find the most recent attendance record where status is True (Present)
-        last_attendance = Attendance.query.filter_by(
-            student_id=self.id, 
-            status=True
-        ).order_by(Attendance.timestamp.desc()).first()
-        
-        if last_attendance:
-            return last_attendance.timestamp
-        return None
+    @staticmethod
+    def last_attendance_times(student_ids):
+        """
+        Return {student_id: timestamp} of the most recent Present record for
+        each of the given students, using a single grouped query.
+        """
+        student_ids = list(student_ids)
+        if not student_ids:
+            return {}
+        rows = db.session.query(
+            Attendance.student_id,
+            db.func.max(Attendance.timestamp)
+        ).filter(
+            Attendance.student_id.in_(student_ids),
+            Attendance.status == True
+        ).group_by(Attendance.student_id).all()
+        return {student_id: timestamp for student_id, timestamp in rows}
 
 class StudentPhoto(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -84,4 +108,135 @@ class Attendance(db.Model):
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)  # Added timestamp
     
     student = db.relationship('Student', backref='attendances')
-    class_ref = db.relationship('Class', backref='attendances')
\ No newline at end of file
+    class_ref = db.relationship('Class', backref='attendances')
+
+    __table_args__ = (
+        # Roster reads: one class on one date
+        db.Index('ix_attendance_class_id_date', 'class_id', 'date'),
+        # Student history ordered by date
+        db.Index('ix_attendance_student_id_date', 'student_id', 'date'),
+        # Latest Present timestamp per student
+        db.Index('ix_attendance_student_id_status_timestamp', 'student_id', 'status', 'timestamp'),
+        # One row per student, class and day; the conflict target of mark_present
+        db.Index('uq_attendance_student_class_date', 'student_id', 'class_id', 'date', unique=True),
+    )
+
+    @staticmethod
+    def mark_present(marks, upsert=True):
+        """
+        Mark (student_id, class_id, date, timestamp) tuples present in the current
+        transaction. Later marks of the same key win. Returns {key: created}, where
+        created is True when the key had no row yet, and the number of students per
+        (class_id, date) who were not present before.
+
+        Both results come from the writes themselves, never from an earlier read,
+        so concurrent writers of the same key cannot each count it as new: new
+        rows are inserted with one INSERT ... ON CONFLICT DO NOTHING RETURNING
+        statement where supported, and existing rows are flipped to present by a
+        conditional UPDATE whose row count says whether they were absent.
+        """
+        table = Attendance.__table__
+        latest = {(student_id, class_id, day): timestamp for student_id, class_id, day, timestamp in marks}
+        rows = {key: {'student_id': key[0], 'class_id': key[1], 'date': key[2], 'status': True, 'timestamp': timestamp}
+                for key, timestamp in latest.items()}
+
+        inserted = set()
+        dialect = db.session.get_bind().dialect.name
+        if upsert and dialect in ('sqlite', 'postgresql'):
+            if dialect == 'sqlite':
+                from sqlalchemy.dialects.sqlite import insert
+            else:
+                from sqlalchemy.dialects.postgresql import insert
+            result = db.session.execute(
+                insert(table).values(list(rows.values()))
+                .on_conflict_do_nothing(index_elements=['student_id', 'class_id', 'date'])
+                .returning(table.c.student_id, table.c.class_id, table.c.date))
+            inserted = {tuple(row) for row in result}
+
+        newly_present = {}
+        created = {}
+        for key, row in rows.items():
+            if key in inserted:
+                created[key] = was_absent = True
+            else:
+                where = (table.c.student_id == key[0]) & (table.c.class_id == key[1]) & (table.c.date == key[2])
+                was_absent = db.session.execute(table.update().where(where & table.c.status.isnot(True))
+                                                .values(status=True, timestamp=row['timestamp'])).rowcount > 0
+                created[key] = False
+                # Already present: only the timestamp moves
+                if not was_absent and not db.session.execute(
+                        table.update().where(where).values(timestamp=row['timestamp'])).rowcount:
+                    # No row at all (no unique key to conflict on, or another database)
+                    db.session.execute(table.insert().values(**row))
+                    created[key] = was_absent = True
+            if was_absent:
+                newly_present[(key[1], key[2])] = newly_present.get((key[1], key[2]), 0) + 1
+        return created, newly_present
+
+class ClassGallery(db.Model):
+    """Catalog entry for a class's face gallery file, found by class_id rather than by filename"""
+    __tablename__ = 'class_gallery'
+    class_id = db.Column(db.Integer, db.ForeignKey('class.id'), primary_key=True)
+    path = db.Column(db.String(255), nullable=False)  # relative to the embeddings directory
+    student_count = db.Column(db.Integer, nullable=False, default=0)
+    embedding_dim = db.Column(db.Integer, nullable=True)
+    model_version = db.Column(db.String(64), nullable=True)
+    byte_size = db.Column(db.Integer, nullable=False, default=0)
+    version = db.Column(db.Integer, nullable=False, default=0)  # bumped on every save
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class SubmissionKey(db.Model):
+    """Idempotency key of an attendance submission and its response, shared by every worker process"""
+    __tablename__ = 'submission_key'
+    student_id = db.Column(db.String(64), primary_key=True)
+    key_hash = db.Column(db.String(64), primary_key=True)  # SHA-256 of the client's key
+    status_code = db.Column(db.Integer, nullable=True)  # None while the first submission runs
+    response = db.Column(db.LargeBinary, nullable=True)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+class AttendanceDailySummary(db.Model):
+    """Present/enrolled counts per class and day, kept up to date on every attendance write"""
+    __tablename__ = 'attendance_daily_summary'
+    class_id = db.Column(db.Integer, db.ForeignKey('class.id'), primary_key=True)
+    date = db.Column(db.Date, primary_key=True)
+    present_count = db.Column(db.Integer, nullable=False, default=0)
+    enrolled_count = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    @staticmethod
+    def _upsert(class_id, day, values, update):
+        """Insert values, or apply update to the existing row, in one statement where supported"""
+        table = AttendanceDailySummary.__table__
+        dialect = db.session.get_bind().dialect.name
+        values = dict(values, class_id=class_id, date=day, updated_at=datetime.utcnow())
+        update = dict(update, updated_at=datetime.utcnow())
+        if dialect in ('sqlite', 'postgresql'):
+            if dialect == 'sqlite':
+                from sqlalchemy.dialects.sqlite import insert
+            else:
+                from sqlalchemy.dialects.postgresql import insert
+            stmt = insert(table).values(**values)
+            db.session.execute(stmt.on_conflict_do_update(index_elements=['class_id', 'date'], set_=update))
+            return
+        # Other databases: update, and insert when no row was there yet
+        result = db.session.execute(table.update().where(
+            (table.c.class_id == class_id) & (table.c.date == day)).values(**update))
+        if result.rowcount == 0:
+            db.session.execute(table.insert().values(**values))
+
+    @staticmethod
+    def set_counts(class_id, day, present_count, enrolled_count):
+        """Record the counts of a whole-roster write for one class and day"""
+        counts = {'present_count': present_count, 'enrolled_count': enrolled_count}
+        AttendanceDailySummary._upsert(class_id, day, counts, counts)
+
+    @staticmethod
+    def add_present(class_id, day, delta=1):
+        """Adjust the present count of one class and day, atomically"""
+        table = AttendanceDailySummary.__table__
+        enrolled = db.session.query(db.func.count(Student.id)).filter(Student.class_id == class_id).scalar()
+        AttendanceDailySummary._upsert(
+            class_id, day,
+            {'present_count': max(delta, 0), 'enrolled_count': enrolled},
+            {'present_count': table.c.present_count + delta, 'enrolled_count': enrolled},
+        )
@@ -0,0 +1,88 @@
+from flask import Blueprint, request, jsonify, current_app, send_file
+from flask_login import login_required, current_user
+from app.models import Teacher
+from app.utils.face_embedder import get_shared_embedder
+from app.utils.profiling import embedder_memory_report
+from functools import wraps
+import traceback
+
+admin = Blueprint('admin', __name__)
+
+
+def admin_required(view):
+    """Logged-in teachers whose email is listed in ADMIN_EMAILS"""
+    @wraps(view)
+    @login_required
+    def wrapper(*args, **kwargs):
+        if not isinstance(current_user, Teacher) or current_user.email.lower() not in current_app.config['ADMIN_EMAILS']:
+            return jsonify({'success': False, 'message': 'Admin access required'}), 403
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def get_request_profiler():
+    return current_app.extensions['request_profiler']
+
+
+@admin.route('/profiling', methods=['GET'])
+@admin_required
+def profiling_status():
+    """Current profiling settings and the stored profiles"""
+    profiler = get_request_profiler()
+    return jsonify({'success': True, 'settings': profiler.settings(), 'profiles': profiler.list_profiles()})
+
+
+@admin.route('/profiling', methods=['POST'])
+@admin_required
+def configure_profiling():
+    """
+    Switch request profiling on or off for this process.
+    JSON body: enabled, sample_rate (0-1), endpoints (list of endpoint names),
+    class_id, max_profiles.
+    """
+    data = request.get_json(silent=True) or {}
+    try:
+        get_request_profiler().configure(
+            enabled=data.get('enabled', False),
+            sample_rate=data.get('sample_rate', 0.0),
+            endpoints=data.get('endpoints'),
+            class_id=data.get('class_id'),
+            max_profiles=data.get('max_profiles', 20),
+        )
+    except (TypeError, ValueError) as e:
+        return jsonify({'success': False, 'message': f'Invalid profiling settings: {e}'}), 400
+
+    settings = get_request_profiler().settings()
+    print(f"Request profiling {'enabled' if settings['enabled'] else 'disabled'} by {current_user.email}: {settings}")
+    return jsonify({'success': True, 'settings': settings})
+
+
+@admin.route('/profiling/<profile_id>', methods=['GET'])
+@admin_required
+def get_profile(profile_id):
+    """A stored profile: the JSON summary, or ?format=pstats for the raw cProfile dump"""
+    profiler = get_request_profiler()
+    if request.args.get('format') == 'pstats':
+        path = profiler.profile_path(profile_id, '.pstats')
+        if path is None:
+            return jsonify({'success': False, 'message': 'Profile not found'}), 404
+        return send_file(path, mimetype='application/octet-stream', as_attachment=True,
+                         download_name=f"{profile_id}.pstats")
+
+    report = profiler.load_profile(profile_id)
+    if report is None:
+        return jsonify({'success': False, 'message': 'Profile not found'}), 404
+    return jsonify({'success': True, 'profile': report})
+
+
+@admin.route('/memory', methods=['GET'])
+@admin_required
+def memory_report():
+    """Memory held by this process's embedder, its caches and the cached class galleries"""
+    try:
+        embedder = get_shared_embedder()
+    except Exception as e:
+        print(f"Admin memory report: embedder not available: {e}")
+        traceback.print_exc()
+        return jsonify({'success': False, 'message': 'Face recognition system not available'}), 503
+    return jsonify({'success': True, 'memory': embedder_memory_report(embedder)})
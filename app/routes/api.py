@@ -1,15 +1,20 @@
-from flask import Blueprint, request, jsonify, current_app, render_template
+from flask import Blueprint, request, jsonify, current_app, render_template, Response, stream_with_context
 from flask_login import login_required, current_user
-from app.models import Class, Student, StudentPhoto, Attendance
-from app.utils.face_embedder import FaceEmbedder
+from app.models import Class, Student, StudentPhoto, Attendance, AttendanceDailySummary
+from app.utils.face_embedder import get_shared_embedder
+from app.utils.photo_quality import assess_photo
+from app.utils.gallery_store import gallery_cache_stats, load_gallery
+from app.utils.attendance_reports import build_attendance_report, invalidate_attendance_reports
 from app import db
 import os
 import numpy as np
 import cv2
-from datetime import date, datetime, timezone
+from datetime import date, datetime, timezone, timedelta
 import pickle
 import uuid
 import io
+import csv
+import json
 import traceback
 
 api = Blueprint('api', __name__)
@@ -21,18 +26,29 @@ def get_face_embedder():
     global face_embedder
     if face_embedder is None:
         try:
-            face_embedder = FaceEmbedder()
+            face_embedder = get_shared_embedder()
             print("API blueprint: FaceEmbedder initialized successfully")
         except Exception as e:
             print(f"API blueprint: Error initializing face embedder: {e}")
             traceback.print_exc()
     return face_embedder
 
+# Upper bound on photos per recognition request
+RECOGNIZE_MAX_IMAGES = 8
+
 @api.route('/api/recognize', methods=['POST'])
 @login_required
 def recognize_face():
-    if 'image' not in request.files:
+    """
+    Recognize students in one or more photos of a class (repeat the image field).
+    Faces from all photos are matched against the gallery in one pass and merged
+    by identity, keeping each student's best score.
+    """
+    image_files = [f for f in request.files.getlist('image') if f and f.filename != '']
+    if not image_files:
         return jsonify({'success': False, 'message': 'No image provided'})
+    if len(image_files) > RECOGNIZE_MAX_IMAGES:
+        return jsonify({'success': False, 'message': f'At most {RECOGNIZE_MAX_IMAGES} images per request'})
     
     class_id = request.form.get('class_id', type=int)
     if not class_id:
@@ -44,8 +60,9 @@ def recognize_face():
     if (class_obj.teacher_id != current_user.id):
         return jsonify({'success': False, 'message': 'Unauthorized'})
     
-    image_file = request.files['image']
-    image_bytes = image_file.read()
+    images = [image_file.read() for image_file in image_files]
+    # Group-photo mode tiles large classroom photos to find small faces
+    group = request.form.get('group', '').lower() in ('1', 'true', 'on')
     
     # Process image with face embedder
     embedder = get_face_embedder()
@@ -53,68 +70,72 @@ def recognize_face():
         return jsonify({'success': False, 'message': 'Face recognition system not available'})
     
     # Get embeddings dictionary
-    print(f"Looking for embeddings for teacher {current_user.id}, class {class_obj.name}")
-    embeddings_dict = embedder.load_class_embeddings(current_user.id, class_obj.name)
+    print(f"Looking for embeddings for class {class_id} ({class_obj.name})")
+    embeddings_dict = load_gallery(class_id)
     
     if not embeddings_dict:
-        print(f"No embeddings found for teacher {current_user.id}, class {class_obj.name}")
+        print(f"No embeddings found for class {class_id} ({class_obj.name})")
         return jsonify({'success': False, 'message': 'No embeddings found for this class. Please add students with photos first.'})
     
     print(f"Found embeddings for {len(embeddings_dict)} students")
     
-    # Detect faces in the image
+    # Detect every photo concurrently and embed all faces in one batch; a
+    # re-submitted image is answered from the result cache by content hash
     try:
-        faces, img = embedder.detect_faces(image_bytes)
-        print(f"Detected {len(faces)} faces in the uploaded image")
+        detections = embedder.detect_and_embed_many(images, group=group)
+        print(f"Detected {sum(len(faces) for faces, _ in detections)} faces in {len(images)} uploaded image(s)")
     except Exception as e:
         print(f"Face detection error: {str(e)}")
         traceback.print_exc()
         return jsonify({'success': False, 'message': f'Error detecting faces: {str(e)}'})
     
-    if not faces:
+    if not any(faces for faces, _ in detections):
         return jsonify({'success': False, 'message': 'No faces detected in the image'})
     
-    # Process each face
+    # Process each face, keeping the best match per identity across photos
     recognized_students = []
-    face_locations = []
+    image_face_locations = [[face['box'] for face in faces] for faces, _ in detections]
+    best_matches = {}
     
-    for i, face in enumerate(faces):
-        try:
-            # Extract face location
-            box = face['box']
-            face_locations.append(box)
-            
-            # Preprocess face
-            face_img = embedder.preprocess_face(img, face)
-            
-            # Get embedding
-            embedding = embedder.get_embedding(face_img)
-            
+    for image_index, (faces, embeddings) in enumerate(detections):
+        for i, embedding in enumerate(embeddings):
             # Compare with stored embeddings
             student_name, similarity = embedder.compare_faces(embedding, embeddings_dict)
             
             if student_name:
-                print(f"Face {i+1}: Recognized as {student_name} with confidence {similarity:.4f}")
-                # Try to find the student in the database
-                student = Student.query.filter_by(name=student_name, class_id=class_id).first()
-                if student:
-                    recognized_students.append({
-                        'id': student.id,
-                        'name': student.name,
-                        'confidence': float(similarity),
-                        'face_index': i
-                    })
+                print(f"Image {image_index+1} face {i+1}: Recognized as {student_name} with confidence {similarity:.4f}")
+                if student_name not in best_matches or similarity > best_matches[student_name][2]:
+                    best_matches[student_name] = (image_index, i, similarity)
             else:
-                print(f"Face {i+1}: Not recognized, highest similarity was {similarity:.4f}")
-        except Exception as e:
-            print(f"Error processing face {i+1}: {str(e)}")
-            traceback.print_exc()
+                print(f"Image {image_index+1} face {i+1}: Not recognized, highest similarity was {similarity:.4f}")
     
-    # Return results
+    # Resolve all matched names to students with a single query
+    if best_matches:
+        students_by_name = {}
+        for student in Student.query.filter(
+            Student.class_id == class_id,
+            Student.name.in_(best_matches.keys())
+        ).order_by(Student.id).all():
+            # Keep the first student per name, as filter_by(...).first() did
+            students_by_name.setdefault(student.name, student)
+        
+        for student_name, (image_index, i, similarity) in best_matches.items():
+            student = students_by_name.get(student_name)
+            if student:
+                recognized_students.append({
+                    'id': student.id,
+                    'name': student.name,
+                    'confidence': float(similarity),
+                    'image_index': image_index,
+                    'face_index': i
+                })
+    
+    # Return results; face_locations keeps the single-image shape for the first photo
     return jsonify({
         'success': True,
         'recognized': recognized_students,
-        'face_locations': face_locations
+        'face_locations': image_face_locations[0],
+        'image_face_locations': image_face_locations
     })
 
 @api.route('/api/save-attendance', methods=['POST'])
@@ -154,8 +175,10 @@ def save_attendance():
     Attendance.query.filter_by(class_id=class_id, date=attendance_date).delete()
     
     # Create attendance records
+    present_count = 0
     for student in students:
         status = student.id in present_student_ids
+        present_count += status
         attendance = Attendance(
             student_id=student.id,
             class_id=class_id,
@@ -164,16 +187,21 @@ def save_attendance():
         )
         db.session.add(attendance)
     
+    # Keep the daily summary in step, in the same transaction
+    AttendanceDailySummary.set_counts(class_id, attendance_date, present_count, len(students))
+    
     try:
         db.session.commit()
+        invalidate_attendance_reports(class_id)
         return jsonify({'success': True, 'message': 'Attendance saved successfully'})
     except Exception as e:
         db.session.rollback()
         return jsonify({'success': False, 'message': f'Error saving attendance: {str(e)}'})
 
 @api.route('/check-face', methods=['POST'])
+@api.route('/api/check-face', methods=['POST'])
 def check_face():
-    """API endpoint to check if a face is detected in an image"""
+    """API endpoint to check if a face is detected in an image, with a quick quality report"""
     if 'image' not in request.files:
         return jsonify({'success': False, 'message': 'No image provided'}), 400
         
@@ -185,8 +213,15 @@ def check_face():
         # Read image data
         image_data = file.read()
         
-        # Detect faces
-        faces, _ = face_embedder.detect_faces(image_data)
+        embedder = get_face_embedder()
+        if embedder is None:
+            return jsonify({'success': False, 'message': 'Face recognition system not available'}), 503
+        
+        # Detect faces and score the best one at reduced resolution
+        assessment = assess_photo(embedder, image_data)
+        quality = {key: value for key, value in assessment.items() if key not in ('faces', 'phash')}
+        if 'phash' in assessment:
+            quality['phash'] = f"{assessment['phash']:016x}"
         
         # Return results
         return jsonify({
@@ -194,11 +229,31 @@ def check_face():
             'faces': [{
                 'box': face['box'],
                 'confidence': face['confidence']
-            } for face in faces]
+            } for face in assessment['faces']],
+            'quality': quality
         })
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
 
+@api.route('/api/embedder-stats', methods=['GET'])
+@login_required
+def embedder_stats():
+    """Micro-batching, result cache, admission, attendance write and gallery cache metrics"""
+    embedder = get_face_embedder()
+    if embedder is None:
+        return jsonify({'success': False, 'message': 'Face recognition system not available'}), 503
+    result_cache = embedder.result_cache.stats() if embedder.result_cache is not None else None
+    admission = {endpoint: limiter.stats()
+                 for endpoint, limiter in current_app.extensions.get('admission_limiters', {}).items()}
+    return jsonify({
+        'success': True,
+        'batching': embedder.batching_stats(),
+        'result_cache': result_cache,
+        'admission': admission,
+        'attendance_writes': current_app.extensions['attendance_writer'].stats(),
+        'gallery_cache': gallery_cache_stats(),
+    })
+
 @api.route('/classes/<int:class_id>/attendance-data', methods=['GET'])
 @login_required
 def get_attendance_data(class_id):
@@ -230,8 +285,6 @@ def get_attendance_data(class_id):
         
         # Format attendance data
         attendance_data = []
-        present_count = 0
-        absent_count = 0
         
         # Create a mapping of student_id to attendance record
         attendance_map = {record.student_id: record for record in attendance_records}
@@ -239,12 +292,6 @@ def get_attendance_data(class_id):
         for student in students:
             attendance_record = attendance_map.get(student.id)
             is_present = attendance_record and attendance_record.status
-            status = "Present" if is_present else "Absent"
-            
-            if is_present:
-                present_count += 1
-            else:
-                absent_count += 1
             
             # Handle timestamp properly - append 'Z' to explicitly mark it as UTC
             timestamp_str = None
@@ -259,15 +306,25 @@ def get_attendance_data(class_id):
                 'timestamp': timestamp_str
             })
             
+        # Counts come from the daily summary every attendance write keeps current;
+        # a day without a summary row (before the backfill) is counted from the roster
+        summary = AttendanceDailySummary.query.get((class_id, attendance_date))
+        if summary is not None:
+            total = summary.enrolled_count
+            present_count = summary.present_count
+        else:
+            total = len(students)
+            present_count = sum(1 for item in attendance_data if item['status'])
+        
         return jsonify({
             'success': True,
             'date': attendance_date.isoformat(),
             'attendance': attendance_data,
             'stats': {
-                'total': len(students),
+                'total': total,
                 'present': present_count,
-                'absent': absent_count,
-                'present_percent': round(present_count * 100 / len(students)) if students else 0
+                'absent': max(total - present_count, 0),
+                'present_percent': round(present_count * 100 / total) if total else 0
             }
         })
         
@@ -326,4 +383,113 @@ def get_attendance_data_api():  # Changed function name from get_attendance_data
         'date': attendance_date.isoformat(),
         'class_name': class_obj.name,
         'students': student_data
-    })
\ No newline at end of file
+    })
+
+# Default and longest date range of an attendance report, in days
+REPORT_DEFAULT_DAYS = 30
+REPORT_MAX_DAYS = 366
+
+@api.route('/api/attendance-report', methods=['GET'])
+@login_required
+def attendance_report():
+    """
+    Class x date attendance matrix with attendance rates over a date range.
+    Query: start, end (ISO dates), class_id (repeatable; default all of the
+    teacher's classes), students=1 to add per-student rates.
+    """
+    try:
+        end = date.fromisoformat(request.args['end']) if request.args.get('end') else date.today()
+        start = (date.fromisoformat(request.args['start']) if request.args.get('start')
+                 else end - timedelta(days=REPORT_DEFAULT_DAYS - 1))
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Invalid date format'}), 400
+    if start > end or (end - start).days >= REPORT_MAX_DAYS:
+        return jsonify({'success': False, 'message': f'Date range must be 1-{REPORT_MAX_DAYS} days'}), 400
+    
+    query = Class.query.filter_by(teacher_id=current_user.id)
+    class_ids = request.args.getlist('class_id', type=int)
+    if class_ids:
+        query = query.filter(Class.id.in_(class_ids))
+    classes = query.all()
+    if class_ids and len(classes) != len(set(class_ids)):
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 403
+    
+    include_students = request.args.get('students', '').lower() in ('1', 'true')
+    report = build_attendance_report(classes, start, end, include_students)
+    return jsonify(dict(report, success=True))
+
+# Rows fetched from the database per round trip while exporting
+EXPORT_YIELD_PER = 1000
+
+@api.route('/classes/<int:class_id>/attendance-export', methods=['GET'])
+@login_required
+def export_attendance(class_id):
+    """
+    Stream attendance records for a class over a date range as CSV or NDJSON.
+    Rows are read with yield_per and written by a generator, so memory use
+    stays constant regardless of the range.
+    """
+    class_obj = Class.query.get_or_404(class_id)
+    if class_obj.teacher_id != current_user.id:
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 403
+    
+    export_format = request.args.get('format', 'csv')
+    if export_format not in ('csv', 'ndjson'):
+        return jsonify({'success': False, 'message': 'Format must be csv or ndjson'}), 400
+    
+    try:
+        start_date = date.fromisoformat(request.args['start']) if request.args.get('start') else None
+        end_date = date.fromisoformat(request.args['end']) if request.args.get('end') else None
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Invalid date format'}), 400
+    
+    query = db.session.query(
+        Attendance.date,
+        Attendance.student_id,
+        Student.name,
+        Attendance.status,
+        Attendance.timestamp
+    ).join(Student, Attendance.student_id == Student.id).filter(Attendance.class_id == class_id)
+    if start_date:
+        query = query.filter(Attendance.date >= start_date)
+    if end_date:
+        query = query.filter(Attendance.date <= end_date)
+    query = query.order_by(Attendance.date, Attendance.student_id).yield_per(EXPORT_YIELD_PER)
+    
+    def generate_csv():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(['date', 'student_id', 'student_name', 'status', 'timestamp'])
+        for row in query:
+            writer.writerow([
+                row.date.isoformat(),
+                row.student_id,
+                row.name,
+                'Present' if row.status else 'Absent',
+                row.timestamp.replace(tzinfo=timezone.utc).isoformat() if row.timestamp else ''
+            ])
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate(0)
+    
+    def generate_ndjson():
+        for row in query:
+            yield json.dumps({
+                'date': row.date.isoformat(),
+                'student_id': row.student_id,
+                'student_name': row.name,
+                'status': bool(row.status),
+                'timestamp': row.timestamp.replace(tzinfo=timezone.utc).isoformat() if row.timestamp else None
+            }) + '\n'
+    
+    if export_format == 'csv':
+        generator, mimetype = generate_csv(), 'text/csv'
+    else:
+        generator, mimetype = generate_ndjson(), 'application/x-ndjson'
+    
+    filename = f"attendance_{class_id}_{start_date or 'start'}_{end_date or 'end'}.{export_format}"
+    return Response(
+        stream_with_context(generator),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename="{filename}"'}
+    )
@@ -1,8 +1,12 @@
 from flask import Blueprint, render_template, redirect, url_for, flash, request, current_app
 from flask_login import login_required, current_user
 from app.models import Class, Student, StudentPhoto
-from app.utils.face_embedder import FaceEmbedder
+from app.utils.face_embedder import get_shared_embedder
+from app.utils.photo_store import store_upload, photo_path
+from app.utils.photo_quality import select_best_photos
+from app.utils.gallery_store import has_gallery, update_gallery
 from app import db
+from sqlalchemy.orm import selectinload
 from werkzeug.utils import secure_filename
 import os
 from flask_wtf import FlaskForm
@@ -22,7 +26,7 @@ def get_face_embedder():
     global face_embedder
     if face_embedder is None:
         try:
-            face_embedder = FaceEmbedder()
+            face_embedder = get_shared_embedder()
             print("FaceEmbedder initialized successfully")
         except Exception as e:
             print(f"Error initializing face embedder: {e}")
@@ -95,11 +99,6 @@ def add_students(class_id):
                 db.session.add(student)
                 db.session.flush()  # Get student ID before commit
                 
-                # Create directory for student images
-                student_dir = os.path.join(current_app.root_path, '..', 'student_images', 
-                                          str(current_user.id), class_obj.name, name)
-                os.makedirs(student_dir, exist_ok=True)
-                
                 # Process student photos and collect them for embedding
                 student_images = []
                 photo_count = 0
@@ -110,20 +109,20 @@ def add_students(class_id):
                     if photo_key in request.files:
                         photo_file = request.files[photo_key]
                         if photo_file and photo_file.filename:
-                            filename = secure_filename(photo_file.filename)
-                            # Generate a unique filename to avoid duplicates
-                            unique_filename = f"{uuid.uuid4()}_{filename}"
-                            
-                            # Save file to student-specific directory
-                            photo_path = os.path.join(student_dir, unique_filename)
-                            photo_file.save(photo_path)
+                            # Downsize and store by content hash
+                            try:
+                                key = store_upload(photo_file)
+                            except Exception as e:
+                                print(f"Could not read photo {photo_file.filename} for {name}: {str(e)}")
+                                flash(f"Skipped unreadable photo {photo_file.filename} for {name}.", "warning")
+                                continue
                             
                             # Create student photo record
-                            photo = StudentPhoto(filename=photo_path, student_id=student.id)
+                            photo = StudentPhoto(filename=key, student_id=student.id)
                             db.session.add(photo)
                             
                             # Add to images list for embedding
-                            student_images.append(photo_path)
+                            student_images.append(photo_path(key))
                             photo_count += 1
                 
                 print(f"Added {photo_count} photos for student {name}")
@@ -131,6 +130,16 @@ def add_students(class_id):
                 # Create face embedding if we have images and embedder is available
                 if embedder and student_images:
                     try:
+                        # Only the best few distinct, usable photos go on to FaceNet
+                        selected, assessments = select_best_photos(embedder, student_images)
+                        rejected = len(student_images) - len(selected)
+                        if rejected:
+                            print(f"Quality gate kept {len(selected)} of {len(student_images)} photos for {name}")
+                        if not selected:
+                            reasons = sorted({reason for a in assessments.values() for reason in a['reasons']})
+                            flash(f"No usable photos for {name}: {', '.join(reasons)}.", "warning")
+                            continue
+                        student_images = selected
                         print(f"Computing embedding for student {name} from {len(student_images)} images")
                         # Compute average embedding for student
                         embedding = embedder.compute_average_embedding(student_images)
@@ -148,7 +157,9 @@ def add_students(class_id):
         # Save embeddings if we have any
         if embedder and embeddings_dict:
             try:
-                embeddings_file = embedder.save_class_embeddings(current_user.id, class_obj.name, embeddings_dict)
+                # Merge into the existing gallery so earlier students keep their embeddings
+                embeddings_file = update_gallery(class_obj.id, lambda gallery: gallery.update(embeddings_dict),
+                                                 embedder.model_version)
                 flash(f'Face embeddings created and saved to {embeddings_file}', 'success')
                 print(f"Saved embeddings for {len(embeddings_dict)} students to {embeddings_file}")
             except Exception as e:
@@ -176,17 +187,16 @@ def view_class(class_id):
         flash('You do not have permission to view this class')
         return redirect(url_for('classes.list_classes'))
     
-    students = Student.query.filter_by(class_id=class_id).all()
+    # Load photos with the roster so the template does not query per student
+    students = Student.query.options(selectinload(Student.photos)).filter_by(class_id=class_id).all()
+    last_attendance = Student.last_attendance_times(student.id for student in students)
     
-    # Check if face embeddings exist for this class
-    embedder = get_face_embedder()
-    has_embeddings = False
-    if embedder:
-        embeddings_dict = embedder.load_class_embeddings(current_user.id, class_obj.name)
-        has_embeddings = len(embeddings_dict) > 0
+    # Check if face embeddings exist for this class (catalog only, no file access)
+    has_embeddings = has_gallery(class_id)
     
     return render_template('classes/view.html', title=class_obj.name, 
-                          class_obj=class_obj, students=students, has_embeddings=has_embeddings)
+                          class_obj=class_obj, students=students, has_embeddings=has_embeddings,
+                          last_attendance=last_attendance)
 
 @classes.route('/classes/<int:class_id>/attendance')
 @login_required
@@ -200,12 +210,8 @@ def take_attendance(class_id):
     
     students = Student.query.filter_by(class_id=class_id).all()
     
-    # Check if face embeddings exist for this class
-    embedder = get_face_embedder()
-    has_embeddings = False
-    if embedder:
-        embeddings_dict = embedder.load_class_embeddings(current_user.id, class_obj.name)
-        has_embeddings = len(embeddings_dict) > 0
+    # Check if face embeddings exist for this class (catalog only, no file access)
+    has_embeddings = has_gallery(class_id)
     
     if not has_embeddings:
         flash('No face embeddings found for this class. Students need to be added with photos first.')
@@ -1,9 +1,16 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, g
 from flask_login import login_user, current_user, logout_user, login_required
 from app import db
 from app.models import Student, Class, StudentPhoto, Attendance
+from sqlalchemy.orm import joinedload
 from werkzeug.utils import secure_filename
-from app.utils.face_embedder import FaceEmbedder
+from app.utils.face_embedder import get_shared_embedder
+from app.utils.photo_store import store_upload, store_photo, photo_path
+from app.utils.photo_quality import select_best_photos
+from app.utils.attendance_writer import get_attendance_writer
+from app.utils.attendance_submissions import run_idempotent, within_resubmit_window
+from app.utils.gallery_store import load_gallery, update_gallery
+from app.utils.student_tokens import TokenError, issue_tokens, student_auth, verify_refresh_token
 import os
 import uuid
 from datetime import datetime, date, timezone
@@ -12,28 +19,34 @@ import glob
 import pickle
 
 student_api = Blueprint('student_api', __name__)
-face_embedder = FaceEmbedder()
+
+# Loaded on first use, so importing the blueprint (e.g. in spawned pool workers) loads no model
+face_embedder = None
+
+def get_face_embedder():
+    global face_embedder
+    if face_embedder is None:
+        face_embedder = get_shared_embedder()
+    return face_embedder
+
+# Seconds a submission waits for its group-committed attendance write
+ATTENDANCE_WRITE_TIMEOUT = 10
 
 # Helper function to save uploaded images
-def save_student_image(file, student_id, class_id):
+def save_student_image(file):
+    """Normalize and store an uploaded photo; returns its store key"""
     if not file:
         return None
-    
-    # Create directory structure if it doesn't exist
-    student_dir = os.path.join('static', 'uploads', 'student_images', str(class_id), str(student_id))
-    os.makedirs(student_dir, exist_ok=True)
-    
-    # Generate a unique filename
-    original_filename = secure_filename(file.filename)
-    unique_id = str(uuid.uuid4())
-    timestamp = str(int(datetime.now().timestamp() * 1000000000))
-    filename = f"{unique_id}_{timestamp}.jpg"
-    
-    # Save the file
-    file_path = os.path.join(student_dir, filename)
-    file.save(file_path)
-    
-    return filename
+    return store_upload(file)
+
+def parse_landmarks(value):
+    """Decode the landmarks JSON sent with a face crop; None when absent"""
+    if not value:
+        return None
+    try:
+        return json.loads(value)
+    except ValueError:
+        raise ValueError('Invalid landmarks')
 
 # Student registration
 @student_api.route('/register', methods=['POST'])
@@ -90,9 +103,8 @@ def login():
         if not student or not student.check_password(password):
             return jsonify({'success': False, 'message': 'Invalid email or password'}), 401
         
-        # Login successful
-        login_user(student)
-        
+        # Login successful; the app authenticates later requests with the
+        # signed tokens instead of a session cookie
         return jsonify({
             'success': True,
             'message': 'Login successful',
@@ -100,7 +112,32 @@ def login():
             'name': student.name,
             'class_id': student.class_id,
             'class_name': student.class_ref.name,
-            'face_encoding_complete': student.face_encoding_complete
+            'face_encoding_complete': student.face_encoding_complete,
+            **issue_tokens(student)
+        }), 200
+    
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+# Exchange a refresh token for new tokens carrying the student's current class
+@student_api.route('/refresh', methods=['POST'])
+def refresh():
+    try:
+        data = request.get_json(silent=True) or {}
+        refresh_token = data.get('refresh_token')
+        
+        if not refresh_token:
+            return jsonify({'success': False, 'message': 'Missing refresh token'}), 400
+        
+        try:
+            student = verify_refresh_token(refresh_token, Student.query.get)
+        except TokenError:
+            return jsonify({'success': False, 'message': 'Invalid or expired refresh token'}), 401
+        
+        return jsonify({
+            'success': True,
+            'message': 'Token refreshed',
+            **issue_tokens(student)
         }), 200
     
     except Exception as e:
@@ -108,10 +145,11 @@ def login():
 
 # Join class
 @student_api.route('/join_class', methods=['POST'])
+@student_auth
 def join_class():
     try:
         data = request.json
-        student_id = data.get('student_id')
+        student_id = g.student_id or data.get('student_id')
         class_code = data.get('class_code')
         
         if not student_id or not class_code:
@@ -135,46 +173,17 @@ def join_class():
         db.session.commit()
         
         # If student has face encoding completed, transfer embeddings from previous class to new class
-        if student.face_encoding_complete:
+        if student.face_encoding_complete and previous_class_id != class_obj.id:
             try:
-                # Path to embeddings directory
-                embeddings_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'embeddings')
-                
-                # Get all embedding files
-                embedding_files = [f for f in os.listdir(embeddings_dir) if f.endswith('_embeddings.pkl')]
-                
-                # Find embedding for previous class
-                student_embedding = None
-                for file in embedding_files:
-                    filepath = os.path.join(embeddings_dir, file)
-                    with open(filepath, 'rb') as f:
-                        embeddings_dict = pickle.load(f)
-                        # Check if the student ID is in this embedding file
-                        if str(student_id) in embeddings_dict:
-                            student_embedding = embeddings_dict[str(student_id)]
-                            break
-                
-                # If found, add to new class embeddings
+                # Move the student's embedding from the previous class gallery to the new one:
+                # add it to the new gallery first, then remove it from the old one
+                key = str(student_id)
+                student_embedding = load_gallery(previous_class_id).get(key)
                 if student_embedding is not None:
-                    # Get teacher_id and class_name for the new class
-                    teacher_id = str(class_obj.teacher_id)
-                    class_name = class_obj.name
-                    
-                    # Load or create embeddings dict for the new class
-                    new_class_file = f"{teacher_id}_{class_name}_embeddings.pkl"
-                    new_class_path = os.path.join(embeddings_dir, new_class_file)
-                    
-                    new_embeddings_dict = {}
-                    if os.path.exists(new_class_path):
-                        with open(new_class_path, 'rb') as f:
-                            new_embeddings_dict = pickle.load(f)
-                    
-                    # Add student embedding to new class
-                    new_embeddings_dict[str(student_id)] = student_embedding
-                    
-                    # Save updated embeddings
-                    with open(new_class_path, 'wb') as f:
-                        pickle.dump(new_embeddings_dict, f)
+                    model_version = get_face_embedder().model_version
+                    update_gallery(class_obj.id, lambda gallery: gallery.update({key: student_embedding}),
+                                   model_version)
+                    update_gallery(previous_class_id, lambda gallery: gallery.pop(key, None), model_version)
             except Exception as e:
                 # Log error but don't prevent class joining
                 print(f"Error transferring face embeddings: {str(e)}")
@@ -183,7 +192,8 @@ def join_class():
             'success': True, 
             'message': 'Successfully joined class',
             'class_id': class_obj.id,
-            'class_name': class_obj.name
+            'class_name': class_obj.name,
+            **issue_tokens(student)
         }), 200
     
     except Exception as e:
@@ -191,9 +201,10 @@ def join_class():
 
 # Upload student face images
 @student_api.route('/upload_faces', methods=['POST'])
+@student_auth
 def upload_faces():
     try:
-        student_id = request.form.get('student_id')
+        student_id = g.student_id or request.form.get('student_id')
         
         if not student_id:
             return jsonify({'success': False, 'message': 'Missing student ID'}), 400
@@ -203,32 +214,66 @@ def upload_faces():
         if not student:
             return jsonify({'success': False, 'message': 'Student not found'}), 404
         
+        # Face crop mode sends on-device face crops instead of full photos
+        crop_mode = 'face_crops' in request.files
+        field = 'face_crops' if crop_mode else 'images'
+        
         # Check if files are included in the request
-        if 'images' not in request.files:
+        if field not in request.files:
             return jsonify({'success': False, 'message': 'No files uploaded'}), 400
         
-        files = request.files.getlist('images')
+        files = request.files.getlist(field)
         if not files or files[0].filename == '':
             return jsonify({'success': False, 'message': 'No files selected'}), 400
         
+        landmarks = []
+        if crop_mode:
+            try:
+                landmarks = json.loads(request.form.get('landmarks') or '[]')
+            except ValueError:
+                return jsonify({'success': False, 'message': 'Invalid landmarks'}), 400
+        
         # Save images and create database records
         saved_files = []
-        for file in files:
+        existing = {photo.filename for photo in student.photos}
+        for i, file in enumerate(files):
             if file:
-                filename = save_student_image(file, student_id, student.class_id)
+                try:
+                    if crop_mode:
+                        # Detection-only sanity check on the small crop before it is kept;
+                        # it is embedded once, with the other photos, below
+                        crop = file.read()
+                        get_face_embedder().check_face_crop(crop, landmarks[i] if i < len(landmarks) else None)
+                        filename = store_photo(crop)
+                    else:
+                        filename = save_student_image(file)
+                except Exception as e:
+                    return jsonify({'success': False, 'message': f'Invalid image {file.filename}: {str(e)}'}), 400
                 if filename:
-                    # Save file info to database
-                    photo = StudentPhoto(filename=filename, student_id=student_id)
-                    db.session.add(photo)
+                    # Identical photos are stored and recorded once
+                    if filename not in existing:
+                        photo = StudentPhoto(filename=filename, student_id=student_id)
+                        db.session.add(photo)
+                        existing.add(filename)
                     saved_files.append(filename)
         
         # Only commit if we have saved files
         if saved_files:
             db.session.commit()
             
-            # Generate face embeddings for the student
+            # Generate face embeddings for the student from all their stored photos
             try:
-                face_embedder.generate_embeddings_for_student(student_id, student.class_id)
+                # Rows not yet moved by `flask photos migrate` may point at missing files
+                image_files = [path for path in (photo_path(filename) for filename in sorted(existing))
+                               if os.path.exists(path)]
+                # Only the best few distinct, usable photos go on to FaceNet
+                embedder = get_face_embedder()
+                selected, assessments = select_best_photos(embedder, image_files)
+                if not selected:
+                    reasons = sorted({reason for a in assessments.values() for reason in a['reasons']})
+                    raise ValueError(f"No usable photos: {', '.join(reasons)}")
+                image_files = selected
+                embedder.generate_embeddings_for_student(student_id, student.class_id, image_files)
                 student.face_encoding_complete = True
                 db.session.commit()
             except Exception as emb_error:
@@ -253,110 +298,129 @@ def upload_faces():
 
 # Submit attendance via face recognition
 @student_api.route('/submit_attendance', methods=['POST'])
+@student_auth
 def submit_attendance():
+    # Repeated taps carry the same Idempotency-Key and get the first response back
+    student_id = g.student_id or request.form.get('student_id')
+    idempotency_key = request.headers.get('Idempotency-Key') or request.form.get('idempotency_key')
+    if student_id and idempotency_key:
+        return run_idempotent(student_id, idempotency_key, record_attendance)
+    return record_attendance()
+
+# Verify the submitted face and mark the student present for today
+def record_attendance():
     try:
-        student_id = request.form.get('student_id')
-        class_id = request.form.get('class_id')
+        student_id = g.student_id or request.form.get('student_id')
+        class_id = request.form.get('class_id') or g.class_id
         
         if not student_id or not class_id:
             return jsonify({'success': False, 'message': 'Missing required fields'}), 400
         
-        # Check if student and class exist
-        student = Student.query.get(student_id)
-        class_obj = Class.query.get(class_id)
-        if not student or not class_obj:
-            return jsonify({'success': False, 'message': 'Student or class not found'}), 404
-        
-        # Check if the student belongs to the specified class
-        if student.class_id != int(class_id):
-            return jsonify({'success': False, 'message': 'Student is not in this class'}), 403
-        
-        # Check if file is included
-        if 'image' not in request.files:
-            return jsonify({'success': False, 'message': 'No image uploaded'}), 400
-        
-        file = request.files['image']
-        if not file or file.filename == '':
-            return jsonify({'success': False, 'message': 'No image selected'}), 400
-        
-        # Save the image temporarily
-        temp_dir = os.path.join('static', 'uploads', 'temp')
-        os.makedirs(temp_dir, exist_ok=True)
-        temp_filename = f"attendance_{student_id}_{datetime.now().timestamp()}.jpg"
-        temp_path = os.path.join(temp_dir, temp_filename)
-        file.save(temp_path)
-        
-        # Verify the face
-        try:
-            is_match = face_embedder.verify_student_face(temp_path, student_id, class_id)
+        if g.student_id:
+            # The signed token vouches for the student and their class, no lookups needed
+            if g.class_id != int(class_id):
+                return jsonify({'success': False, 'message': 'Student is not in this class'}), 403
+            student_label = f"#{student_id}"
+            class_label = f"#{class_id}"
+        else:
+            # Check if student and class exist
+            student = Student.query.get(student_id)
+            class_obj = Class.query.get(class_id)
+            if not student or not class_obj:
+                return jsonify({'success': False, 'message': 'Student or class not found'}), 404
             
-            # Clean up temporary file
-            if os.path.exists(temp_path):
-                os.remove(temp_path)
+            # Check if the student belongs to the specified class
+            if student.class_id != int(class_id):
+                return jsonify({'success': False, 'message': 'Student is not in this class'}), 403
+            student_label = student.name
+            class_label = class_obj.name
+        
+        # A repeat soon after a verified submission returns the stored result:
+        # no inference and no write. Today's row is the only record every worker
+        # shares, so a teacher marking the student absent is seen at once.
+        today = date.today()
+        current_time = datetime.now(timezone.utc)  # Use UTC time for consistent timestamps
+        existing_attendance = Attendance.query.filter_by(
+            student_id=student_id, 
+            class_id=class_id,
+            date=today
+        ).first()
+        if existing_attendance and existing_attendance.status and \
+                within_resubmit_window(existing_attendance.timestamp, current_time):
+            return jsonify({
+                'success': True,
+                'message': 'Attendance already recorded',
+                'date': today.isoformat(),
+                'timestamp': existing_attendance.timestamp.replace(tzinfo=timezone.utc).isoformat()
+            }), 200
+        
+        # Face crop mode: the app detected the face on-device and sends only the crop
+        if 'face_crop' in request.files:
+            try:
+                embedding = get_face_embedder().embed_face_crop(request.files['face_crop'].read(),
+                                                                parse_landmarks(request.form.get('landmarks')))
+            except Exception as e:
+                return jsonify({'success': False, 'message': f'Invalid face crop: {str(e)}'}), 400
+            file = None
+        else:
+            # Check if file is included
+            if 'image' not in request.files:
+                return jsonify({'success': False, 'message': 'No image uploaded'}), 400
+            
+            file = request.files['image']
+            if not file or file.filename == '':
+                return jsonify({'success': False, 'message': 'No image selected'}), 400
+        
+        # Verify the face straight from the uploaded bytes
+        try:
+            if file is None:
+                is_match = get_face_embedder().verify_student_embedding(embedding, student_id, class_id)
+            else:
+                is_match = get_face_embedder().verify_student_face(file.read(), student_id, class_id)
                 
             if not is_match:
                 return jsonify({'success': False, 'message': 'Face verification failed'}), 401
                 
-            # Check if attendance already exists for today
-            today = date.today()
-            current_time = datetime.now(timezone.utc)  # Use UTC time for consistent timestamps
-            existing_attendance = Attendance.query.filter_by(
-                student_id=student_id, 
-                class_id=class_id,
-                date=today
-            ).first()
+            # Group-committed upsert; the future resolves once the mark is durable
+            created = get_attendance_writer().submit(
+                student_id, class_id, today, current_time  # Store UTC time
+            ).result(timeout=ATTENDANCE_WRITE_TIMEOUT)
             
-            if existing_attendance:
-                existing_attendance.status = True
-                existing_attendance.timestamp = current_time  # Update with UTC time
-                db.session.commit()
-                
-                # Display attendance update in terminal
-                local_time = current_time.replace(tzinfo=timezone.utc).astimezone()
-                formatted_time = local_time.strftime("%Y-%m-%d %H:%M:%S")
-                print(f"\n[ATTENDANCE UPDATED] {formatted_time} - Student: {student.name} (ID: {student_id}) - Class: {class_obj.name}\n")
-                
-                return jsonify({
-                    'success': True,
-                    'message': 'Attendance updated successfully',
-                    'date': today.isoformat(),
-                    'timestamp': current_time.isoformat()
-                }), 200
-            else:
-                # Create new attendance record
-                new_attendance = Attendance(
-                    student_id=student_id,
-                    class_id=class_id,
-                    date=today,
-                    status=True,
-                    timestamp=current_time  # Store UTC time
-                )
-                db.session.add(new_attendance)
-                db.session.commit()
-                
-                # Display attendance marking in terminal
-                local_time = current_time.replace(tzinfo=timezone.utc).astimezone()
-                formatted_time = local_time.strftime("%Y-%m-%d %H:%M:%S")
-                print(f"\n[ATTENDANCE MARKED] {formatted_time} - Student: {student.name} (ID: {student_id}) - Class: {class_obj.name}\n")
-                
-                return jsonify({
-                    'success': True,
-                    'message': 'Attendance recorded successfully',
-                    'date': today.isoformat(),
-                    'timestamp': current_time.isoformat()
-                }), 201
+            # Display attendance marking in terminal
+            local_time = current_time.replace(tzinfo=timezone.utc).astimezone()
+            formatted_time = local_time.strftime("%Y-%m-%d %H:%M:%S")
+            label = 'MARKED' if created else 'UPDATED'
+            print(f"\n[ATTENDANCE {label}] {formatted_time} - Student: {student_label} (ID: {student_id}) - Class: {class_label}\n")
+            
+            return jsonify({
+                'success': True,
+                'message': 'Attendance recorded successfully' if created else 'Attendance updated successfully',
+                'date': today.isoformat(),
+                'timestamp': current_time.isoformat()
+            }), 201 if created else 200
                 
         except Exception as verif_error:
-            # Clean up temporary file if it exists
-            if os.path.exists(temp_path):
-                os.remove(temp_path)
             return jsonify({'success': False, 'message': f'Face verification error: {str(verif_error)}'}), 500
     
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
 
+# Page size limits for attendance history
+HISTORY_DEFAULT_LIMIT = 100
+HISTORY_MAX_LIMIT = 500
+
+def encode_history_cursor(attendance):
+    """Opaque keyset cursor pointing just past the given attendance row"""
+    return f"{attendance.date.isoformat()}_{attendance.id}"
+
+def decode_history_cursor(cursor):
+    """Return (date, id) from a cursor made by encode_history_cursor"""
+    cursor_date, _, cursor_id = cursor.partition('_')
+    return date.fromisoformat(cursor_date), int(cursor_id)
+
 # Get attendance history for a student
 @student_api.route('/attendance_history/<student_id>', methods=['GET'])
+@student_auth
 def attendance_history(student_id):
     try:
         # Check if student exists
@@ -364,8 +428,36 @@ def attendance_history(student_id):
         if not student:
             return jsonify({'success': False, 'message': 'Student not found'}), 404
         
-        # Get all attendance records for the student
-        attendances = Attendance.query.filter_by(student_id=student_id).order_by(Attendance.date.desc()).all()
+        # App builds that predate paging send neither limit nor cursor and expect everything
+        paged = 'limit' in request.args or 'cursor' in request.args
+        limit = request.args.get('limit', HISTORY_DEFAULT_LIMIT, type=int)
+        limit = max(1, min(limit, HISTORY_MAX_LIMIT))
+        
+        # Newest first; id breaks ties between rows on the same date
+        query = Attendance.query.options(joinedload(Attendance.class_ref)).filter_by(
+            student_id=student_id
+        )
+        
+        cursor = request.args.get('cursor')
+        if cursor:
+            try:
+                cursor_date, cursor_id = decode_history_cursor(cursor)
+            except ValueError:
+                return jsonify({'success': False, 'message': 'Invalid cursor'}), 400
+            query = query.filter(db.or_(
+                Attendance.date < cursor_date,
+                db.and_(Attendance.date == cursor_date, Attendance.id < cursor_id)
+            ))
+        
+        query = query.order_by(Attendance.date.desc(), Attendance.id.desc())
+        if paged:
+            # Fetch one extra row to know whether another page exists
+            attendances = query.limit(limit + 1).all()
+            has_more = len(attendances) > limit
+            attendances = attendances[:limit]
+        else:
+            attendances = query.all()
+            has_more = False
         
         # Format the attendance records
         attendance_list = []
@@ -382,7 +474,8 @@ def attendance_history(student_id):
             'success': True,
             'student_id': student_id,
             'student_name': student.name,
-            'attendance': attendance_list
+            'attendance': attendance_list,
+            'next_cursor': encode_history_cursor(attendances[-1]) if has_more else None
         }), 200
     
     except Exception as e:
@@ -390,6 +483,7 @@ def attendance_history(student_id):
 
 # Get student profile
 @student_api.route('/profile/<student_id>', methods=['GET'])
+@student_auth
 def get_profile(student_id):
     try:
         # Check if student exists
@@ -0,0 +1,150 @@
+from flask import g, jsonify, request
+from app.utils.student_tokens import request_student_id
+import logging
+import math
+import threading
+import time
+
+logger = logging.getLogger('attendance-app')
+
+
+class AdmissionLimiter:
+    """
+    Bounded concurrency for one endpoint: at most max_concurrent requests run,
+    at most max_queue more wait up to queue_timeout seconds for a slot, and
+    anything beyond that is rejected immediately.
+    """
+
+    def __init__(self, max_concurrent, max_queue, queue_timeout):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._cond = threading.Condition()
+        self.active = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+
+    def acquire(self):
+        """Take a slot, waiting in the queue if needed; False means reject"""
+        with self._cond:
+            if self.active < self.max_concurrent and self.waiting == 0:
+                self.active += 1
+                self.admitted += 1
+                return True
+            if self.waiting >= self.max_queue:
+                self.rejected += 1
+                return False
+
+            self.waiting += 1
+            deadline = time.monotonic() + self.queue_timeout
+            try:
+                while self.active >= self.max_concurrent:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.timed_out += 1
+                        return False
+                    self._cond.wait(remaining)
+            finally:
+                self.waiting -= 1
+            self.active += 1
+            self.admitted += 1
+            return True
+
+    def release(self):
+        with self._cond:
+            self.active -= 1
+            self._cond.notify()
+
+    def stats(self):
+        with self._cond:
+            return {
+                'active': self.active,
+                'waiting': self.waiting,
+                'max_concurrent': self.max_concurrent,
+                'max_queue': self.max_queue,
+                'admitted': self.admitted,
+                'rejected': self.rejected,
+                'timed_out': self.timed_out,
+            }
+
+
+class RateLimiter:
+    """Token bucket per key: `limit` requests per `period` seconds, with bursts up to `limit`"""
+
+    # Idle buckets are dropped once this many keys are tracked
+    MAX_KEYS = 10000
+
+    def __init__(self, limit, period):
+        self.limit = limit
+        self.period = period
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def hit(self, key):
+        """Consume one token for key; returns 0, or the seconds to wait before retrying"""
+        rate = self.limit / self.period
+        now = time.monotonic()
+        with self._lock:
+            tokens, last = self._buckets.get(key, (self.limit, now))
+            tokens = min(self.limit, tokens + (now - last) * rate)
+            if tokens < 1:
+                self._buckets[key] = (tokens, now)
+                return (1 - tokens) / rate
+            self._buckets[key] = (tokens - 1, now)
+            if len(self._buckets) > self.MAX_KEYS:
+                self._buckets = {k: (t, l) for k, (t, l) in self._buckets.items()
+                                 if t + (now - l) * rate < self.limit}
+            return 0
+
+
+def _overloaded(message, retry_after, status=503):
+    response = jsonify({'success': False, 'message': message})
+    response.status_code = status
+    response.headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+    return response
+
+
+def init_admission_control(app):
+    """
+    Limit concurrent requests to the inference endpoints.
+
+    ADMISSION_LIMITS maps endpoint names to (max_concurrent, max_queue). A
+    request that finds its endpoint's queue full, or waits longer than
+    ADMISSION_QUEUE_TIMEOUT, gets an immediate 503 with Retry-After instead
+    of piling onto the model. Student endpoints are also limited to
+    STUDENT_RATE_LIMIT (requests, seconds) per student_id, answered with 429.
+    Limits are per process.
+    """
+    timeout = app.config.get('ADMISSION_QUEUE_TIMEOUT', 10)
+    limiters = {endpoint: AdmissionLimiter(max_concurrent, max_queue, timeout)
+                for endpoint, (max_concurrent, max_queue) in app.config.get('ADMISSION_LIMITS', {}).items()}
+    student_rate = app.config.get('STUDENT_RATE_LIMIT')
+    rate_limiter = RateLimiter(*student_rate) if student_rate else None
+    app.extensions['admission_limiters'] = limiters
+
+    @app.before_request
+    def admit_request():
+        limiter = limiters.get(request.endpoint)
+        if limiter is None:
+            return None
+
+        if rate_limiter is not None and request.endpoint.startswith('student_api.'):
+            student_id = request_student_id()
+            if student_id:
+                retry_after = rate_limiter.hit(student_id)
+                if retry_after:
+                    return _overloaded('Too many requests, please try again shortly', retry_after, 429)
+
+        if not limiter.acquire():
+            logger.warning(f"Rejected {request.endpoint}: {limiter.active} active, {limiter.waiting} queued")
+            return _overloaded('Server is busy, please try again shortly', limiter.queue_timeout)
+        g.admission_limiter = limiter
+        return None
+
+    @app.teardown_request
+    def release_admission(exc):
+        limiter = g.pop('admission_limiter', None)
+        if limiter is not None:
+            limiter.release()
@@ -0,0 +1,22 @@
+import os
+import tempfile
+
+
+def atomic_write(path, write_fn, mode='wb'):
+    """
+    Write a file through write_fn(f) so readers see either the old or the new
+    contents: the data goes to a uniquely named temp file in the same
+    directory, which then replaces path. Threads and processes may write the
+    same path at once. The temp file is removed when writing or replacing fails.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, mode) as f:
+            write_fn(f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
@@ -0,0 +1,125 @@
+from app import db
+from app.models import Attendance, AttendanceDailySummary, Student
+import os
+import threading
+import time
+
+# Seconds a cached report may be served. Attendance writes in any process invalidate it
+# sooner (see _summary_stamp); the TTL bounds staleness from roster changes alone.
+REPORT_CACHE_TTL = float(os.environ.get('REPORT_CACHE_TTL', 60))
+# Seconds a cached report is served without re-checking its summary stamp, so repeated
+# requests cost no query; writes by other processes show up after at most this long
+REPORT_STAMP_INTERVAL = float(os.environ.get('REPORT_STAMP_INTERVAL', 2))
+
+_report_cache = {}
+_report_cache_lock = threading.Lock()
+
+
+def invalidate_attendance_reports(class_id):
+    """Drop cached reports that include class_id; call after committing an attendance write"""
+    with _report_cache_lock:
+        for key in [key for key in _report_cache if class_id in key[0]]:
+            del _report_cache[key]
+
+
+def _summary_stamp(class_ids, start, end):
+    """
+    (row count, latest updated_at) of the summary rows a report reads. Every
+    attendance write upserts its summary row, so a write by any worker process
+    changes the stamp and the cached report is rebuilt.
+    """
+    return tuple(db.session.query(
+        db.func.count(), db.func.max(AttendanceDailySummary.updated_at)
+    ).filter(
+        AttendanceDailySummary.class_id.in_(class_ids),
+        AttendanceDailySummary.date >= start,
+        AttendanceDailySummary.date <= end
+    ).one())
+
+
+def build_attendance_report(classes, start, end, include_students=False):
+    """
+    Class x date attendance matrix and rates between start and end (inclusive),
+    answered from AttendanceDailySummary in one query. With include_students,
+    per-student present days and rates are added from one grouped query.
+    """
+    class_ids = tuple(sorted(class_obj.id for class_obj in classes))
+    key = (class_ids, start, end, include_students)
+    now = time.monotonic()
+    with _report_cache_lock:
+        cached = _report_cache.get(key)
+    if cached is not None and now - cached[0] < REPORT_CACHE_TTL:
+        built_at, checked_at, stamp, report = cached
+        if now - checked_at < REPORT_STAMP_INTERVAL:
+            return report
+        if _summary_stamp(class_ids, start, end) == stamp:
+            with _report_cache_lock:
+                if _report_cache.get(key) is cached:
+                    _report_cache[key] = (built_at, now, stamp, report)
+            return report
+
+    rows = AttendanceDailySummary.query.filter(
+        AttendanceDailySummary.class_id.in_(class_ids),
+        AttendanceDailySummary.date >= start,
+        AttendanceDailySummary.date <= end
+    ).order_by(AttendanceDailySummary.class_id, AttendanceDailySummary.date).all()
+    # The same stamp _summary_stamp reads, taken from the rows already fetched
+    stamp = (len(rows), max((row.updated_at for row in rows), default=None))
+
+    rows_by_class = {}
+    for row in rows:
+        rows_by_class.setdefault(row.class_id, []).append(row)
+    students_by_class = _student_present_days(class_ids, start, end) if include_students else {}
+
+    report_classes = []
+    for class_obj in sorted(classes, key=lambda c: c.id):
+        class_rows = rows_by_class.get(class_obj.id, [])
+        present = sum(row.present_count for row in class_rows)
+        enrolled = sum(row.enrolled_count for row in class_rows)
+        entry = {
+            'id': class_obj.id,
+            'name': class_obj.name,
+            'sessions': len(class_rows),
+            'daily': {row.date.isoformat(): {'present': row.present_count, 'enrolled': row.enrolled_count}
+                      for row in class_rows},
+            'present_rate': round(present / enrolled, 4) if enrolled else None,
+        }
+        if include_students:
+            sessions = len(class_rows)
+            entry['students'] = [{
+                'id': student_id,
+                'name': name,
+                'present_days': days,
+                'rate': round(days / sessions, 4) if sessions else None,
+            } for student_id, name, days in students_by_class.get(class_obj.id, [])]
+        report_classes.append(entry)
+
+    report = {
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'dates': sorted({row.date.isoformat() for row in rows}),
+        'classes': report_classes,
+    }
+    with _report_cache_lock:
+        _report_cache[key] = (now, now, stamp, report)
+    return report
+
+
+def _student_present_days(class_ids, start, end):
+    """{class_id: [(student id, name, present days)]} for every student of the classes, in one grouped query"""
+    present_days = db.func.sum(db.case((Attendance.status == True, 1), else_=0))
+    rows = db.session.query(
+        Student.class_id, Student.id, Student.name, present_days
+    ).outerjoin(Attendance, db.and_(
+        Attendance.student_id == Student.id,
+        Attendance.class_id == Student.class_id,
+        Attendance.date >= start,
+        Attendance.date <= end
+    )).filter(Student.class_id.in_(class_ids)).group_by(
+        Student.class_id, Student.id, Student.name
+    ).order_by(Student.class_id, Student.name).all()
+
+    students_by_class = {}
+    for class_id, student_id, name, days in rows:
+        students_by_class.setdefault(class_id, []).append((student_id, name, int(days or 0)))
+    return students_by_class
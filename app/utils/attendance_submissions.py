@@ -0,0 +1,117 @@
+from app import db
+from app.models import SubmissionKey
+from datetime import datetime, timedelta, timezone
+from flask import current_app, jsonify
+from sqlalchemy.exc import IntegrityError
+import hashlib
+import os
+import time
+
+# Seconds after a recorded attendance during which repeat submissions are answered
+# from today's attendance row without verification; 0 disables the short-circuit
+ATTENDANCE_RESUBMIT_WINDOW = float(os.environ.get('ATTENDANCE_RESUBMIT_WINDOW', 30 * 60))
+# Seconds a response is kept for replay under its idempotency key
+IDEMPOTENCY_KEY_TTL = float(os.environ.get('IDEMPOTENCY_KEY_TTL', 15 * 60))
+# Seconds a repeat waits for the first submission with the same key to finish
+IDEMPOTENCY_WAIT_TIMEOUT = 30
+# Seconds a claimed key stays taken without a response, in case its worker died
+IDEMPOTENCY_PENDING_TTL = 2 * IDEMPOTENCY_WAIT_TIMEOUT
+# Seconds between checks for the first submission's response
+IDEMPOTENCY_POLL_INTERVAL = 0.05
+
+
+def within_resubmit_window(timestamp, now):
+    """True when attendance recorded at timestamp still covers a submission at now"""
+    if timestamp is None or ATTENDANCE_RESUBMIT_WINDOW <= 0:
+        return False
+    if timestamp.tzinfo is None:
+        # SQLite hands back naive datetimes; they are stored as UTC
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    return 0 <= (now - timestamp).total_seconds() <= ATTENDANCE_RESUBMIT_WINDOW
+
+
+def _claim(scope, now):
+    """Take the key for this submission; False when another submission already holds it"""
+    table = SubmissionKey.__table__
+    db.session.execute(table.delete().where(table.c.expires_at < now))
+    values = {'student_id': scope[0], 'key_hash': scope[1],
+              'expires_at': now + timedelta(seconds=IDEMPOTENCY_PENDING_TTL)}
+    dialect = db.session.get_bind().dialect.name
+    if dialect in ('sqlite', 'postgresql'):
+        if dialect == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert
+        claimed = db.session.execute(insert(table).values(**values).on_conflict_do_nothing()).rowcount > 0
+    else:
+        # Other databases: the primary key turns a second insert into an IntegrityError
+        try:
+            with db.session.begin_nested():
+                db.session.execute(table.insert().values(**values))
+            claimed = True
+        except IntegrityError:
+            claimed = False
+    db.session.commit()
+    return claimed
+
+
+def _release(scope):
+    table = SubmissionKey.__table__
+    db.session.rollback()
+    db.session.execute(table.delete().where((table.c.student_id == scope[0]) & (table.c.key_hash == scope[1])))
+    db.session.commit()
+
+
+def _wait_for_response(scope):
+    """(status, body) stored by the first submission, or None if it failed or did not finish in time"""
+    table = SubmissionKey.__table__
+    query = db.select(table.c.status_code, table.c.response).where(
+        (table.c.student_id == scope[0]) & (table.c.key_hash == scope[1]))
+    deadline = time.monotonic() + IDEMPOTENCY_WAIT_TIMEOUT
+    while True:
+        row = db.session.execute(query).first()
+        db.session.commit()
+        if row is None:
+            return None
+        if row.status_code is not None:
+            return row.status_code, row.response
+        if time.monotonic() >= deadline:
+            return None
+        time.sleep(IDEMPOTENCY_POLL_INTERVAL)
+
+
+def run_idempotent(student_id, key, handler):
+    """
+    Run handler() once per (student, idempotency key) and return its
+    (response, status). Repeats within IDEMPOTENCY_KEY_TTL get the stored
+    response replayed; a repeat arriving while the first is still running
+    waits for it. Keys live in the submission_key table, so a retry that
+    reaches another worker process is replayed too. Server errors are not
+    kept, so those can be retried.
+    """
+    scope = (str(student_id), hashlib.sha256(key.encode('utf-8')).hexdigest())
+    if not _claim(scope, datetime.utcnow()):
+        stored = _wait_for_response(scope)
+        if stored is None:
+            return jsonify({'success': False, 'message': 'Submission is still being processed'}), 409
+        status, data = stored
+        response = current_app.response_class(data, mimetype='application/json')
+        response.headers['Idempotent-Replayed'] = 'true'
+        return response, status
+
+    try:
+        response, status = handler()
+    except Exception:
+        _release(scope)
+        raise
+
+    if status >= 500:
+        _release(scope)
+        return response, status
+    table = SubmissionKey.__table__
+    db.session.execute(table.update().where(
+        (table.c.student_id == scope[0]) & (table.c.key_hash == scope[1])
+    ).values(status_code=status, response=response.get_data(),
+             expires_at=datetime.utcnow() + timedelta(seconds=IDEMPOTENCY_KEY_TTL)))
+    db.session.commit()
+    return response, status
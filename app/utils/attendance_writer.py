@@ -0,0 +1,147 @@
+from app import db
+from app.models import Attendance, AttendanceDailySummary
+from app.utils.attendance_reports import invalidate_attendance_reports
+from concurrent.futures import Future
+from collections import Counter
+from flask import current_app
+from sqlalchemy import inspect
+import logging
+import os
+import queue
+import threading
+import time
+
+logger = logging.getLogger('attendance-app')
+
+
+class AttendanceWriter:
+    """
+    Group commit for attendance marks.
+
+    Concurrent submissions queue their marks; a writer thread gathers them for
+    at most max_wait_ms or until max_batch_size marks are waiting, and writes
+    them with one upsert and one commit. Callers get a Future that resolves
+    after the commit (True when a new row was created, False when an existing
+    row was updated), so an acknowledged mark is durable.
+    """
+
+    def __init__(self, app, max_batch_size=64, max_wait_ms=5.0):
+        self.app = app
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._upsert = None
+
+        # Metrics
+        self.batch_size_counts = Counter()
+        self.total_marks = 0
+        self.total_batches = 0
+        self.failed_batches = 0
+
+    def _ensure_worker(self):
+        """Start the writer thread, restarting it in a forked child"""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            if self._pid != os.getpid():
+                # Threads and queued marks do not survive fork
+                self._queue = queue.Queue()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._worker, name='attendance-writer', daemon=True)
+            self._thread.start()
+
+    def submit(self, student_id, class_id, day, timestamp):
+        """Queue one present mark; returns a Future resolved after it is committed"""
+        self._ensure_worker()
+        future = Future()
+        self._queue.put(((int(student_id), int(class_id), day, timestamp), future))
+        return future
+
+    def _collect_batch(self):
+        """Block for the first mark, then gather more until full or the wait expires"""
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining <= 0:
+                    batch.append(self._queue.get_nowait())
+                else:
+                    batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _has_unique_key(self):
+        # Databases not yet migrated lack the unique index ON CONFLICT needs
+        indexes = inspect(db.engine).get_indexes('attendance')
+        return any(index['unique'] and set(index['column_names']) == {'student_id', 'class_id', 'date'}
+                   for index in indexes)
+
+    def _write(self, marks):
+        """Write marks in one transaction; returns {key: created}"""
+        try:
+            if self._upsert is None:
+                self._upsert = self._has_unique_key()
+            created, newly_present = Attendance.mark_present(marks, upsert=self._upsert)
+            for (class_id, day), count in newly_present.items():
+                AttendanceDailySummary.add_present(class_id, day, count)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        for class_id in {class_id for _, class_id, _, _ in marks}:
+            invalidate_attendance_reports(class_id)
+        return created
+
+    def _worker(self):
+        while True:
+            batch = self._collect_batch()
+            with self.app.app_context():
+                try:
+                    created = self._write([mark for mark, _ in batch])
+                    for (student_id, class_id, day, _), future in batch:
+                        future.set_result(created[(student_id, class_id, day)])
+                except Exception as e:
+                    # One bad mark must not fail the others: retry them one by one
+                    logger.warning(f"Attendance batch of {len(batch)} failed, writing marks singly: {e}")
+                    with self._lock:
+                        self.failed_batches += 1
+                    for mark, future in batch:
+                        try:
+                            future.set_result(self._write([mark])[mark[:3]])
+                        except Exception as mark_error:
+                            future.set_exception(mark_error)
+
+            with self._lock:
+                self.batch_size_counts[len(batch)] += 1
+                self.total_marks += len(batch)
+                self.total_batches += 1
+
+    def stats(self):
+        """Batch-size distribution and totals since startup"""
+        with self._lock:
+            return {
+                'max_batch_size': self.max_batch_size,
+                'max_wait_ms': self.max_wait * 1000.0,
+                'total_marks': self.total_marks,
+                'total_batches': self.total_batches,
+                'failed_batches': self.failed_batches,
+                'mean_batch_size': (self.total_marks / self.total_batches) if self.total_batches else 0.0,
+                'batch_size_counts': dict(sorted(self.batch_size_counts.items())),
+                'queued': self._queue.qsize(),
+            }
+
+
+def init_attendance_writer(app):
+    """Create the app's attendance writer from ATTENDANCE_WRITE_BATCH = (max marks, max wait ms)"""
+    max_batch_size, max_wait_ms = app.config.get('ATTENDANCE_WRITE_BATCH', (64, 5.0))
+    app.extensions['attendance_writer'] = AttendanceWriter(app, max_batch_size, max_wait_ms)
+
+
+def get_attendance_writer():
+    return current_app.extensions['attendance_writer']
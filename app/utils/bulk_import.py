@@ -0,0 +1,143 @@
+from app import db
+from app.models import Teacher, Class, Student, StudentPhoto
+from app.utils.photo_store import store_photo
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import os
+import time
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+
+def scan_tree(root):
+    """
+    Walk a <teacher id>/<class name>/<student name>/*.jpg tree.
+    Returns a list of (teacher_id, class_name, student_name, [image paths]).
+    """
+    entries = []
+    for teacher_dir in sorted(os.listdir(root)):
+        teacher_path = os.path.join(root, teacher_dir)
+        if not teacher_dir.isdigit() or not os.path.isdir(teacher_path):
+            continue
+        for class_name in sorted(os.listdir(teacher_path)):
+            class_path = os.path.join(teacher_path, class_name)
+            if not os.path.isdir(class_path):
+                continue
+            for student_name in sorted(os.listdir(class_path)):
+                student_path = os.path.join(class_path, student_name)
+                if not os.path.isdir(student_path):
+                    continue
+                images = sorted(
+                    os.path.join(student_path, f) for f in os.listdir(student_path)
+                    if f.lower().endswith(IMAGE_EXTENSIONS)
+                )
+                entries.append((int(teacher_dir), class_name, student_name, images))
+    return entries
+
+
+def _ingest_file(path):
+    """Pool task: normalize one photo into the photo store"""
+    try:
+        with open(path, 'rb') as f:
+            return path, store_photo(f.read()), None
+    except Exception as e:
+        return path, None, str(e)
+
+
+def import_tree(root, workers=None, commit_every=200, embed=True, echo=print):
+    """
+    Create Class/Student/StudentPhoto rows for every student folder under
+    root, then rebuild the touched class galleries. Photos are normalized in
+    a process pool and rows are committed in batches of commit_every students.
+    Returns a list of failures, each {'student': '<teacher id>/<class>/<student>',
+    'student_id': id or None, 'photo': file name or None, 'error': message}.
+    """
+    from app.routes.classes import generate_class_code
+
+    start = time.time()
+    entries = scan_tree(root)
+    workers = workers or os.cpu_count() or 1
+    failures = []
+
+    # Normalize and store every photo using all cores
+    all_files = [path for *_, images in entries for path in images]
+    keys = {}
+    photo_errors = {}
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(workers, mp_context=context) as pool:
+        for path, key, error in pool.map(_ingest_file, all_files, chunksize=16):
+            if error:
+                photo_errors[path] = error
+            else:
+                keys[path] = key
+    ingest_time = time.time() - start
+    echo(f"Stored {len(keys)} of {len(all_files)} photos in {ingest_time:.1f}s "
+         f"({len(all_files) / max(ingest_time, 1e-6):.1f} photos/s)")
+
+    # Preload what already exists so reruns do not duplicate rows
+    teacher_ids = {teacher_id for teacher_id, *_ in entries}
+    known_teachers = {t.id for t in Teacher.query.filter(Teacher.id.in_(teacher_ids)).all()}
+    classes = {(c.teacher_id, c.name): c for c in Class.query.filter(Class.teacher_id.in_(teacher_ids)).all()}
+
+    touched_class_ids = set()
+    students_by_class = {}
+    created_students = 0
+    for count, (teacher_id, class_name, student_name, images) in enumerate(entries, 1):
+        label = f"{teacher_id}/{class_name}/{student_name}"
+        if teacher_id not in known_teachers:
+            failures.append(_failure(label, None, None, f"teacher {teacher_id} does not exist"))
+            continue
+
+        class_obj = classes.get((teacher_id, class_name))
+        if class_obj is None:
+            class_obj = Class(name=class_name, teacher_id=teacher_id, class_code=generate_class_code(class_name))
+            db.session.add(class_obj)
+            db.session.flush()
+            classes[(teacher_id, class_name)] = class_obj
+
+        if class_obj.id not in students_by_class:
+            students_by_class[class_obj.id] = {
+                s.name: s for s in Student.query.filter_by(class_id=class_obj.id).all()
+            }
+        student = students_by_class[class_obj.id].get(student_name)
+        if student is None:
+            student = Student(name=student_name, class_id=class_obj.id)
+            db.session.add(student)
+            db.session.flush()
+            students_by_class[class_obj.id][student_name] = student
+            created_students += 1
+
+        for path in images:
+            if path in photo_errors:
+                failures.append(_failure(label, student.id, os.path.basename(path), photo_errors[path]))
+        stored = [keys[path] for path in images if path in keys]
+        if not stored:
+            failures.append(_failure(label, student.id, None, "no readable photos"))
+        existing = {photo.filename for photo in student.photos}
+        for key in stored:
+            if key not in existing:
+                db.session.add(StudentPhoto(filename=key, student_id=student.id))
+                existing.add(key)
+        touched_class_ids.add(class_obj.id)
+
+        if count % commit_every == 0:
+            db.session.commit()
+    db.session.commit()
+    echo(f"Imported {len(entries)} student folders ({created_students} new students) "
+         f"into {len(touched_class_ids)} classes")
+
+    if embed and touched_class_ids:
+        from app.utils.gallery_rebuild import rebuild_galleries
+        rebuild_galleries(sorted(touched_class_ids), workers=workers, restart=True, echo=echo)
+
+    for failure in failures:
+        photo = f" {failure['photo']}" if failure['photo'] else ''
+        echo(f"FAILED {failure['student']}{photo}: {failure['error']}")
+    elapsed = time.time() - start
+    echo(f"Done in {elapsed:.1f}s ({len(entries) / max(elapsed, 1e-6):.1f} students/s), "
+         f"{len({failure['student'] for failure in failures})} with failures")
+    return failures
+
+
+def _failure(label, student_id, photo, error):
+    return {'student': label, 'student_id': student_id, 'photo': photo, 'error': error}
@@ -0,0 +1,74 @@
+from app.utils.atomic_file import atomic_write
+from io import BytesIO
+import hashlib
+import numpy as np
+import os
+import re
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+DEFAULT_CROP_CACHE_DIR = os.environ.get('FACE_CROP_CACHE_DIR', os.path.join(PROJECT_ROOT, 'face_crops'))
+
+# Photo store files are already named by their SHA-256
+_STORE_NAME = re.compile(r'^([0-9a-f]{64})\.jpg$')
+
+
+class FaceCropCache:
+    """
+    On-disk cache of the aligned, resized face crop of each photo.
+
+    Entries are uint8 crops taken before prewhitening, so they stay valid when
+    the FaceNet model changes; only a change of detector settings invalidates
+    them, which is why those settings are part of the directory name.
+    Layout: <root>/<detector_version>/<aa>/<photo sha256>.npz
+    A photo with no usable face is cached too, as an empty crop.
+    """
+
+    def __init__(self, root, detector_version):
+        self.root = root
+        self.detector_version = detector_version
+
+    def photo_key(self, image_path):
+        """Content hash identifying a photo file"""
+        match = _STORE_NAME.match(os.path.basename(image_path))
+        if match:
+            return match.group(1)
+        hasher = hashlib.sha256()
+        with open(image_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                hasher.update(chunk)
+        return hasher.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.root, self.detector_version, key[:2], f"{key}.npz")
+
+    def get(self, key):
+        """Return (crop or None, confidence), or None on a cache miss"""
+        path = self._path(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            with np.load(path) as data:
+                crop = data['crop']
+                confidence = float(data['confidence'])
+        except (OSError, ValueError, KeyError):
+            # Truncated or foreign file; treat as a miss and let it be rewritten
+            return None
+        return (crop if crop.size else None), confidence
+
+    def put(self, key, crop, confidence):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        buffer = BytesIO()
+        np.savez(buffer,
+                 crop=crop if crop is not None else np.zeros((0,), np.uint8),
+                 confidence=np.float32(confidence))
+        atomic_write(path, lambda f: f.write(buffer.getvalue()))
+
+    def load_crops(self, keys):
+        """Return {key: (crop, confidence)} for every cached key; misses are omitted"""
+        results = {}
+        for key in keys:
+            entry = self.get(key)
+            if entry is not None:
+                results[key] = entry
+        return results
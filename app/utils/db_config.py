@@ -0,0 +1,79 @@
+from sqlalchemy import event
+import os
+import logging
+
+logger = logging.getLogger('attendance-app')
+
+DEFAULT_DATABASE_URI = 'sqlite:///../attendance.db'
+
+
+def _env_int(name, default=None):
+    value = os.environ.get(name)
+    if value is None or value == '':
+        return default
+    return int(value)
+
+
+def _env_bool(name, default):
+    value = os.environ.get(name)
+    if value is None or value == '':
+        return default
+    return value.lower() in ('1', 'true', 'yes', 'on')
+
+
+def configure_database(app):
+    """
+    Populate the SQLAlchemy settings on app.config from the environment.
+
+    DATABASE_URL          any SQLAlchemy URI (default: sqlite:///../attendance.db)
+    DB_POOL_SIZE          connections kept open in the pool
+    DB_MAX_OVERFLOW       extra connections allowed above the pool size
+    DB_POOL_TIMEOUT       seconds to wait for a pooled connection
+    DB_POOL_RECYCLE       seconds after which connections are replaced
+    SQLITE_WAL            enable WAL + synchronous=NORMAL for SQLite (default on)
+    SQLITE_BUSY_TIMEOUT   milliseconds SQLite waits on a locked database (default 5000)
+    """
+    uri = os.environ.get('DATABASE_URL', DEFAULT_DATABASE_URI)
+    app.config['SQLALCHEMY_DATABASE_URI'] = uri
+    app.config['SQLITE_WAL'] = _env_bool('SQLITE_WAL', True)
+    app.config['SQLITE_BUSY_TIMEOUT'] = _env_int('SQLITE_BUSY_TIMEOUT', 5000)
+
+    engine_options = {'pool_pre_ping': True}
+    for option, env_name in (('pool_size', 'DB_POOL_SIZE'),
+                             ('max_overflow', 'DB_MAX_OVERFLOW'),
+                             ('pool_timeout', 'DB_POOL_TIMEOUT'),
+                             ('pool_recycle', 'DB_POOL_RECYCLE')):
+        value = _env_int(env_name)
+        if value is not None:
+            engine_options[option] = value
+
+    if uri.startswith('sqlite'):
+        # The driver-level timeout is in seconds; keep it in step with busy_timeout
+        engine_options['connect_args'] = {
+            'timeout': app.config['SQLITE_BUSY_TIMEOUT'] / 1000.0,
+            'check_same_thread': False,
+        }
+
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options
+
+
+def init_sqlite_pragmas(app, engine):
+    """Apply WAL, synchronous and busy_timeout pragmas to every new SQLite connection"""
+    if engine.dialect.name != 'sqlite':
+        return
+
+    use_wal = app.config.get('SQLITE_WAL', True)
+    busy_timeout = app.config.get('SQLITE_BUSY_TIMEOUT', 5000)
+
+    @event.listens_for(engine, 'connect')
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute(f"PRAGMA busy_timeout={int(busy_timeout)}")
+        if use_wal:
+            # WAL lets readers proceed during a write; NORMAL skips the fsync per commit
+            # that FULL requires while staying durable across application crashes
+            cursor.execute("PRAGMA journal_mode=WAL")
+            cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.close()
+
+    logger.info(f"SQLite configured: WAL={'on' if use_wal else 'off'}, busy_timeout={busy_timeout}ms")
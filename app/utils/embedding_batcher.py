@@ -0,0 +1,108 @@
+from concurrent.futures import Future
+from collections import Counter
+import numpy as np
+import os
+import queue
+import threading
+import time
+
+
+class EmbeddingBatcher:
+    """
+    Collects embedding requests from concurrent callers and runs them as a
+    single batched inference call.
+
+    A request waits at most max_wait_ms for other requests to join its batch,
+    and a batch never holds more than max_batch_size faces. Callers get a
+    Future that resolves to their own embedding.
+    """
+
+    def __init__(self, run_batch, max_batch_size=32, max_wait_ms=5.0):
+        self.run_batch = run_batch
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+        # Metrics
+        self.batch_size_counts = Counter()
+        self.total_requests = 0
+        self.total_batches = 0
+
+    def _ensure_worker(self):
+        """Start the worker thread, restarting it in a forked child"""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            if self._pid != os.getpid():
+                # Threads and queued items do not survive fork
+                self._queue = queue.Queue()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._worker, name='embedding-batcher', daemon=True)
+            self._thread.start()
+
+    def submit(self, face_img):
+        """Queue one preprocessed face; returns a Future for its embedding"""
+        self._ensure_worker()
+        future = Future()
+        self._queue.put((face_img, future))
+        return future
+
+    def submit_many(self, face_imgs):
+        """Queue several faces; returns one Future per face"""
+        self._ensure_worker()
+        futures = []
+        for face_img in face_imgs:
+            future = Future()
+            self._queue.put((face_img, future))
+            futures.append(future)
+        return futures
+
+    def _collect_batch(self):
+        """Block for the first request, then gather more until full or the wait expires"""
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining <= 0:
+                    # Still take whatever is already waiting
+                    batch.append(self._queue.get_nowait())
+                else:
+                    batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _worker(self):
+        while True:
+            batch = self._collect_batch()
+            futures = [future for _, future in batch]
+            try:
+                embeddings = self.run_batch(np.stack([face_img for face_img, _ in batch]))
+                for future, embedding in zip(futures, embeddings):
+                    future.set_result(embedding)
+            except Exception as e:
+                for future in futures:
+                    future.set_exception(e)
+
+            with self._lock:
+                self.batch_size_counts[len(batch)] += 1
+                self.total_requests += len(batch)
+                self.total_batches += 1
+
+    def stats(self):
+        """Batch-size distribution and totals since startup"""
+        with self._lock:
+            return {
+                'max_batch_size': self.max_batch_size,
+                'max_wait_ms': self.max_wait * 1000.0,
+                'total_requests': self.total_requests,
+                'total_batches': self.total_batches,
+                'mean_batch_size': (self.total_requests / self.total_batches) if self.total_batches else 0.0,
+                'batch_size_counts': dict(sorted(self.batch_size_counts.items())),
+                'queued': self._queue.qsize(),
+            }
@@ -1,53 +1,141 @@
-import tensorflow as tf
 import numpy as np
 import os
 import cv2
-import pickle
-from mtcnn.mtcnn import MTCNN
-import re
 from PIL import Image
 from io import BytesIO
 import glob
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from app.utils.embedding_batcher import EmbeddingBatcher
+from app.utils.crop_cache import FaceCropCache, DEFAULT_CROP_CACHE_DIR
+from app.utils.result_cache import result_cache_from_env
+from app.utils.tiled_detection import TiledDetector, DETECT_TILE_MIN_FACE, DETECT_TILE_WORKERS
+
+# Shared embedder so every blueprint feeds the same model and batch queue
+_shared_embedder = None
+_shared_embedder_lock = threading.Lock()
+
+def get_shared_embedder():
+    """
+    Return the process-wide FaceEmbedder, creating it on first use.
+    When INFERENCE_SOCKET is set this is a thin client of the inference
+    server instead, and no model is loaded in this process. FACE_EMBEDDER=stub
+    selects the model-free stub used by load tests.
+    """
+    global _shared_embedder
+    if _shared_embedder is None:
+        with _shared_embedder_lock:
+            if _shared_embedder is None:
+                socket_path = os.environ.get('INFERENCE_SOCKET')
+                if os.environ.get('FACE_EMBEDDER') == 'stub':
+                    from app.utils.stub_embedder import stub_embedder_from_env
+                    _shared_embedder = stub_embedder_from_env()
+                elif socket_path:
+                    from app.utils.inference_client import RemoteFaceEmbedder
+                    _shared_embedder = RemoteFaceEmbedder(socket_path)
+                else:
+                    _shared_embedder = FaceEmbedder()
+    return _shared_embedder
 
 class FaceEmbedder:
-    def __init__(self, model_path='20180402-114759'):
+    # Detection and cropping settings; bump when MTCNN parameters, margin or crop size change
+    DETECTOR_VERSION = 'mtcnn-default-margin0.2-160'
+    CROP_MARGIN = 0.2
+    CROP_SIZE = (160, 160)
+    # Bounds for face crops detected on the client (see _client_crop_face)
+    CLIENT_CROP_MIN_SIDE = 96
+    CLIENT_CROP_MAX_SIDE = 320
+    CLIENT_CROP_MIN_FACE_FRACTION = 0.2
+
+    def __init__(self, model_path='20180402-114759', batch_max_size=None, batch_max_wait_ms=None):
         self.model_path = model_path
-        self.detector = MTCNN()
+        self.model_version = os.path.basename(model_path)
+        self._detector = None
+        self._detector_pid = None
+        self._detector_lock = threading.Lock()
         self.facenet_graph = None
         self.session = None
+        self._session_pid = None
+        self._session_lock = threading.Lock()
         self.embeddings_cache = {}
+        self.crop_cache = FaceCropCache(DEFAULT_CROP_CACHE_DIR, self.DETECTOR_VERSION)
+        # Detection/embedding results by content hash, shared by every endpoint
+        self.result_cache = result_cache_from_env()
+        # Group-photo mode: per-thread detectors tuned for small faces
+        self._tile_detectors = threading.local()
+        self.tiled_detector = TiledDetector(self.detect_tile)
         self._load_model()
+        
+        # Cross-request micro-batching; a max batch size of 1 disables it
+        if batch_max_size is None:
+            batch_max_size = int(os.environ.get('EMBED_BATCH_MAX_SIZE', 32))
+        if batch_max_wait_ms is None:
+            batch_max_wait_ms = float(os.environ.get('EMBED_BATCH_MAX_WAIT_MS', 5))
+        self.batcher = None
+        if batch_max_size > 1:
+            self.batcher = EmbeddingBatcher(self._run_embeddings, batch_max_size, batch_max_wait_ms)
 
     def _load_model(self):
         """Load the FaceNet model"""
+        import tensorflow as tf
+        
         self.facenet_graph = tf.Graph()
         with self.facenet_graph.as_default():
-            # TensorFlow 2.12.0 cần cấu hình session rõ ràng hơn
-            config = tf.compat.v1.ConfigProto()
-            config.gpu_options.allow_growth = True
-            self.session = tf.compat.v1.Session(config=config)
-            
-            with self.session.as_default():
-                # Load the model
-                # Fix the path to look in the project root directory instead of the app directory
-                model_path = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 
-                                         self.model_path, '20180402-114759.pb')
-                if not os.path.exists(model_path):
-                    raise FileNotFoundError(f"Model file not found at {model_path}")
-                
-                with tf.io.gfile.GFile(model_path, 'rb') as f:
-                    graph_def = tf.compat.v1.GraphDef()
-                    graph_def.ParseFromString(f.read())
-                    tf.compat.v1.import_graph_def(graph_def, name='')
-                
-                # Get input and output tensors
-                self.images_placeholder = tf.compat.v1.get_default_graph().get_tensor_by_name("input:0")
-                self.embeddings = tf.compat.v1.get_default_graph().get_tensor_by_name("embeddings:0")
-                self.phase_train_placeholder = tf.compat.v1.get_default_graph().get_tensor_by_name("phase_train:0")
-                print("FaceNet model loaded successfully")
+            # Load the model
+            # Fix the path to look in the project root directory instead of the app directory
+            model_path = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 
+                                     self.model_path, '20180402-114759.pb')
+            if not os.path.exists(model_path):
+                raise FileNotFoundError(f"Model file not found at {model_path}")
+            
+            with tf.io.gfile.GFile(model_path, 'rb') as f:
+                graph_def = tf.compat.v1.GraphDef()
+                graph_def.ParseFromString(f.read())
+                tf.compat.v1.import_graph_def(graph_def, name='')
+            
+            # Get input and output tensors
+            self.images_placeholder = self.facenet_graph.get_tensor_by_name("input:0")
+            self.embeddings = self.facenet_graph.get_tensor_by_name("embeddings:0")
+            self.phase_train_placeholder = self.facenet_graph.get_tensor_by_name("phase_train:0")
+            print("FaceNet model loaded successfully")
 
-    def detect_faces(self, image):
-        """Detect faces in an image using MTCNN"""
+    def _get_session(self):
+        """
+        Return the TF session for this process.
+        The graph is shared copy-on-write after fork, but a session owns runtime
+        threads that do not survive fork, so each process opens its own.
+        """
+        if self.session is None or self._session_pid != os.getpid():
+            import tensorflow as tf
+            
+            with self._session_lock:
+                if self.session is None or self._session_pid != os.getpid():
+                    with self.facenet_graph.as_default():
+                        # TensorFlow 2.12.0 cần cấu hình session rõ ràng hơn
+                        config = tf.compat.v1.ConfigProto()
+                        config.gpu_options.allow_growth = True
+                        self.session = tf.compat.v1.Session(config=config)
+                        self._session_pid = os.getpid()
+        return self.session
+
+    @property
+    def detector(self):
+        """
+        The MTCNN detector of this process, created on first use.
+        MTCNN runs on the TensorFlow eager runtime, which does not survive
+        fork, so like the FaceNet session it is never inherited from a parent.
+        """
+        if self._detector is None or self._detector_pid != os.getpid():
+            with self._detector_lock:
+                if self._detector is None or self._detector_pid != os.getpid():
+                    # Imported here so thin inference clients never load TensorFlow
+                    from mtcnn.mtcnn import MTCNN
+                    self._detector = MTCNN()
+                    self._detector_pid = os.getpid()
+        return self._detector
+
+    def load_image(self, image):
+        """Decode a file path, encoded bytes or array into an RGB uint8 array"""
         if isinstance(image, str):
             # Load image from file
             image = cv2.imread(image)
@@ -64,11 +152,41 @@ class FaceEmbedder:
                     image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
         else:
             raise ValueError("Unsupported image format")
+        return image
+
+    def detect_faces_rgb(self, image):
+        """Detect faces in an already-decoded RGB array"""
+        return self.detector.detect_faces(image)
+
+    def detect_faces(self, image):
+        """Detect faces in an image using MTCNN"""
+        image = self.load_image(image)
         
         # Detect faces
         faces = self.detector.detect_faces(image)
         return faces, image
 
+    def detect_tile(self, tile, min_face_size=DETECT_TILE_MIN_FACE):
+        """Detect faces down to min_face_size pixels in one RGB tile of a group photo"""
+        # MTCNN instances are not shared between threads, nor kept across fork
+        if getattr(self._tile_detectors, 'pid', None) != os.getpid():
+            self._tile_detectors.pid = os.getpid()
+            self._tile_detectors.by_min_face = {}
+        detector = self._tile_detectors.by_min_face.get(min_face_size)
+        if detector is None:
+            from mtcnn.mtcnn import MTCNN
+            detector = MTCNN(min_face_size=min_face_size)
+            self._tile_detectors.by_min_face[min_face_size] = detector
+        return detector.detect_faces(tile)
+
+    def detect_faces_group(self, image):
+        """
+        Detect faces in a large group photo on overlapping tiles in parallel.
+        Finds smaller faces than detect_faces and returns the same (faces, image).
+        """
+        image = self.load_image(image)
+        return self.tiled_detector.detect(image), image
+
     def prewhiten(self, img):
         """
         Prewhiten image exactly as in David Sandberg's FaceNet implementation.
@@ -83,17 +201,17 @@ class FaceEmbedder:
         whitened_img = np.multiply(np.subtract(img, mean), 1/std_adj)
         return whitened_img
     
-    def preprocess_face(self, image, face, target_size=(160, 160)):
+    def crop_face(self, image, face, target_size=None):
         """
-        Extract, align and preprocess face for FaceNet embedding.
-        Includes cropping, resizing, and prewhitening.
+        Extract the face with a margin and resize it for FaceNet.
+        Returns a uint8 crop, before any normalization.
         """
+        target_size = target_size or self.CROP_SIZE
         x, y, width, height = face['box']
         x, y = max(x, 0), max(y, 0)  # Ensure non-negative values
         
         # Extract face with a margin for better alignment
-        margin_percent = 0.2  # 20% margin
-        margin = int(min(width, height) * margin_percent)
+        margin = int(min(width, height) * self.CROP_MARGIN)
         x_min = max(0, x - margin)
         y_min = max(0, y - margin)
         x_max = min(image.shape[1], x + width + margin)
@@ -105,8 +223,10 @@ class FaceEmbedder:
         # In a full implementation, we would use the landmarks to align the face
         
         # Resize to target size
-        face_img = cv2.resize(face_img, target_size, interpolation=cv2.INTER_CUBIC)
-        
+        return cv2.resize(face_img, target_size, interpolation=cv2.INTER_CUBIC)
+
+    def whiten_crop(self, face_img):
+        """Turn a uint8 face crop into FaceNet input"""
         # Convert to float32
         face_img = face_img.astype(np.float32)
         
@@ -114,42 +234,75 @@ class FaceEmbedder:
         face_img /= 255.0
         
         # Prewhiten using Sandberg's method
-        face_img = self.prewhiten(face_img)
+        return self.prewhiten(face_img)
+
+    def preprocess_face(self, image, face, target_size=None):
+        """
+        Extract, align and preprocess face for FaceNet embedding.
+        Includes cropping, resizing, and prewhitening.
+        """
+        return self.whiten_crop(self.crop_face(image, face, target_size))
+
+    def best_face_crop(self, image):
+        """
+        Return (uint8 crop, confidence) of the most confident face in a photo,
+        or (None, 0.0) when no face is found. Photo files are looked up in the
+        crop cache first, so a photo is only ever decoded and detected once.
+        """
+        key = None
+        if isinstance(image, str) and self.crop_cache is not None:
+            key = self.crop_cache.photo_key(image)
+            cached = self.crop_cache.get(key)
+            if cached is not None:
+                return cached
         
-        return face_img
+        faces, img = self.detect_faces(image)
+        if faces:
+            face = max(faces, key=lambda x: x['confidence'])
+            result = (self.crop_face(img, face), float(face['confidence']))
+        else:
+            result = (None, 0.0)
+        
+        if key is not None:
+            self.crop_cache.put(key, *result)
+        return result
+
+    def _run_embeddings(self, face_imgs):
+        """Run FaceNet on a stacked batch of preprocessed faces"""
+        session = self._get_session()
+        with self.facenet_graph.as_default():
+            with session.as_default():
+                feed_dict = {self.images_placeholder: face_imgs, self.phase_train_placeholder: False}
+                return session.run(self.embeddings, feed_dict=feed_dict)
+
+    def get_embeddings(self, face_imgs):
+        """Get FaceNet embeddings for a list of preprocessed faces"""
+        if len(face_imgs) == 0:
+            return []
+        if self.batcher is None:
+            return list(self._run_embeddings(np.stack(face_imgs)))
+        # Faces from concurrent requests may share the same session.run
+        futures = self.batcher.submit_many(face_imgs)
+        return [future.result() for future in futures]
 
     def get_embedding(self, face_img):
         """Get face embedding using FaceNet"""
-        with self.facenet_graph.as_default():
-            with self.session.as_default():
-                # Add batch dimension
-                face_img = np.expand_dims(face_img, axis=0)
-                
-                # Get embedding
-                feed_dict = {self.images_placeholder: face_img, self.phase_train_placeholder: False}
-                embedding = self.session.run(self.embeddings, feed_dict=feed_dict)
-                
-                # Return the flattened embedding
-                return embedding[0]
+        if self.batcher is None:
+            # Add batch dimension and return the flattened embedding
+            return self._run_embeddings(np.expand_dims(face_img, axis=0))[0]
+        return self.batcher.submit(face_img).result()
+
+    def batching_stats(self):
+        """Batch-size distribution of the micro-batcher, or None when disabled"""
+        return self.batcher.stats() if self.batcher else None
 
     def compute_average_embedding(self, images):
         """
         Compute average embedding from multiple face images.
         Multiple images improve recognition accuracy.
         """
-        embeddings = []
-        
-        for image in images:
-            faces, img = self.detect_faces(image)
-            
-            if not faces:
-                continue
-                
-            # Use the face with the highest confidence
-            face = max(faces, key=lambda x: x['confidence'])
-            face_img = self.preprocess_face(img, face)
-            embedding = self.get_embedding(face_img)
-            embeddings.append(embedding)
+        # Embeddings of the most confident face in each photo
+        embeddings = self.photo_embeddings(images)
             
         if not embeddings:
             return None
@@ -166,53 +319,122 @@ class FaceEmbedder:
         Compute embeddings for a student from multiple images.
         Returns a list of embeddings for each valid face detected.
         """
-        embeddings = []
-        
-        for image in images:
-            faces, img = self.detect_faces(image)
-            
-            if not faces:
-                continue
-                
-            # Get the face with the highest confidence
-            face = max(faces, key=lambda x: x['confidence'])
-            if face['confidence'] < 0.9:  # Skip low confidence faces
-                continue
-                
-            # Preprocess and get embedding
-            face_img = self.preprocess_face(img, face)
-            embedding = self.get_embedding(face_img)
-            
-            # Normalize embedding to unit length
-            embedding = embedding / np.linalg.norm(embedding)
-            embeddings.append(embedding)
-            
-        return embeddings
+        # Skip low confidence faces and normalize to unit length
+        embeddings = self.photo_embeddings(images, min_confidence=0.9)
+        return [embedding / np.linalg.norm(embedding) for embedding in embeddings]
 
-    def save_class_embeddings(self, teacher_id, class_name, embeddings_dict):
-        """Save embeddings for a class to a pickle file"""
-        embeddings_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'embeddings')
-        os.makedirs(embeddings_dir, exist_ok=True)
+    def photo_embeddings(self, images, min_confidence=0.0):
+        """
+        Embed the most confident face of each photo, in one batch.
+        Photos whose best face is missing or below min_confidence are skipped.
+        Results for photo files are kept in the result cache by content hash.
+        """
+        results = [None] * len(images)
+        keys = [None] * len(images)
+        to_embed = []
         
-        filename = f"{teacher_id}_{class_name}_embeddings.pkl"
-        filepath = os.path.join(embeddings_dir, filename)
+        for i, image in enumerate(images):
+            if isinstance(image, str) and self.result_cache is not None and self.crop_cache is not None:
+                keys[i] = self.result_cache.make_key('photo', self.crop_cache.photo_key(image),
+                                                     self.model_version, self.DETECTOR_VERSION)
+                results[i] = self.result_cache.get(keys[i])
+                if results[i] is not None:
+                    continue
+            crop, confidence = self.best_face_crop(image)
+            if crop is None:
+                results[i] = (None, confidence)
+            else:
+                to_embed.append((i, crop, confidence))
         
-        with open(filepath, 'wb') as f:
-            pickle.dump(embeddings_dict, f)
-            
-        return filepath
+        # Embed all newly detected faces in one batch
+        embeddings = self.get_embeddings([self.whiten_crop(crop) for _, crop, _ in to_embed])
+        for (i, _, confidence), embedding in zip(to_embed, embeddings):
+            results[i] = (embedding, confidence)
+        
+        for key, result in zip(keys, results):
+            if key is not None:
+                self.result_cache.put(key, result)
+        
+        return [embedding for embedding, confidence in results
+                if embedding is not None and confidence >= min_confidence]
+
+    def detect_and_embed(self, image, group=False):
+        """
+        Detect every face in an image and embed each one.
+        With group=True large photos are detected tile by tile (see detect_faces_group).
+        Returns (faces, embeddings). Identical image bytes are answered from
+        the result cache without decoding; treat the results as read-only.
+        """
+        return self.detect_and_embed_many([image], group)[0]
 
-    def load_class_embeddings(self, teacher_id, class_name):
-        """Load embeddings for a class from a pickle file"""
-        embeddings_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'embeddings')
-        filename = f"{teacher_id}_{class_name}_embeddings.pkl"
-        filepath = os.path.join(embeddings_dir, filename)
+    def detect_and_embed_many(self, images, group=False):
+        """
+        detect_and_embed for several images: cache misses are decoded and
+        detected concurrently and all their faces are embedded in one batch.
+        Returns one (faces, embeddings) pair per image, in order.
+        """
+        images = list(images)
+        results = [None] * len(images)
+        keys = [None] * len(images)
         
-        if os.path.exists(filepath):
-            with open(filepath, 'rb') as f:
-                return pickle.load(f)
+        for i, image in enumerate(images):
+            if isinstance(image, str):
+                with open(image, 'rb') as f:
+                    images[i] = image = f.read()
+            if isinstance(image, bytes) and self.result_cache is not None:
+                namespace = f"image-{self.tiled_detector.settings}" if group else 'image'
+                keys[i] = self.result_cache.make_key(namespace, self.result_cache.digest(image),
+                                                     self.model_version, self.DETECTOR_VERSION)
+                results[i] = self.result_cache.get(keys[i])
         
-        return {}
+        # The same photo sent twice in one request is only processed once
+        misses = {}
+        for i, result in enumerate(results):
+            if result is None:
+                misses.setdefault(keys[i] if keys[i] is not None else i, []).append(i)
+        if misses:
+            firsts = [indices[0] for indices in misses.values()]
+            computed = self._detect_and_embed_many([images[i] for i in firsts], group)
+            for indices, result in zip(misses.values(), computed):
+                for i in indices:
+                    results[i] = result
+                if keys[indices[0]] is not None:
+                    self.result_cache.put(keys[indices[0]], result)
+        return results
+
+    # Threads for decoding and detecting several images of one request
+    _image_pool = None
+    _image_pool_pid = None
+    _image_pool_lock = threading.Lock()
+
+    def _map_images(self, fn, images):
+        if len(images) == 1:
+            return [fn(images[0])]
+        with self._image_pool_lock:
+            # Threads do not survive fork, so each worker process gets its own pool
+            if FaceEmbedder._image_pool is None or FaceEmbedder._image_pool_pid != os.getpid():
+                FaceEmbedder._image_pool = ThreadPoolExecutor(DETECT_TILE_WORKERS, thread_name_prefix='face-image')
+                FaceEmbedder._image_pool_pid = os.getpid()
+        return list(FaceEmbedder._image_pool.map(fn, images))
+
+    def _detect_and_embed_many(self, images, group=False):
+        detect = self.detect_faces_group if group else self.detect_faces
+        detections = self._map_images(detect, images)
+        
+        # Embed the faces of every image in one batch, then split them back per image
+        face_imgs = [self.preprocess_face(img, face) for faces, img in detections for face in faces]
+        embeddings = list(self.get_embeddings(face_imgs))
+        results = []
+        offset = 0
+        for faces, _ in detections:
+            results.append((faces, embeddings[offset:offset + len(faces)]))
+            offset += len(faces)
+        return results
+
+    def embed_crops(self, crops):
+        """Embed cached uint8 crops in one batch; returns unit-length embeddings"""
+        embeddings = self.get_embeddings([self.whiten_crop(crop) for crop in crops])
+        return [embedding / np.linalg.norm(embedding) for embedding in embeddings]
 
     def compare_faces(self, embedding, embeddings_dict, threshold=0.6):
         """Compare a face embedding with stored embeddings and return the best match"""
@@ -229,29 +451,28 @@ class FaceEmbedder:
                 
         return best_match, best_similarity
 
-    def process_attendance_image(self, teacher_id, class_name, image):
-        """Process an attendance image and return recognized students"""
+    def process_attendance_image(self, class_id, image, group=False):
+        """
+        Process an attendance image and return recognized students.
+        Set group for large classroom photos with many small faces.
+        """
+        from app.utils.gallery_store import load_gallery
+        
         # Load class embeddings
-        embeddings_dict = self.load_class_embeddings(teacher_id, class_name)
+        embeddings_dict = load_gallery(class_id)
         
         if not embeddings_dict:
             return [], "No embeddings found for this class."
             
-        # Detect faces
-        faces, img = self.detect_faces(image)
+        # Detect and embed every face in one batch
+        faces, embeddings = self.detect_and_embed(image, group)
         
         if not faces:
             return [], "No faces detected in the image."
             
         results = []
         
-        for i, face in enumerate(faces):
-            # Preprocess face
-            face_img = self.preprocess_face(img, face)
-            
-            # Get embedding
-            embedding = self.get_embedding(face_img)
-            
+        for i, (face, embedding) in enumerate(zip(faces, embeddings)):
             # Normalize embedding to unit length for cosine similarity
             embedding = embedding / np.linalg.norm(embedding)
             
@@ -269,12 +490,69 @@ class FaceEmbedder:
             
         return results, "Attendance processed successfully."
     
-    def verify_student_face(self, image_path, student_id, class_id):
+    def _client_crop_face(self, size, faces, landmarks=None):
+        """
+        Sanity checks for a face crop detected on the client device: it must
+        hold one confident face filling most of the crop, and the client's eye
+        landmarks (crop pixels, {"eyes": [[x, y], [x, y]]}) must agree with
+        MTCNN's. Returns the index of that face; raises ValueError otherwise.
+        """
+        width, height = size
+        if not faces:
+            raise ValueError("No face found in the face crop")
+        best = max(range(len(faces)), key=lambda i: faces[i]['confidence'])
+        face = faces[best]
+        if face['confidence'] < 0.9:
+            raise ValueError(f"Face detection confidence {face['confidence']:.2f} is below 0.9")
+        _, _, w, h = face['box']
+        if w * h < self.CLIENT_CROP_MIN_FACE_FRACTION * width * height:
+            raise ValueError(f"Face covers {w * h / (width * height):.0%} of the face crop; "
+                             f"it must cover at least {self.CLIENT_CROP_MIN_FACE_FRACTION:.0%}")
+        
+        eyes = (landmarks or {}).get('eyes')
+        if eyes:
+            # Compare eyes in left-to-right image order, whichever naming the client uses
+            client_eyes = sorted((float(x), float(y)) for x, y in eyes)
+            detected_eyes = sorted([face['keypoints']['left_eye'], face['keypoints']['right_eye']])
+            eye_distance = max(1.0, float(np.hypot(*np.subtract(detected_eyes[1], detected_eyes[0]))))
+            for client_eye, detected_eye in zip(client_eyes, detected_eyes):
+                if np.hypot(*np.subtract(client_eye, detected_eye)) > 0.5 * eye_distance:
+                    raise ValueError("Face landmarks do not match the face crop")
+        return best
+
+    def _client_crop_size(self, crop):
+        """(width, height) of a client face crop, read from its header; raises ValueError when out of bounds"""
+        width, height = Image.open(BytesIO(crop)).size
+        if min(width, height) < self.CLIENT_CROP_MIN_SIDE or max(width, height) > self.CLIENT_CROP_MAX_SIDE:
+            raise ValueError(f"Face crop must be {self.CLIENT_CROP_MIN_SIDE}-{self.CLIENT_CROP_MAX_SIDE} pixels, got {width}x{height}")
+        return width, height
+
+    def check_face_crop(self, crop, landmarks=None):
+        """
+        Validate a client face crop with detection only, no FaceNet.
+        For crops that are stored rather than matched (enrollment uploads).
+        Raises ValueError for an unusable crop.
+        """
+        size = self._client_crop_size(crop)
+        faces, _ = self.detect_faces(crop)
+        self._client_crop_face(size, faces, landmarks)
+
+    def embed_face_crop(self, crop, landmarks=None):
+        """
+        Embed a face crop detected on the client device.
+        The crop is small, so the sanity re-detect is cheap (see _client_crop_face).
+        Returns the raw embedding; raises ValueError for an unusable crop.
+        """
+        size = self._client_crop_size(crop)
+        faces, embeddings = self.detect_and_embed(crop)
+        return embeddings[self._client_crop_face(size, faces, landmarks)]
+
+    def verify_student_face(self, image, student_id, class_id):
         """
         Verify if the face in the image matches the stored face embeddings of the student.
         
         Args:
-            image_path: Path to the image file containing the student's face
+            image: Path to the image file, or the raw image bytes
             student_id: ID of the student to verify
             class_id: ID of the class the student belongs to
             
@@ -283,42 +561,35 @@ class FaceEmbedder:
         """
         try:
             # Load the image
-            if not os.path.exists(image_path):
-                raise FileNotFoundError(f"Image file not found at {image_path}")
+            if isinstance(image, str) and not os.path.exists(image):
+                raise FileNotFoundError(f"Image file not found at {image}")
             
-            # Detect faces in the image
-            faces, img = self.detect_faces(image_path)
+            # Detect and embed faces (repeat submissions come from the result cache)
+            faces, embeddings = self.detect_and_embed(image)
             
             if not faces:
                 raise ValueError("No faces detected in the image")
             
             # Get the face with highest confidence
-            face = max(faces, key=lambda x: x['confidence'])
-            
-            if face['confidence'] < 0.9:
-                raise ValueError(f"Face detection confidence too low: {face['confidence']}")
+            best = max(range(len(faces)), key=lambda i: faces[i]['confidence'])
             
-            # Preprocess and get embedding for the submitted face
-            face_img = self.preprocess_face(img, face)
-            submission_embedding = self.get_embedding(face_img)
+            if faces[best]['confidence'] < 0.9:
+                raise ValueError(f"Face detection confidence too low: {faces[best]['confidence']}")
             
+        except Exception as e:
+            raise Exception(f"Face verification failed: {str(e)}")
+        
+        return self.verify_student_embedding(embeddings[best], student_id, class_id)
+
+    def verify_student_embedding(self, submission_embedding, student_id, class_id):
+        """Verify an already computed face embedding against the student's stored embedding"""
+        try:
             # Normalize embedding to unit length for cosine similarity
             submission_embedding = submission_embedding / np.linalg.norm(submission_embedding)
             
-            # Load embeddings for the class
-            embeddings_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'embeddings')
-            # Find the appropriate embedding file for the class
-            embedding_files = [f for f in os.listdir(embeddings_dir) if f.endswith('_embeddings.pkl')]
-            
-            student_embedding = None
-            for file in embedding_files:
-                filepath = os.path.join(embeddings_dir, file)
-                with open(filepath, 'rb') as f:
-                    embeddings_dict = pickle.load(f)
-                    # Check if the student ID is in this embedding file
-                    if str(student_id) in embeddings_dict:
-                        student_embedding = embeddings_dict[str(student_id)]
-                        break
+            # Load the gallery of the class from the catalog
+            from app.utils.gallery_store import load_gallery
+            student_embedding = load_gallery(class_id).get(str(student_id))
             
             if student_embedding is None:
                 raise ValueError(f"No face embeddings found for student ID: {student_id}")
@@ -335,30 +606,33 @@ class FaceEmbedder:
         except Exception as e:
             raise Exception(f"Face verification failed: {str(e)}")
 
-    def generate_embeddings_for_student(self, student_id, class_id):
+    def generate_embeddings_for_student(self, student_id, class_id, image_files=None):
         """
         Generate face embeddings for a student from their uploaded photos.
-        Updates the class embeddings file with the student's embeddings.
+        Updates the class gallery with the student's embedding.
         
         Args:
             student_id: ID of the student
             class_id: ID of the class the student belongs to
+            image_files: Paths of the student's photos; defaults to the legacy
+                static/uploads/student_images/<class>/<student> directory
             
         Returns:
             bool: True if embeddings were generated successfully
         """
         try:
-            # Get paths to student images
-            student_dir = os.path.join(
-                os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
-                'static', 'uploads', 'student_images', str(class_id), str(student_id)
-            )
-            
-            if not os.path.exists(student_dir):
-                raise FileNotFoundError(f"No images directory found for student {student_id}")
+            if image_files is None:
+                # Get paths to student images
+                student_dir = os.path.join(
+                    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+                    'static', 'uploads', 'student_images', str(class_id), str(student_id)
+                )
                 
-            # Get all image files for the student
-            image_files = glob.glob(os.path.join(student_dir, '*.jpg'))
+                if not os.path.exists(student_dir):
+                    raise FileNotFoundError(f"No images directory found for student {student_id}")
+                    
+                # Get all image files for the student
+                image_files = glob.glob(os.path.join(student_dir, '*.jpg'))
             if not image_files:
                 raise ValueError(f"No image files found for student {student_id}")
                 
@@ -373,64 +647,11 @@ class FaceEmbedder:
             # Normalize the average embedding
             avg_embedding = avg_embedding / np.linalg.norm(avg_embedding)
             
-            # Find the class embedding file from any teacher
-            embeddings_dir = os.path.join(
-                os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 
-                'embeddings'
-            )
-            os.makedirs(embeddings_dir, exist_ok=True)
-            
-            # Look for appropriate class embedding file
-            embedding_files = [f for f in os.listdir(embeddings_dir) if f.endswith('_embeddings.pkl')]
-            
-            # Check if there's a file for this class
-            class_embedding_file = None
-            teacher_id = None
-            class_name = None
-            
-            for file in embedding_files:
-                # Extract class_id if it's in the file name
-                if f"_{class_id}_" in file or file.startswith(f"{class_id}_"):
-                    class_embedding_file = file
-                    parts = re.match(r"(\d+)_(.+)_embeddings\.pkl", file)
-                    if parts:
-                        teacher_id = parts.group(1)
-                        class_name = parts.group(2)
-                    break
-            
-            # If no file exists for this class yet, we need to create one
-            # This requires knowing the teacher_id and class_name
-            if not class_embedding_file:
-                # Try to infer teacher_id and class_name from other files
-                # Assumption: first part of filename is teacher_id
-                if embedding_files:
-                    parts = re.match(r"(\d+)_.+", embedding_files[0])
-                    if parts:
-                        teacher_id = parts.group(1)
-                        # Use class_id as the class_name if we can't determine it
-                        class_name = str(class_id)
-                else:
-                    # Default values if no other info is available
-                    teacher_id = "1"  # Assuming default teacher id
-                    class_name = str(class_id)
-                
-                class_embedding_file = f"{teacher_id}_{class_name}_embeddings.pkl"
-            
-            # Full path to the embedding file
-            filepath = os.path.join(embeddings_dir, class_embedding_file)
-            
-            # Load existing embeddings or create new dict
-            embeddings_dict = {}
-            if os.path.exists(filepath):
-                with open(filepath, 'rb') as f:
-                    embeddings_dict = pickle.load(f)
-            
-            # Add or update the student's embedding
-            embeddings_dict[str(student_id)] = avg_embedding
-            
-            # Save the updated embeddings
-            with open(filepath, 'wb') as f:
-                pickle.dump(embeddings_dict, f)
+            # Add or update the student's embedding in the class gallery; concurrent
+            # enrollments in the same class are retried rather than overwritten
+            from app.utils.gallery_store import update_gallery
+            update_gallery(class_id, lambda gallery: gallery.update({str(student_id): avg_embedding}),
+                           self.model_version)
             
             return True
             
@@ -0,0 +1,217 @@
+from app import db
+from app.models import Class, Student
+from app.utils.atomic_file import atomic_write
+from app.utils.crop_cache import FaceCropCache, DEFAULT_CROP_CACHE_DIR
+from app.utils.face_embedder import FaceEmbedder, get_shared_embedder
+from app.utils.photo_store import photo_path
+from app.utils.gallery_store import (EMBEDDINGS_DIR, GalleryConflict, get_gallery_entry, load_gallery_version,
+                                     save_gallery, update_gallery)
+from sqlalchemy.orm import selectinload
+import multiprocessing
+import numpy as np
+import json
+import os
+import threading
+import time
+
+CHECKPOINT_PATH = os.path.join(EMBEDDINGS_DIR, 'rebuild_checkpoint.json')
+MIN_CONFIDENCE = 0.9  # Same bar as FaceEmbedder.compute_embeddings_for_student
+
+
+class DetectionWorker(FaceEmbedder):
+    """FaceEmbedder with only MTCNN and the crop cache, for pool processes"""
+
+    def __init__(self):
+        self._detector = None
+        self._detector_pid = None
+        self._detector_lock = threading.Lock()
+        self.crop_cache = FaceCropCache(DEFAULT_CROP_CACHE_DIR, self.DETECTOR_VERSION)
+        self.batcher = None
+
+
+_worker = None
+
+
+def _init_worker():
+    global _worker
+    _worker = DetectionWorker()
+
+
+def _detect_crop(task):
+    """Pool task: decode and detect one photo, returning its best crop"""
+    student_id, path = task
+    try:
+        crop, confidence = _worker.best_face_crop(path)
+        return student_id, path, crop, confidence, None
+    except Exception as e:
+        return student_id, path, None, 0.0, str(e)
+
+
+def gallery_key(student):
+    """
+    Key a student's embedding the way their enrollment path does:
+    teacher-added students by name (/api/recognize), app-registered
+    students by id (submit_attendance verification).
+    """
+    return student.name if student.email is None else str(student.id)
+
+
+def load_checkpoint(model_version):
+    if os.path.exists(CHECKPOINT_PATH):
+        with open(CHECKPOINT_PATH) as f:
+            checkpoint = json.load(f)
+        if checkpoint.get('model_version') == model_version:
+            return checkpoint
+    return {'model_version': model_version, 'completed_class_ids': []}
+
+
+def save_checkpoint(checkpoint):
+    os.makedirs(os.path.dirname(CHECKPOINT_PATH), exist_ok=True)
+    atomic_write(CHECKPOINT_PATH, lambda f: json.dump(checkpoint, f), mode='w')
+
+
+def rebuild_class(class_obj, embedder, pool, batch_size):
+    """
+    Recompute and atomically replace one class gallery; returns (students in
+    the gallery, failures). Students whose photos are missing or unusable keep
+    their previous embedding, or lose face_encoding_complete when there is none.
+    Enrollments and class changes saved while the rebuild runs are merged in,
+    not overwritten.
+    """
+    # The gallery as it was before embedding; later saves are detected against its version
+    version, snapshot = load_gallery_version(class_obj.id)
+    students = Student.query.options(selectinload(Student.photos)).filter_by(class_id=class_obj.id).all()
+    students_by_id = {student.id: student for student in students}
+
+    tasks = []
+    failures = []
+    for student in students:
+        for photo in student.photos:
+            path = photo_path(photo.filename)
+            if os.path.exists(path):
+                tasks.append((student.id, path))
+            else:
+                failures.append(f"{student.name}: missing photo {photo.filename}")
+
+    # Decode and detect in the pool; embed in batches here as crops arrive
+    crops_by_student = {}
+    pending_crops, pending_ids = [], []
+
+    def flush():
+        for student_id, embedding in zip(pending_ids, embedder.embed_crops(pending_crops)):
+            crops_by_student.setdefault(student_id, []).append(embedding)
+        pending_crops.clear()
+        pending_ids.clear()
+
+    for student_id, path, crop, confidence, error in pool.imap_unordered(_detect_crop, tasks, chunksize=4):
+        if error:
+            failures.append(f"{students_by_id[student_id].name}: {path}: {error}")
+            continue
+        if crop is None or confidence < MIN_CONFIDENCE:
+            continue
+        pending_crops.append(crop)
+        pending_ids.append(student_id)
+        if len(pending_crops) >= batch_size:
+            flush()
+    if pending_crops:
+        flush()
+
+    # Students without a usable photo now keep the embedding they already had,
+    # unless it came from another model and cannot be compared with the new ones
+    entry = get_gallery_entry(class_obj.id)
+    same_model = entry is not None and entry.model_version in (None, embedder.model_version)
+    previous = snapshot if same_model else {}
+
+    gallery = {}
+    for student in students:
+        embeddings = crops_by_student.get(student.id)
+        if not embeddings:
+            key = gallery_key(student)
+            if key in previous:
+                gallery[key] = previous[key]
+                failures.append(f"{student.name}: no usable face in {len(student.photos)} photos, "
+                                f"kept previous embedding")
+            elif student.face_encoding_complete or student.photos:
+                # Without an embedding they cannot be verified; they need to re-enroll
+                student.face_encoding_complete = False
+                failures.append(f"{student.name}: no usable face in {len(student.photos)} photos, "
+                                f"no embedding; marked for re-enrollment")
+            continue
+        avg_embedding = np.mean(embeddings, axis=0)
+        gallery[gallery_key(student)] = avg_embedding / np.linalg.norm(avg_embedding)
+        student.face_encoding_complete = True
+
+    try:
+        save_gallery(class_obj.id, gallery, embedder.model_version, expected_version=version)
+        return len(gallery), failures
+    except GalleryConflict:
+        pass
+
+    merged = {}
+
+    def merge(current):
+        # Entries added or changed since the snapshot win; entries removed since stay removed
+        saved_since = {key: value for key, value in current.items()
+                       if key not in snapshot or not np.array_equal(value, snapshot[key])}
+        rebuilt = {key: value for key, value in gallery.items() if key not in snapshot or key in current}
+        current.clear()
+        current.update(rebuilt)
+        current.update(saved_since)
+        merged.clear()
+        merged.update(current)
+
+    update_gallery(class_obj.id, merge, embedder.model_version)
+    # Students who enrolled during the rebuild have an embedding again
+    for student in students:
+        if gallery_key(student) in merged and not student.face_encoding_complete:
+            student.face_encoding_complete = True
+    db.session.commit()
+    failures.append("gallery was saved during the rebuild; kept the entries saved meanwhile")
+    return len(merged), failures
+
+
+def rebuild_galleries(class_ids=None, workers=None, batch_size=64, restart=False, echo=print):
+    """
+    Rebuild class galleries from StudentPhoto rows.
+
+    Photos are decoded and detected by a process pool (results land in the
+    crop cache), embedded in batches in this process, and each class gallery
+    is swapped in atomically when complete. Finished classes are recorded in
+    a checkpoint, so rerunning after an interruption resumes where it stopped.
+    """
+    embedder = get_shared_embedder()
+    checkpoint = {'model_version': embedder.model_version, 'completed_class_ids': []}
+    if not restart:
+        checkpoint = load_checkpoint(embedder.model_version)
+    completed = set(checkpoint['completed_class_ids'])
+
+    query = Class.query.order_by(Class.id)
+    if class_ids:
+        query = query.filter(Class.id.in_(class_ids))
+    classes = [class_obj for class_obj in query.all() if class_obj.id not in completed]
+    if completed:
+        echo(f"Resuming: {len(completed)} classes already rebuilt with model {embedder.model_version}")
+
+    workers = workers or os.cpu_count() or 1
+    # spawn: TensorFlow state does not survive fork
+    context = multiprocessing.get_context('spawn')
+    start = time.time()
+    total_students = 0
+    with context.Pool(workers, initializer=_init_worker) as pool:
+        for class_obj in classes:
+            class_start = time.time()
+            count, failures = rebuild_class(class_obj, embedder, pool, batch_size)
+            total_students += count
+            for failure in failures:
+                echo(f"  [{class_obj.name}] {failure}")
+            echo(f"Rebuilt class {class_obj.id} '{class_obj.name}': {count} students "
+                 f"in {time.time() - class_start:.1f}s")
+
+            checkpoint['completed_class_ids'].append(class_obj.id)
+            save_checkpoint(checkpoint)
+
+    # Everything finished; the next run starts fresh
+    if os.path.exists(CHECKPOINT_PATH):
+        os.remove(CHECKPOINT_PATH)
+    echo(f"Rebuilt {len(classes)} classes, {total_students} students in {time.time() - start:.1f}s")
+    return total_students
@@ -0,0 +1,259 @@
+from app import db
+from app.models import Class, ClassGallery
+from app.utils.atomic_file import atomic_write
+from app.utils.photo_store import PROJECT_ROOT
+from collections import OrderedDict
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.util import identity_key
+import os
+import pickle
+import random
+import threading
+import time
+
+EMBEDDINGS_DIR = os.environ.get('EMBEDDINGS_DIR', os.path.join(PROJECT_ROOT, 'embeddings'))
+# Class galleries kept in memory per process, each tagged with its catalog version
+GALLERY_CACHE_SIZE = int(os.environ.get('GALLERY_CACHE_SIZE', 64))
+# Attempts of update_gallery when concurrent saves keep changing the gallery
+GALLERY_SAVE_RETRIES = int(os.environ.get('GALLERY_SAVE_RETRIES', 20))
+# Longest random wait before the first retry, in seconds; doubles per attempt up to 0.5
+GALLERY_SAVE_BACKOFF = float(os.environ.get('GALLERY_SAVE_BACKOFF', 0.01))
+
+_gallery_cache = OrderedDict()
+_gallery_cache_lock = threading.Lock()
+_gallery_cache_stats = {'hits': 0, 'loads': 0}
+
+
+def gallery_filename(class_id):
+    return f"class_{class_id}_embeddings.pkl"
+
+
+def legacy_gallery_filename(teacher_id, class_name):
+    """Name galleries had before the catalog, which a class rename used to orphan"""
+    return f"{teacher_id}_{class_name}_embeddings.pkl"
+
+
+def get_gallery_entry(class_id):
+    return ClassGallery.query.get(class_id)
+
+
+def has_gallery(class_id):
+    """True when the class has a non-empty gallery; answered from the catalog alone"""
+    entry = get_gallery_entry(class_id)
+    return entry is not None and entry.student_count > 0
+
+
+def _read_gallery_file(path):
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+
+def _cache_gallery(class_id, version, gallery):
+    with _gallery_cache_lock:
+        _gallery_cache[class_id] = (version, gallery)
+        _gallery_cache.move_to_end(class_id)
+        while len(_gallery_cache) > GALLERY_CACHE_SIZE:
+            _gallery_cache.popitem(last=False)
+
+
+def load_gallery(class_id):
+    """
+    Load the {student key: embedding} gallery of a class; empty when it has none.
+    Galleries are cached per process and checked against the catalog version
+    with one primary-key read, so a gallery rewritten by another worker is
+    reloaded on its next use. Returns a copy the caller may modify.
+    """
+    return load_gallery_version(class_id)[1]
+
+
+def load_gallery_version(class_id):
+    """(catalog version, gallery copy) of a class; version 0 when it has no gallery yet"""
+    row = db.session.query(ClassGallery.version, ClassGallery.path).filter(ClassGallery.class_id == class_id).first()
+    if row is None:
+        return 0, {}
+    version, filename = row
+
+    with _gallery_cache_lock:
+        cached = _gallery_cache.get(class_id)
+        if cached is not None and cached[0] == version:
+            _gallery_cache.move_to_end(class_id)
+            _gallery_cache_stats['hits'] += 1
+            return version, dict(cached[1])
+
+    path = os.path.join(EMBEDDINGS_DIR, filename)
+    if not os.path.exists(path):
+        return version, {}
+    gallery = _read_gallery_file(path)
+    with _gallery_cache_lock:
+        _gallery_cache_stats['loads'] += 1
+    _cache_gallery(class_id, version, gallery)
+    return version, dict(gallery)
+
+
+def cached_galleries():
+    """(class_id, version, gallery) of every gallery cached in this process"""
+    with _gallery_cache_lock:
+        return [(class_id, version, gallery) for class_id, (version, gallery) in _gallery_cache.items()]
+
+
+def gallery_cache_stats():
+    """Cache hits, file loads and the cached classes with their versions"""
+    with _gallery_cache_lock:
+        return dict(_gallery_cache_stats, classes={class_id: version for class_id, (version, _) in _gallery_cache.items()})
+
+
+class GalleryConflict(Exception):
+    """The gallery was saved by someone else after the caller loaded it"""
+
+
+def save_gallery(class_id, embeddings_dict, model_version=None, expected_version=None):
+    """
+    Replace the gallery of a class and update its catalog entry.
+    The file is replaced atomically, so readers see either the old or the
+    new gallery, and the catalog version is bumped so every process reloads
+    it. With expected_version (from load_gallery_version, 0 for a class with
+    no gallery yet) the save only happens if nobody saved the gallery since;
+    otherwise GalleryConflict is raised, the gallery is left alone and the
+    caller's transaction is left open. A save commits the session.
+    Returns the gallery file path.
+    """
+    os.makedirs(EMBEDDINGS_DIR, exist_ok=True)
+    filename = gallery_filename(class_id)
+    path = os.path.join(EMBEDDINGS_DIR, filename)
+
+    # Claim the next version before touching the file; the row stays locked until commit
+    if not _claim_version(class_id, filename, expected_version):
+        _conflict(class_id)
+    entry = db.session.get(ClassGallery, class_id, populate_existing=True)
+    old_filename = entry.path
+
+    atomic_write(path, lambda f: pickle.dump(embeddings_dict, f))
+
+    _describe(entry, filename, embeddings_dict, os.path.getsize(path), model_version)
+    db.session.commit()
+
+    # Legacy files are moved to the class_id name on their first save
+    if old_filename != filename and os.path.exists(os.path.join(EMBEDDINGS_DIR, old_filename)):
+        os.remove(os.path.join(EMBEDDINGS_DIR, old_filename))
+    return path
+
+
+def _claim_version(class_id, filename, expected_version):
+    """
+    Bump the catalog version of a class gallery, creating its entry at version 1
+    when it has none. This is the save's first write, so it opens the write
+    transaction that the gallery file is written under. With expected_version,
+    returns False when the version is no longer the expected one.
+    """
+    table = ClassGallery.__table__
+    if expected_version:
+        return db.session.execute(table.update().where(
+            (table.c.class_id == class_id) & (table.c.version == expected_version)
+        ).values(version=expected_version + 1)).rowcount > 0
+
+    values = {'class_id': class_id, 'path': filename, 'version': 1, 'student_count': 0, 'byte_size': 0}
+    dialect = db.session.get_bind().dialect.name
+    if dialect in ('sqlite', 'postgresql'):
+        if dialect == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert
+        stmt = insert(table).values(**values)
+        if expected_version is None:
+            db.session.execute(stmt.on_conflict_do_update(index_elements=['class_id'],
+                                                          set_={'version': table.c.version + 1}))
+            return True
+        # Only the first of several concurrent first saves inserts the row
+        return db.session.execute(stmt.on_conflict_do_nothing(index_elements=['class_id'])).rowcount > 0
+
+    # Other databases: update an existing entry, insert otherwise
+    bump = table.update().where(table.c.class_id == class_id).values(version=table.c.version + 1)
+    if expected_version is None and db.session.execute(bump).rowcount:
+        return True
+    try:
+        with db.session.begin_nested():
+            db.session.execute(table.insert().values(**values))
+        return True
+    except IntegrityError:
+        # Another save created the entry first
+        return expected_version is None and db.session.execute(bump).rowcount > 0
+
+
+def _conflict(class_id):
+    # Leave the caller's transaction alone; only drop the stale catalog row so it is read again
+    entry = db.session.identity_map.get(identity_key(ClassGallery, class_id))
+    if entry is not None:
+        db.session.expire(entry)
+    raise GalleryConflict(f"Gallery of class {class_id} was saved by someone else since it was loaded")
+
+
+def update_gallery(class_id, update, model_version=None):
+    """
+    Load a class gallery, change it in place with update(gallery) and save it.
+    Concurrent updates of the same class do not lose each other's changes:
+    when another save got in between, the gallery is reloaded and update
+    applied again, after a short random wait. Returns the gallery file path.
+    """
+    for attempt in range(GALLERY_SAVE_RETRIES):
+        if attempt:
+            time.sleep(random.uniform(0, min(GALLERY_SAVE_BACKOFF * 2 ** (attempt - 1), 0.5)))
+        version, gallery = load_gallery_version(class_id)
+        update(gallery)
+        try:
+            return save_gallery(class_id, gallery, model_version, expected_version=version)
+        except GalleryConflict:
+            continue
+    raise GalleryConflict(f"Gallery of class {class_id} kept changing; gave up after {GALLERY_SAVE_RETRIES} attempts")
+
+
+def _describe(entry, filename, embeddings_dict, byte_size, model_version):
+    first = next(iter(embeddings_dict.values()), None)
+    entry.path = filename
+    entry.student_count = len(embeddings_dict)
+    entry.embedding_dim = len(first) if first is not None else None
+    entry.model_version = model_version
+    entry.byte_size = byte_size
+
+
+def sync_gallery_catalog(echo=None):
+    """
+    Register gallery files written before the catalog existed. Matches
+    <teacher id>_<class name>_embeddings.pkl, then the <teacher id>_<class id>
+    names older student uploads produced. Returns the number registered.
+    """
+    if not os.path.isdir(EMBEDDINGS_DIR):
+        return 0
+    files = set(os.listdir(EMBEDDINGS_DIR))
+    catalogued = {class_id for (class_id,) in db.session.query(ClassGallery.class_id)}
+
+    registered = 0
+    for class_obj in Class.query.order_by(Class.id).all():
+        if class_obj.id in catalogued:
+            continue
+        candidates = [legacy_gallery_filename(class_obj.teacher_id, class_obj.name)]
+        candidates += sorted(f for f in files if f.endswith(f"_{class_obj.id}_embeddings.pkl"))
+        filename = next((f for f in candidates if f in files), None)
+        if filename is None:
+            continue
+        path = os.path.join(EMBEDDINGS_DIR, filename)
+        try:
+            embeddings_dict = _read_gallery_file(path)
+        except Exception as e:
+            if echo:
+                echo(f"Skipping unreadable gallery {filename}: {e}")
+            continue
+        entry = ClassGallery(class_id=class_obj.id, version=1)
+        _describe(entry, filename, embeddings_dict, os.path.getsize(path), None)
+        db.session.add(entry)
+        registered += 1
+        if echo:
+            echo(f"Registered {filename} for class {class_obj.id} ({class_obj.name})")
+    db.session.commit()
+    return registered
+
+
+def init_gallery_catalog(echo=None):
+    """Fill an empty catalog from existing gallery files, once"""
+    if ClassGallery.query.first() is None:
+        return sync_gallery_catalog(echo)
+    return 0
@@ -0,0 +1,109 @@
+from app.utils.face_embedder import FaceEmbedder
+from app.utils import inference_protocol as proto
+from app.utils.crop_cache import FaceCropCache, DEFAULT_CROP_CACHE_DIR
+from app.utils.result_cache import result_cache_from_env
+from app.utils.tiled_detection import TiledDetector, DETECT_TILE_MIN_FACE
+import socket
+import struct
+import threading
+
+
+class RemoteFaceEmbedder(FaceEmbedder):
+    """
+    FaceEmbedder that runs detection and FaceNet in the inference server.
+
+    Decoding, cropping, prewhitening, gallery files and matching stay in this
+    process; only detect and embed calls go over the Unix socket. No model is
+    loaded here, so web workers stay small and scale independently of the
+    inference process.
+    """
+
+    def __init__(self, socket_path, timeout=30.0, model_version='20180402-114759'):
+        self.socket_path = socket_path
+        self.model_version = model_version
+        self.timeout = timeout
+        self.embeddings_cache = {}
+        self.crop_cache = FaceCropCache(DEFAULT_CROP_CACHE_DIR, self.DETECTOR_VERSION)
+        self.result_cache = result_cache_from_env()
+        # Tiles are sent to the server concurrently, one socket per thread
+        self.tiled_detector = TiledDetector(self.detect_tile)
+        self.batcher = None
+        self._local = threading.local()
+
+    def _connection(self):
+        # One persistent connection per thread
+        sock = getattr(self._local, 'sock', None)
+        if sock is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            sock.connect(self.socket_path)
+            self._local.sock = sock
+        return sock
+
+    def _close(self):
+        sock = getattr(self._local, 'sock', None)
+        if sock is not None:
+            sock.close()
+            self._local.sock = None
+
+    def _call(self, op, payload):
+        """Send one request frame and return the response payload, reconnecting once"""
+        for attempt in range(2):
+            try:
+                sock = self._connection()
+                proto.send_frame(sock, op, payload)
+                status, response = proto.recv_frame(sock)
+                break
+            except (ConnectionError, OSError):
+                self._close()
+                if attempt:
+                    raise
+        if status != proto.STATUS_OK:
+            raise RuntimeError(f"Inference server error: {response.decode('utf-8', 'replace')}")
+        return response
+
+    def detect_faces(self, image):
+        """Detect faces remotely; the decoded image is still returned for local cropping"""
+        if isinstance(image, str):
+            with open(image, 'rb') as f:
+                image = f.read()
+        img = self.load_image(image)
+        # Send the compressed upload when we have it; it is far smaller than pixels
+        payload = proto.pack_image(image if isinstance(image, bytes) else img)
+        faces, _ = proto.unpack_faces(self._call(proto.OP_DETECT, payload))
+        return faces, img
+
+    def detect_faces_rgb(self, image):
+        faces, _ = proto.unpack_faces(self._call(proto.OP_DETECT, proto.pack_image(image)))
+        return faces
+
+    def detect_tile(self, tile, min_face_size=DETECT_TILE_MIN_FACE):
+        """Detect a group-photo tile with the server's small-face detector"""
+        payload = struct.pack('<I', min_face_size) + proto.pack_image(tile)
+        faces, _ = proto.unpack_faces(self._call(proto.OP_DETECT_TILE, payload))
+        return faces
+
+    def _run_embeddings(self, face_imgs):
+        embeddings, _ = proto.unpack_array(self._call(proto.OP_EMBED, proto.pack_array(face_imgs)), 2)
+        return embeddings
+
+    def embed_image(self, image):
+        """Detect and embed every face of an image in one round trip"""
+        if isinstance(image, str):
+            with open(image, 'rb') as f:
+                image = f.read()
+        payload = proto.pack_image(image if isinstance(image, bytes) else self.load_image(image))
+        response = self._call(proto.OP_EMBED_IMAGE, payload)
+        faces, offset = proto.unpack_faces(response)
+        embeddings, _ = proto.unpack_array(response, 2, offset)
+        return faces, list(embeddings)
+
+    def _detect_and_embed_many(self, images, group=False):
+        if group:
+            return super()._detect_and_embed_many(images, group)
+        # One round trip per image instead of detect + embed; the server batches
+        # the embeddings of concurrent calls
+        return self._map_images(self.embed_image, images)
+
+    def batching_stats(self):
+        return None
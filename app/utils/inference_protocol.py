@@ -0,0 +1,130 @@
+"""
+Binary framing for the local inference server.
+
+Every message is a 5-byte header followed by a payload:
+
+    request:  uint8 op,     uint32 payload length, payload
+    response: uint8 status, uint32 payload length, payload
+
+All integers are little-endian. A non-zero status means the payload is a
+UTF-8 error message.
+
+Payloads by op:
+
+    DETECT  in:  image
+            out: faces
+    DETECT_TILE
+            in:  uint32 min face size, then image (one tile of a group photo)
+            out: faces
+    EMBED   in:  uint32 n, h, w, c, then n*h*w*c float32 preprocessed faces
+            out: uint32 n, dim, then n*dim float32 embeddings
+    EMBED_IMAGE
+            in:  image
+            out: faces, then uint32 n, dim, n*dim float32 (one per face)
+
+An image is uint8 kind followed by either encoded bytes (kind 0, e.g. a
+JPEG as uploaded) or uint32 h, w and h*w*3 RGB pixels (kind 1). Faces are
+uint32 count, then per face int32 x, y, w, h, float32 confidence and ten
+int32 keypoint coordinates in KEYPOINT_NAMES order.
+"""
+import numpy as np
+import struct
+
+OP_DETECT = 1
+OP_EMBED = 2
+OP_EMBED_IMAGE = 3
+# 4 was MATCH, which nothing sent; matching stays in the web process
+OP_DETECT_TILE = 5
+
+STATUS_OK = 0
+STATUS_ERROR = 1
+
+HEADER = struct.Struct('<BI')
+FACE = struct.Struct('<4if10i')
+KEYPOINT_NAMES = ('left_eye', 'right_eye', 'nose', 'mouth_left', 'mouth_right')
+
+IMAGE_ENCODED = 0
+IMAGE_RAW = 1
+
+
+def recv_exactly(sock, size):
+    """Read exactly size bytes, or raise ConnectionError if the peer closes"""
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+    while received < size:
+        count = sock.recv_into(view[received:], size - received)
+        if count == 0:
+            raise ConnectionError("Inference socket closed")
+        received += count
+    return bytes(buffer)
+
+
+def send_frame(sock, code, payload=b''):
+    sock.sendall(HEADER.pack(code, len(payload)) + payload)
+
+
+def recv_frame(sock):
+    """Return (op or status, payload)"""
+    code, length = HEADER.unpack(recv_exactly(sock, HEADER.size))
+    return code, recv_exactly(sock, length) if length else b''
+
+
+def pack_image(image):
+    if isinstance(image, (bytes, bytearray)):
+        return struct.pack('<B', IMAGE_ENCODED) + bytes(image)
+    image = np.ascontiguousarray(image, dtype=np.uint8)
+    return struct.pack('<BII', IMAGE_RAW, image.shape[0], image.shape[1]) + image.tobytes()
+
+
+def unpack_image(payload):
+    """Return encoded bytes or an RGB array, plus the number of bytes consumed"""
+    kind = payload[0]
+    if kind == IMAGE_ENCODED:
+        return payload[1:], len(payload)
+    height, width = struct.unpack_from('<II', payload, 1)
+    offset = 9 + height * width * 3
+    return np.frombuffer(payload, np.uint8, height * width * 3, 9).reshape(height, width, 3), offset
+
+
+def pack_faces(faces):
+    parts = [struct.pack('<I', len(faces))]
+    for face in faces:
+        keypoints = face.get('keypoints', {})
+        coords = []
+        for name in KEYPOINT_NAMES:
+            coords.extend(int(v) for v in keypoints.get(name, (0, 0)))
+        parts.append(FACE.pack(*(int(v) for v in face['box']), float(face['confidence']), *coords))
+    return b''.join(parts)
+
+
+def unpack_faces(payload, offset=0):
+    """Return (faces, offset after the faces)"""
+    (count,) = struct.unpack_from('<I', payload, offset)
+    offset += 4
+    faces = []
+    for _ in range(count):
+        values = FACE.unpack_from(payload, offset)
+        offset += FACE.size
+        coords = values[5:]
+        faces.append({
+            'box': list(values[:4]),
+            'confidence': values[4],
+            'keypoints': {name: (coords[2 * i], coords[2 * i + 1]) for i, name in enumerate(KEYPOINT_NAMES)}
+        })
+    return faces, offset
+
+
+def pack_array(array):
+    """uint32 shape followed by float32 data"""
+    array = np.ascontiguousarray(array, dtype='<f4')
+    return struct.pack(f'<{array.ndim}I', *array.shape) + array.tobytes()
+
+
+def unpack_array(payload, ndim, offset=0):
+    """Return (float32 array, offset after the array)"""
+    shape = struct.unpack_from(f'<{ndim}I', payload, offset)
+    offset += 4 * ndim
+    size = int(np.prod(shape))
+    array = np.frombuffer(payload, '<f4', size, offset).reshape(shape)
+    return array, offset + 4 * size
@@ -0,0 +1,100 @@
+from app.utils import inference_protocol as proto
+import numpy as np
+import logging
+import os
+import socketserver
+import struct
+
+logger = logging.getLogger('attendance-app')
+
+
+class InferenceRequestHandler(socketserver.BaseRequestHandler):
+    """Serves frames on one client connection until the client disconnects"""
+
+    def handle(self):
+        embedder = self.server.embedder
+        while True:
+            try:
+                op, payload = proto.recv_frame(self.request)
+            except ConnectionError:
+                return
+            try:
+                response = self.dispatch(embedder, op, payload)
+                proto.send_frame(self.request, proto.STATUS_OK, response)
+            except ConnectionError:
+                return
+            except Exception as e:
+                logger.exception(f"Inference request failed (op {op})")
+                proto.send_frame(self.request, proto.STATUS_ERROR, str(e).encode('utf-8'))
+
+    def detect(self, embedder, payload):
+        image, _ = proto.unpack_image(payload)
+        if isinstance(image, np.ndarray):
+            # Raw frames are already RGB; skip load_image's BGR heuristic
+            return embedder.detect_faces_rgb(image), image
+        return embedder.detect_faces(image)
+
+    def dispatch(self, embedder, op, payload):
+        if op == proto.OP_DETECT:
+            faces, _ = self.detect(embedder, payload)
+            return proto.pack_faces(faces)
+
+        if op == proto.OP_DETECT_TILE:
+            (min_face_size,) = struct.unpack_from('<I', payload)
+            tile, _ = proto.unpack_image(payload[4:])
+            if not isinstance(tile, np.ndarray):
+                tile = embedder.load_image(tile)
+            return proto.pack_faces(embedder.detect_tile(tile, min_face_size))
+
+        if op == proto.OP_EMBED:
+            face_imgs, _ = proto.unpack_array(payload, 4)
+            return proto.pack_array(np.asarray(embedder.get_embeddings(list(face_imgs))))
+
+        if op == proto.OP_EMBED_IMAGE:
+            faces, img = self.detect(embedder, payload)
+            embeddings = embedder.get_embeddings([embedder.preprocess_face(img, face) for face in faces])
+            embeddings = np.asarray(embeddings).reshape(len(faces), -1)
+            return proto.pack_faces(faces) + proto.pack_array(embeddings)
+
+        raise ValueError(f"Unknown op {op}")
+
+
+class InferenceServer(socketserver.ThreadingUnixStreamServer):
+    """
+    Unix-domain socket server exposing detect/embed of one FaceEmbedder.
+    Each connection gets a thread, and all of them feed the embedder's
+    micro-batcher, which keeps the model saturated under load.
+    """
+    daemon_threads = True
+
+    def __init__(self, socket_path, embedder):
+        self.embedder = embedder
+        self.socket_path = socket_path
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        super().__init__(socket_path, InferenceRequestHandler)
+        os.chmod(socket_path, 0o660)
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+
+def run_inference_server(socket_path):
+    """Serve the model of this process until interrupted"""
+    from app.utils.face_embedder import FaceEmbedder, get_shared_embedder
+    from app.utils.inference_client import RemoteFaceEmbedder
+
+    # Reuse the model the app already loaded; a client-mode process needs its own
+    embedder = get_shared_embedder()
+    if isinstance(embedder, RemoteFaceEmbedder):
+        embedder = FaceEmbedder()
+    server = InferenceServer(socket_path, embedder)
+    logger.info(f"Inference server listening on {socket_path}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -0,0 +1,151 @@
+import cv2
+import math
+import numpy as np
+import os
+
+# Longest side used for quality detection; faces are still found, just faster
+QUALITY_MAX_SIDE = 640
+# Photos per student that go on to FaceNet during enrollment
+ENROLL_MAX_PHOTOS = int(os.environ.get('ENROLL_MAX_PHOTOS', 5))
+
+MIN_FACE_SIZE = 60          # shorter box side, in original-image pixels
+MIN_CONFIDENCE = 0.9
+MIN_SHARPNESS = 60.0        # Laplacian variance of the 160x160 grayscale face
+MIN_BRIGHTNESS = 50.0
+MAX_BRIGHTNESS = 210.0
+MAX_YAW = 0.35              # nose offset from the eye midpoint, in eye distances
+MAX_ROLL = 25.0             # eye-line angle, degrees
+DUPLICATE_DISTANCE = 6      # perceptual-hash Hamming distance
+
+
+def perceptual_hash(gray):
+    """64-bit DCT perceptual hash of a grayscale image"""
+    small = cv2.resize(gray, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low = cv2.dct(small)[:8, :8].flatten()
+    bits = low > np.median(low[1:])
+    return int(''.join('1' if bit else '0' for bit in bits), 2)
+
+
+def hamming(a, b):
+    return bin(a ^ b).count('1')
+
+
+def estimate_pose(keypoints):
+    """Yaw, roll and pitch ratio from the five MTCNN landmarks"""
+    left_eye = np.array(keypoints['left_eye'], np.float32)
+    right_eye = np.array(keypoints['right_eye'], np.float32)
+    nose = np.array(keypoints['nose'], np.float32)
+    mouth = (np.array(keypoints['mouth_left'], np.float32) + np.array(keypoints['mouth_right'], np.float32)) / 2
+    eye_mid = (left_eye + right_eye) / 2
+    eye_distance = max(float(np.linalg.norm(right_eye - left_eye)), 1.0)
+    dx, dy = right_eye - left_eye
+    mouth_drop = max(float(mouth[1] - eye_mid[1]), 1.0)
+    return {
+        'yaw': float((nose[0] - eye_mid[0]) / eye_distance),
+        'roll': float(math.degrees(math.atan2(dy, dx))),
+        # Roughly 0.5 for a level face; lower looks up, higher looks down
+        'pitch_ratio': float((nose[1] - eye_mid[1]) / mouth_drop),
+    }
+
+
+def assess_photo(embedder, image, max_side=QUALITY_MAX_SIDE):
+    """
+    Score one photo at reduced resolution.
+
+    Returns a dict with the detected faces (boxes in original coordinates),
+    and for the most confident face its size, sharpness (Laplacian variance),
+    exposure, pose and a perceptual hash, plus an overall score, a pass flag
+    and the reasons it failed.
+    """
+    img = embedder.load_image(image)
+    height, width = img.shape[:2]
+    scale = min(1.0, max_side / max(height, width))
+    small = cv2.resize(img, (int(width * scale), int(height * scale)), interpolation=cv2.INTER_AREA) if scale < 1.0 else img
+
+    faces = embedder.detect_faces_rgb(small)
+    for face in faces:
+        face['box'] = [int(round(v / scale)) for v in face['box']]
+        if 'keypoints' in face:
+            face['keypoints'] = {k: (int(round(x / scale)), int(round(y / scale))) for k, (x, y) in face['keypoints'].items()}
+
+    result = {'faces': faces, 'face_count': len(faces), 'passed': False, 'score': 0.0, 'reasons': []}
+    if not faces:
+        result['reasons'].append('no face detected')
+        return result
+
+    face = max(faces, key=lambda f: f['confidence'])
+    x, y, w, h = face['box']
+    x, y = max(x, 0), max(y, 0)
+    gray = cv2.cvtColor(img[y:y + h, x:x + w], cv2.COLOR_RGB2GRAY)
+    gray = cv2.resize(gray, (160, 160), interpolation=cv2.INTER_AREA)
+
+    sharpness = float(cv2.Laplacian(gray, cv2.CV_64F).var())
+    brightness = float(gray.mean())
+    clipped = float(((gray < 10) | (gray > 245)).mean())
+    pose = estimate_pose(face['keypoints']) if 'keypoints' in face else None
+    face_size = min(w, h)
+
+    reasons = []
+    if face['confidence'] < MIN_CONFIDENCE:
+        reasons.append('low detection confidence')
+    if face_size < MIN_FACE_SIZE:
+        reasons.append('face too small')
+    if sharpness < MIN_SHARPNESS:
+        reasons.append('image is blurry')
+    if brightness < MIN_BRIGHTNESS:
+        reasons.append('face is too dark')
+    elif brightness > MAX_BRIGHTNESS:
+        reasons.append('face is overexposed')
+    if pose and abs(pose['yaw']) > MAX_YAW:
+        reasons.append('face is turned sideways')
+    if pose and abs(pose['roll']) > MAX_ROLL:
+        reasons.append('head is tilted')
+
+    # Each factor saturates at 1 once comfortably inside its limit
+    score = float(face['confidence'])
+    score *= min(1.0, sharpness / (MIN_SHARPNESS * 3))
+    score *= min(1.0, face_size / (MIN_FACE_SIZE * 2))
+    score *= 1.0 - min(1.0, abs(brightness - 128.0) / 128.0) * 0.5
+    if pose:
+        score *= 1.0 - min(1.0, abs(pose['yaw']) / (MAX_YAW * 2))
+
+    result.update({
+        'face_size': face_size,
+        'face_fraction': float(w * h) / float(width * height),
+        'sharpness': sharpness,
+        'brightness': brightness,
+        'clipped_fraction': clipped,
+        'pose': pose,
+        'phash': perceptual_hash(gray),
+        'score': score,
+        'passed': not reasons,
+        'reasons': reasons,
+    })
+    return result
+
+
+def select_best_photos(embedder, images, k=ENROLL_MAX_PHOTOS):
+    """
+    Assess photos and keep at most k that pass the gate, best first,
+    dropping near-duplicates. Returns (selected images, {image: assessment}).
+    """
+    assessments = {}
+    for image in images:
+        try:
+            assessments[image] = assess_photo(embedder, image)
+        except Exception as e:
+            assessments[image] = {'passed': False, 'score': 0.0, 'reasons': [f'unreadable image: {e}']}
+
+    ranked = sorted((image for image in images if assessments[image]['passed']),
+                    key=lambda image: assessments[image]['score'], reverse=True)
+    selected, hashes = [], []
+    for image in ranked:
+        phash = assessments[image]['phash']
+        if any(hamming(phash, other) <= DUPLICATE_DISTANCE for other in hashes):
+            assessments[image]['reasons'].append('near-duplicate of a better photo')
+            continue
+        selected.append(image)
+        hashes.append(phash)
+        if len(selected) >= k:
+            break
+    return selected, assessments
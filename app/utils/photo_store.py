@@ -0,0 +1,63 @@
+from app.utils.atomic_file import atomic_write
+from PIL import Image, ImageOps
+from io import BytesIO
+import hashlib
+import os
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Canonical photo storage: <PHOTO_STORE_DIR>/<first two hex chars>/<sha256>.jpg
+PHOTO_STORE_DIR = os.environ.get('PHOTO_STORE_DIR', os.path.join(PROJECT_ROOT, 'photo_store'))
+# Longest side kept after ingest; plenty for MTCNN and the 160x160 FaceNet crop
+PHOTO_MAX_SIDE = int(os.environ.get('PHOTO_MAX_SIDE', 1024))
+PHOTO_JPEG_QUALITY = 90
+
+
+def normalize_photo(data, max_side=PHOTO_MAX_SIDE):
+    """
+    Decode an uploaded image, apply its EXIF rotation, bound its longest side
+    and re-encode it as an RGB JPEG. Returns the JPEG bytes.
+    """
+    with Image.open(BytesIO(data)) as img:
+        img = ImageOps.exif_transpose(img)
+        img = img.convert('RGB')
+        if max(img.size) > max_side:
+            img.thumbnail((max_side, max_side), Image.LANCZOS)
+        out = BytesIO()
+        img.save(out, format='JPEG', quality=PHOTO_JPEG_QUALITY, optimize=True)
+        return out.getvalue()
+
+
+def photo_key(digest):
+    """Store-relative key for a content hash"""
+    return f"{digest[:2]}/{digest}.jpg"
+
+
+def photo_path(filename):
+    """
+    Absolute path of a StudentPhoto.filename.
+    Store keys resolve into PHOTO_STORE_DIR; absolute legacy paths are returned as-is.
+    """
+    if os.path.isabs(filename):
+        return filename
+    return os.path.join(PHOTO_STORE_DIR, filename)
+
+
+def store_photo(data):
+    """
+    Normalize image bytes and store them by content hash.
+    Identical photos are written once. Returns the store key for StudentPhoto.filename.
+    """
+    normalized = normalize_photo(data)
+    key = photo_key(hashlib.sha256(normalized).hexdigest())
+    path = photo_path(key)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write then rename so a concurrent reader never sees a partial file
+        atomic_write(path, lambda f: f.write(normalized))
+    return key
+
+
+def store_upload(file):
+    """Store a werkzeug FileStorage upload; returns its store key"""
+    return store_photo(file.read())
@@ -0,0 +1,131 @@
+from werkzeug.serving import make_server
+import logging
+import os
+import signal
+import sys
+import time
+
+logger = logging.getLogger('attendance-app')
+
+
+class _StopServer(Exception):
+    """Raised from the signal handler to break the master out of os.wait()"""
+
+
+def _memory_report(label):
+    """Log RSS plus unique/proportional set size, which show copy-on-write sharing"""
+    try:
+        import psutil
+        info = psutil.Process().memory_full_info()
+        pss = getattr(info, 'pss', None)
+        logger.info(
+            f"{label} pid {os.getpid()}: rss={info.rss / 2**20:.1f} MiB, "
+            f"uss={info.uss / 2**20:.1f} MiB"
+            + (f", pss={pss / 2**20:.1f} MiB" if pss is not None else "")
+        )
+    except Exception as e:
+        logger.warning(f"Could not read memory usage for pid {os.getpid()}: {e}")
+
+
+class PreforkServer:
+    """
+    Pre-fork WSGI server.
+
+    The master binds the listening socket and loads the FaceNet graph, then
+    forks workers that inherit both. The graph weights stay shared
+    copy-on-write; TensorFlow sessions and the MTCNN detector are created in
+    each worker on first use. Every worker accepts connections from the same
+    socket. A worker exits
+    after max_requests requests and the master replaces it.
+    """
+
+    def __init__(self, app, host, port, workers=2, max_requests=1000, preload=None):
+        self.app = app
+        self.host = host
+        self.port = port
+        self.num_workers = max(1, workers)
+        self.max_requests = max_requests
+        self.preload = preload
+        self.workers = {}
+        self.running = True
+        self.server = None
+
+    def run(self):
+        if not hasattr(os, 'fork'):
+            raise RuntimeError("Pre-fork serving requires a platform with os.fork")
+
+        if self.preload:
+            self.preload()
+        _memory_report("Master")
+
+        # Bind once in the master; workers share the listening socket
+        self.server = make_server(self.host, self.port, self.app, threaded=True)
+        logger.info(f"Serving on http://{self.host}:{self.port} with {self.num_workers} workers "
+                    f"(max {self.max_requests} requests per worker)")
+
+        signal.signal(signal.SIGTERM, self._handle_stop)
+        signal.signal(signal.SIGINT, self._handle_stop)
+
+        try:
+            for _ in range(self.num_workers):
+                self._spawn_worker()
+
+            while self.running:
+                try:
+                    pid, status = os.wait()
+                except ChildProcessError:
+                    break
+                if self.workers.pop(pid, None) is not None and self.running:
+                    logger.info(f"Worker {pid} exited (status {status}); starting a replacement")
+                    self._spawn_worker()
+        except _StopServer:
+            logger.info("Shutting down workers")
+        finally:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            self._stop_workers()
+            self.server.server_close()
+
+    def _spawn_worker(self):
+        pid = os.fork()
+        if pid:
+            self.workers[pid] = time.time()
+            return
+
+        # Worker process
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        exit_code = 0
+        try:
+            _memory_report("Worker")
+            # Track request threads so server_close() can wait for them
+            self.server.daemon_threads = False
+            self.server.block_on_close = True
+            handled = 0
+            while self.max_requests <= 0 or handled < self.max_requests:
+                self.server.handle_request()
+                handled += 1
+            # Waits for in-flight request threads before exiting
+            self.server.server_close()
+        except Exception:
+            logger.exception(f"Worker {os.getpid()} crashed")
+            exit_code = 1
+        finally:
+            os._exit(exit_code)
+
+    def _handle_stop(self, signum, frame):
+        self.running = False
+        raise _StopServer()
+
+    def _stop_workers(self):
+        for pid in list(self.workers):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        for pid in list(self.workers):
+            try:
+                os.waitpid(pid, 0)
+            except ChildProcessError:
+                pass
+        self.workers.clear()
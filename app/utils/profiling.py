@@ -0,0 +1,302 @@
+from app.utils.photo_store import PROJECT_ROOT
+from datetime import datetime, timezone
+from flask import g, request
+import cProfile
+import io
+import json
+import logging
+import numpy as np
+import os
+import pstats
+import random
+import threading
+import time
+import tracemalloc
+import uuid
+
+logger = logging.getLogger('attendance-app')
+
+PROFILE_DIR = os.environ.get('PROFILE_DIR', os.path.join(PROJECT_ROOT, 'profiles'))
+# Stored profiles kept on disk; older ones are deleted
+PROFILE_KEEP = int(os.environ.get('PROFILE_KEEP', 50))
+# Request header that asks for a profile while profiling is switched on
+PROFILE_HEADER = 'X-Profile-Request'
+# Frames kept per allocation traceback
+TRACEMALLOC_FRAMES = 10
+
+
+class RequestProfiler:
+    """
+    Profiles selected requests with cProfile and tracemalloc.
+
+    Off until an admin switches it on. Once on, requests to the chosen
+    endpoints (and class, if set) are profiled with probability sample_rate,
+    or when they carry the X-Profile-Request header, until max_profiles
+    profiles are stored; then it switches itself off. One request is profiled
+    at a time per process. Each profile is stored as <id>.pstats for download
+    plus <id>.json with the timing and allocation summary.
+    Settings are per process.
+    """
+
+    def __init__(self, profile_dir=PROFILE_DIR, keep=PROFILE_KEEP):
+        self.profile_dir = profile_dir
+        self.keep = keep
+        self.enabled = False
+        self.sample_rate = 0.0
+        self.endpoints = set()
+        self.class_id = None
+        self.remaining = 0
+        self._active = threading.Lock()
+        self._lock = threading.Lock()
+
+    def configure(self, enabled, sample_rate=0.0, endpoints=None, class_id=None, max_profiles=20):
+        with self._lock:
+            self.enabled = bool(enabled)
+            self.sample_rate = min(max(float(sample_rate), 0.0), 1.0)
+            self.endpoints = set(endpoints or [])
+            self.class_id = int(class_id) if class_id else None
+            self.remaining = max(0, int(max_profiles))
+
+    def settings(self):
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'sample_rate': self.sample_rate,
+                'endpoints': sorted(self.endpoints),
+                'class_id': self.class_id,
+                'remaining': self.remaining,
+                'header': PROFILE_HEADER,
+            }
+
+    def _selected(self):
+        """Whether the current request should be profiled"""
+        if not self.enabled or self.remaining <= 0:
+            return False
+        if request.endpoint is None or request.endpoint.startswith(('admin.', 'static')):
+            return False
+        if self.endpoints and request.endpoint not in self.endpoints:
+            return False
+        if self.class_id is not None and _request_class_id() != self.class_id:
+            return False
+        return bool(request.headers.get(PROFILE_HEADER)) or random.random() < self.sample_rate
+
+    def start(self):
+        if not self._selected() or not self._active.acquire(blocking=False):
+            return
+        with self._lock:
+            if self.remaining <= 0:
+                self._active.release()
+                return
+            self.remaining -= 1
+            if self.remaining == 0:
+                self.enabled = False
+
+        started_tracing = not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+        tracemalloc.reset_peak()
+        profile = cProfile.Profile()
+        g.request_profile = (profile, started_tracing, time.perf_counter())
+        profile.enable()
+
+    def finish(self, status=None):
+        """Stop profiling the current request and store the result"""
+        state = g.pop('request_profile', None)
+        if state is None:
+            return
+        profile, started_tracing, start = state
+        try:
+            profile.disable()
+            duration = time.perf_counter() - start
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            if started_tracing:
+                tracemalloc.stop()
+            self._store(profile, snapshot, duration, current, peak, status)
+        except Exception as e:
+            logger.warning(f"Could not store request profile: {e}")
+        finally:
+            self._active.release()
+
+    def _store(self, profile, snapshot, duration, current, peak, status):
+        os.makedirs(self.profile_dir, exist_ok=True)
+        created = datetime.now(timezone.utc)
+        profile_id = f"{created.strftime('%Y%m%dT%H%M%S')}-{request.endpoint}-{uuid.uuid4().hex[:6]}"
+        profile.dump_stats(os.path.join(self.profile_dir, f"{profile_id}.pstats"))
+
+        text = io.StringIO()
+        pstats.Stats(profile, stream=text).sort_stats('cumulative').print_stats(40)
+        allocations = [{
+            'size_bytes': stat.size,
+            'count': stat.count,
+            'traceback': [f"{frame.filename}:{frame.lineno}" for frame in stat.traceback],
+        } for stat in snapshot.statistics('traceback')[:25]]
+
+        report = {
+            'id': profile_id,
+            'created_at': created.isoformat(),
+            'endpoint': request.endpoint,
+            'method': request.method,
+            'path': request.path,
+            'class_id': _request_class_id(),
+            'status': status,
+            'duration_ms': round(duration * 1000, 1),
+            'traced_memory_bytes': current,
+            'peak_traced_memory_bytes': peak,
+            # tracemalloc is process-wide: concurrent requests show up here too
+            'top_allocations': allocations,
+            'top_functions': text.getvalue(),
+        }
+        with open(os.path.join(self.profile_dir, f"{profile_id}.json"), 'w') as f:
+            json.dump(report, f, indent=2)
+        logger.info(f"Stored profile {profile_id} ({report['duration_ms']} ms)")
+        self._prune()
+
+    def _prune(self):
+        reports = sorted(name for name in os.listdir(self.profile_dir) if name.endswith('.json'))
+        for name in reports[:-self.keep] if self.keep > 0 else []:
+            for suffix in ('.json', '.pstats'):
+                path = os.path.join(self.profile_dir, name[:-len('.json')] + suffix)
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def list_profiles(self):
+        """Summaries of the stored profiles, newest first"""
+        if not os.path.isdir(self.profile_dir):
+            return []
+        profiles = []
+        for name in sorted(os.listdir(self.profile_dir), reverse=True):
+            if name.endswith('.json'):
+                report = self.load_profile(name[:-len('.json')])
+                if report is not None:
+                    profiles.append({key: report[key] for key in
+                                     ('id', 'created_at', 'endpoint', 'class_id', 'status', 'duration_ms',
+                                      'peak_traced_memory_bytes')})
+        return profiles
+
+    def profile_path(self, profile_id, suffix):
+        """Path of a stored profile file, or None for unknown or unsafe ids"""
+        if os.path.basename(profile_id) != profile_id:
+            return None
+        path = os.path.join(self.profile_dir, profile_id + suffix)
+        return path if os.path.exists(path) else None
+
+    def load_profile(self, profile_id):
+        path = self.profile_path(profile_id, '.json')
+        if path is None:
+            return None
+        with open(path) as f:
+            return json.load(f)
+
+
+def _request_class_id():
+    value = (request.view_args or {}).get('class_id') or request.args.get('class_id')
+    if value is None and request.mimetype in ('multipart/form-data', 'application/x-www-form-urlencoded'):
+        value = request.form.get('class_id')
+    try:
+        return int(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def init_request_profiler(app):
+    """Attach a RequestProfiler, switched off, as app.extensions['request_profiler']"""
+    profiler = RequestProfiler(app.config.get('PROFILE_DIR', PROFILE_DIR))
+    app.extensions['request_profiler'] = profiler
+
+    @app.before_request
+    def start_request_profile():
+        profiler.start()
+
+    @app.after_request
+    def finish_request_profile(response):
+        profiler.finish(response.status_code)
+        return response
+
+    @app.teardown_request
+    def abandon_request_profile(exc):
+        # Requests that raised never reach after_request
+        if 'request_profile' in g:
+            profiler.finish(500)
+
+
+def deep_nbytes(value, _seen=None):
+    """Bytes held by numpy arrays reachable from value through dicts, lists and tuples"""
+    _seen = _seen if _seen is not None else set()
+    if id(value) in _seen:
+        return 0
+    _seen.add(id(value))
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, dict):
+        return sum(deep_nbytes(item, _seen) for item in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(deep_nbytes(item, _seen) for item in value)
+    return 0
+
+
+def _graph_bytes(graph):
+    """Bytes of the constant tensors (the weights) of a frozen TensorFlow graph"""
+    total = 0
+    for op in graph.get_operations():
+        if op.type == 'Const':
+            output = op.outputs[0]
+            if output.shape.is_fully_defined():
+                total += int(np.prod(output.shape.as_list())) * output.dtype.size
+    return total
+
+
+def _detector_bytes(detector):
+    """Approximate weight bytes of an MTCNN detector from its Keras sub-networks"""
+    total = 0
+    for value in vars(detector).values():
+        if hasattr(value, 'count_params'):
+            total += value.count_params() * 4
+    return total or None
+
+
+def embedder_memory_report(embedder):
+    """
+    Memory held by the embedder and the caches around it: process RSS, the
+    FaceNet graph weights, MTCNN weights, the result cache and each cached
+    class gallery. Sizes are bytes; None where a part is not loaded here.
+    """
+    from app.utils.gallery_store import cached_galleries
+
+    report = {'pid': os.getpid()}
+    try:
+        import psutil
+        info = psutil.Process().memory_full_info()
+        report['process'] = {'rss': info.rss, 'uss': getattr(info, 'uss', None), 'pss': getattr(info, 'pss', None)}
+    except Exception as e:
+        report['process'] = {'error': str(e)}
+
+    graph = getattr(embedder, 'facenet_graph', None)
+    try:
+        report['facenet_graph_bytes'] = _graph_bytes(graph) if graph is not None else None
+    except Exception as e:
+        report['facenet_graph_bytes'] = None
+        report['facenet_graph_error'] = str(e)
+
+    # Only a detector this process already built; reading .detector would build one
+    detector = getattr(embedder, '_detector', None)
+    if getattr(embedder, '_detector_pid', None) != os.getpid():
+        detector = None
+    report['detector_bytes'] = _detector_bytes(detector) if detector is not None else None
+
+    result_cache = embedder.result_cache
+    if result_cache is not None:
+        values = result_cache.values()
+        report['result_cache'] = {'entries': len(values), 'bytes': deep_nbytes(values)}
+    else:
+        report['result_cache'] = None
+
+    galleries = {}
+    for class_id, version, gallery in cached_galleries():
+        galleries[class_id] = {'version': version, 'students': len(gallery), 'bytes': deep_nbytes(gallery)}
+    report['galleries'] = galleries
+    report['galleries_bytes'] = sum(entry['bytes'] for entry in galleries.values())
+
+    report['batching'] = embedder.batching_stats()
+    report['threads'] = threading.active_count()
+    return report
@@ -0,0 +1,37 @@
+from flask import g, has_request_context, request
+from sqlalchemy import event
+import logging
+
+logger = logging.getLogger('attendance-app')
+
+
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    """Increment the per-request SQL statement counter"""
+    if has_request_context():
+        g.query_count = g.get('query_count', 0) + 1
+
+
+def init_query_counter(app, engine):
+    """
+    Count SQL statements issued during each request.
+
+    The count is exposed as an X-Query-Count response header in debug and
+    testing mode. QUERY_BUDGETS maps endpoint names to the maximum number of
+    queries they may issue; when testing, exceeding a budget raises an
+    AssertionError so N+1 regressions fail loudly, otherwise a warning is logged.
+    """
+    event.listen(engine, 'before_cursor_execute', _count_query)
+
+    @app.after_request
+    def check_query_budget(response):
+        count = g.get('query_count', 0)
+        if app.debug or app.testing:
+            response.headers['X-Query-Count'] = str(count)
+
+        budget = app.config.get('QUERY_BUDGETS', {}).get(request.endpoint)
+        if budget is not None and count > budget:
+            message = f"{request.endpoint} issued {count} queries (budget {budget})"
+            if app.testing:
+                raise AssertionError(message)
+            logger.warning(message)
+        return response
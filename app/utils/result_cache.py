@@ -0,0 +1,98 @@
+from app.utils.atomic_file import atomic_write
+from collections import OrderedDict
+import hashlib
+import os
+import pickle
+import threading
+
+
+class InferenceResultCache:
+    """
+    Bounded in-memory LRU of detection/embedding results, keyed by content hash.
+
+    Keys combine a namespace, the SHA-256 of the input bytes, and the model and
+    detector versions, so a model change never serves stale vectors. When
+    spill_dir is set, evicted entries are written there and read back on a
+    later miss. Cached values are shared between callers and must be treated
+    as read-only.
+    """
+
+    def __init__(self, max_entries=512, spill_dir=None):
+        self.max_entries = max_entries
+        self.spill_dir = spill_dir
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        if spill_dir:
+            os.makedirs(spill_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(namespace, digest, model_version, detector_version):
+        return f"{namespace}-{model_version}-{detector_version}-{digest}"
+
+    @staticmethod
+    def digest(data):
+        return hashlib.sha256(data).hexdigest()
+
+    def _spill_path(self, key):
+        return os.path.join(self.spill_dir, f"{hashlib.sha1(key.encode('utf-8')).hexdigest()}.pkl")
+
+    def get(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+        if self.spill_dir:
+            path = self._spill_path(key)
+            try:
+                with open(path, 'rb') as f:
+                    value = pickle.load(f)
+            except (OSError, EOFError, pickle.UnpicklingError):
+                value = None
+            if value is not None:
+                self.put(key, value)
+                with self._lock:
+                    self.hits += 1
+                return value
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, value):
+        evicted = []
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                evicted.append(self._entries.popitem(last=False))
+        if self.spill_dir:
+            for evicted_key, evicted_value in evicted:
+                path = self._spill_path(evicted_key)
+                if os.path.exists(path):
+                    continue
+                atomic_write(path, lambda f: pickle.dump(evicted_value, f))
+
+    def values(self):
+        """Snapshot of the values held in memory, for memory accounting"""
+        with self._lock:
+            return list(self._entries.values())
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'spill_dir': self.spill_dir,
+            }
+
+
+def result_cache_from_env():
+    """Cache configured by RESULT_CACHE_SIZE (0 disables) and RESULT_CACHE_SPILL_DIR"""
+    size = int(os.environ.get('RESULT_CACHE_SIZE', 512))
+    if size <= 0:
+        return None
+    return InferenceResultCache(size, os.environ.get('RESULT_CACHE_SPILL_DIR') or None)
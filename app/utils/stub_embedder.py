@@ -0,0 +1,90 @@
+from app.utils.face_embedder import FaceEmbedder
+from app.utils.result_cache import result_cache_from_env
+from app.utils.tiled_detection import TiledDetector, DETECT_TILE_MIN_FACE
+import cv2
+import numpy as np
+import os
+import time
+
+
+class StubFaceEmbedder(FaceEmbedder):
+    """
+    Deterministic, model-free FaceEmbedder for load tests.
+
+    Every image has one "face" covering its centre, found when it is at least
+    the detector's minimum face size (MTCNN's default of 20 pixels, or
+    DETECT_TILE_MIN_FACE on group-photo tiles). The embedding is a fixed
+    random projection of the downscaled crop, so the same photo always embeds
+    the same way and different synthetic students (see synthetic_face) are
+    far apart. detect_ms and embed_ms add simulated inference time.
+    """
+    DETECTOR_VERSION = 'stub-center'
+    EMBEDDING_DIM = 512
+    MIN_FACE_SIZE = 20
+
+    def __init__(self, detect_ms=0.0, embed_ms=0.0, model_version='stub'):
+        self.model_version = model_version
+        self.detect_ms = detect_ms
+        self.embed_ms = embed_ms
+        self.embeddings_cache = {}
+        self.crop_cache = None
+        self.result_cache = result_cache_from_env()
+        self.tiled_detector = TiledDetector(self.detect_tile)
+        self.batcher = None
+        self._projection = np.random.default_rng(0).standard_normal((16 * 16, self.EMBEDDING_DIM)).astype(np.float32)
+
+    def detect_faces_rgb(self, image, min_face_size=MIN_FACE_SIZE):
+        if self.detect_ms:
+            time.sleep(self.detect_ms / 1000.0)
+        height, width = image.shape[:2]
+        side = min(height, width) // 2
+        if side < min_face_size:
+            return []
+        x, y = (width - side) // 2, (height - side) // 2
+        return [{
+            'box': [x, y, side, side],
+            'confidence': 0.99,
+            'keypoints': {
+                'left_eye': (x + side // 3, y + side // 3),
+                'right_eye': (x + 2 * side // 3, y + side // 3),
+                'nose': (x + side // 2, y + side // 2),
+                'mouth_left': (x + side // 3, y + 3 * side // 4),
+                'mouth_right': (x + 2 * side // 3, y + 3 * side // 4),
+            },
+        }]
+
+    def detect_faces(self, image):
+        image = self.load_image(image)
+        return self.detect_faces_rgb(image), image
+
+    def detect_tile(self, tile, min_face_size=DETECT_TILE_MIN_FACE):
+        return self.detect_faces_rgb(tile, min_face_size)
+
+    def _run_embeddings(self, face_imgs):
+        if self.embed_ms:
+            time.sleep(self.embed_ms / 1000.0)
+        small = np.stack([cv2.resize(np.asarray(face_img, dtype=np.float32).mean(axis=2), (16, 16),
+                                     interpolation=cv2.INTER_AREA).ravel() for face_img in face_imgs])
+        embeddings = small @ self._projection
+        return embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+
+
+def synthetic_face(seed, size=256, jitter_seed=None):
+    """
+    JPEG bytes of a synthetic "face" for student seed: a random block
+    pattern the stub embedder tells apart. jitter_seed adds light pixel noise,
+    so repeat photos differ in bytes (no result cache hits) but not in identity.
+    """
+    blocks = np.random.default_rng(seed).integers(0, 256, (8, 8, 3), dtype=np.uint8)
+    image = cv2.resize(blocks, (size, size), interpolation=cv2.INTER_NEAREST)
+    if jitter_seed is not None:
+        noise = np.random.default_rng(jitter_seed).integers(-4, 5, image.shape)
+        image = np.clip(image.astype(np.int16) + noise, 0, 255).astype(np.uint8)
+    ok, encoded = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, 90])
+    return encoded.tobytes()
+
+
+def stub_embedder_from_env():
+    """StubFaceEmbedder with simulated latencies from STUB_DETECT_MS / STUB_EMBED_MS"""
+    return StubFaceEmbedder(detect_ms=float(os.environ.get('STUB_DETECT_MS', 0)),
+                            embed_ms=float(os.environ.get('STUB_EMBED_MS', 0)))
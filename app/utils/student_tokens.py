@@ -0,0 +1,124 @@
+from flask import current_app, g, jsonify, request
+from functools import wraps
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+import hashlib
+import os
+
+# Lifetimes in seconds: access tokens are short, refresh tokens last a term
+ACCESS_TOKEN_TTL = int(os.environ.get('STUDENT_ACCESS_TOKEN_TTL', 15 * 60))
+REFRESH_TOKEN_TTL = int(os.environ.get('STUDENT_REFRESH_TOKEN_TTL', 30 * 24 * 3600))
+
+
+class TokenError(Exception):
+    pass
+
+
+def _serializer(kind):
+    return URLSafeTimedSerializer(current_app.config['SECRET_KEY'], salt=f"student-{kind}-token")
+
+
+def _password_fingerprint(student):
+    # Changing the password invalidates outstanding refresh tokens
+    return hashlib.sha256((student.password_hash or '').encode('utf-8')).hexdigest()[:16]
+
+
+def issue_tokens(student):
+    """Signed access and refresh tokens for a student, as returned by /login and /refresh"""
+    return {
+        'access_token': _serializer('access').dumps({'sid': student.id, 'cid': student.class_id}),
+        'refresh_token': _serializer('refresh').dumps({'sid': student.id, 'pw': _password_fingerprint(student)}),
+        'token_type': 'Bearer',
+        'expires_in': ACCESS_TOKEN_TTL,
+    }
+
+
+def verify_access_token(token):
+    """Return {'sid', 'cid'} from a valid access token; checked by signature alone, no DB access"""
+    try:
+        return _serializer('access').loads(token, max_age=ACCESS_TOKEN_TTL)
+    except BadSignature as e:
+        raise TokenError(str(e))
+
+
+def verify_refresh_token(token, load_student):
+    """Return the student of a valid refresh token; load_student(id) fetches the row"""
+    try:
+        payload = _serializer('refresh').loads(token, max_age=REFRESH_TOKEN_TTL)
+    except BadSignature as e:
+        raise TokenError(str(e))
+    student = load_student(payload['sid'])
+    if student is None or payload.get('pw') != _password_fingerprint(student):
+        raise TokenError('Refresh token has been revoked')
+    return student
+
+
+def token_identity():
+    """
+    The verified access token payload of this request, or None without an
+    Authorization: Bearer header. Raises TokenError for a bad token.
+    Verified once per request.
+    """
+    if 'token_identity' not in g:
+        header = request.headers.get('Authorization', '')
+        scheme, _, token = header.partition(' ')
+        if scheme.lower() != 'bearer' or not token:
+            g.token_identity = None
+        else:
+            try:
+                g.token_identity = verify_access_token(token.strip())
+            except TokenError as e:
+                g.token_identity = e
+    if isinstance(g.token_identity, TokenError):
+        raise g.token_identity
+    return g.token_identity
+
+
+def request_student_id():
+    """Student id of the request: from the token when present, else the student_id field"""
+    try:
+        identity = token_identity()
+    except TokenError:
+        identity = None
+    if identity is not None:
+        return str(identity['sid'])
+    return request.form.get('student_id') or (request.get_json(silent=True) or {}).get('student_id')
+
+
+def _unauthorized(message):
+    response = jsonify({'success': False, 'message': message})
+    response.status_code = 401
+    response.headers['WWW-Authenticate'] = 'Bearer'
+    return response
+
+
+def student_auth(view):
+    """
+    Authenticate a student API request by bearer token. Sets g.student_id and
+    g.class_id from the token; a student_id given in the URL, form or JSON
+    body must match it. Without a token the request falls back to the
+    student_id field, unless STUDENT_API_REQUIRE_TOKEN is set.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        try:
+            identity = token_identity()
+        except TokenError:
+            return _unauthorized('Invalid or expired token')
+
+        g.student_id = None
+        g.class_id = None
+        if identity is None:
+            if current_app.config.get('STUDENT_API_REQUIRE_TOKEN'):
+                return _unauthorized('Authentication required')
+            return view(*args, **kwargs)
+
+        claimed = [kwargs.get('student_id'), request.form.get('student_id')]
+        if request.is_json:
+            claimed.append((request.get_json(silent=True) or {}).get('student_id'))
+        if any(value not in (None, '') and str(value) != str(identity['sid']) for value in claimed):
+            return jsonify({'success': False, 'message': 'Token does not match student'}), 403
+
+        g.student_id = identity['sid']
+        g.class_id = identity['cid']
+        return view(*args, **kwargs)
+    return wrapper
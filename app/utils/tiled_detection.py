@@ -0,0 +1,109 @@
+from concurrent.futures import ThreadPoolExecutor
+import os
+import threading
+
+# Group-photo detection settings
+DETECT_TILE_SIZE = int(os.environ.get('DETECT_TILE_SIZE', 640))
+DETECT_TILE_OVERLAP = float(os.environ.get('DETECT_TILE_OVERLAP', 0.25))
+DETECT_TILE_WORKERS = int(os.environ.get('DETECT_TILE_WORKERS', min(4, os.cpu_count() or 1)))
+DETECT_TILE_MIN_FACE = int(os.environ.get('DETECT_TILE_MIN_FACE', 12))
+# Boxes overlapping by more than this fraction of the smaller box are one face
+DETECT_TILE_NMS_THRESHOLD = 0.5
+
+
+def tile_boxes(width, height, tile_size, overlap):
+    """
+    Split a width x height image into overlapping square tiles.
+    Returns (x, y, w, h) tuples; edge tiles are shifted inwards rather than
+    shrunk so every tile keeps the full size when the image allows it.
+    """
+    stride = max(1, int(tile_size * (1 - overlap)))
+
+    def starts(length):
+        if length <= tile_size:
+            return [0]
+        positions = list(range(0, length - tile_size, stride))
+        positions.append(length - tile_size)
+        return positions
+
+    return [(x, y, min(tile_size, width), min(tile_size, height))
+            for y in starts(height) for x in starts(width)]
+
+
+def _overlap_ratio(a, b):
+    """Intersection area over the smaller box, so a face cut by a tile edge
+    still matches the full detection from the neighbouring tile"""
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    iw = min(ax + aw, bx + bw) - max(ax, bx)
+    ih = min(ay + ah, by + bh) - max(ay, by)
+    if iw <= 0 or ih <= 0:
+        return 0.0
+    return (iw * ih) / float(max(1, min(aw * ah, bw * bh)))
+
+
+def non_max_suppression(faces, threshold=DETECT_TILE_NMS_THRESHOLD):
+    """Keep the most confident of each group of overlapping detections"""
+    kept = []
+    for face in sorted(faces, key=lambda f: f['confidence'], reverse=True):
+        if all(_overlap_ratio(face['box'], other['box']) <= threshold for other in kept):
+            kept.append(face)
+    return kept
+
+
+class TiledDetector:
+    """
+    Detects faces in large group photos by running the detector on
+    overlapping tiles in a thread pool and merging the results with
+    cross-tile non-maximum suppression.
+
+    detect_tile is called with an RGB tile and returns MTCNN-style face
+    dicts in tile coordinates. It is called concurrently, one thread per
+    tile, so it must be thread-safe.
+    """
+
+    def __init__(self, detect_tile, tile_size=None, overlap=None, workers=None):
+        self.detect_tile = detect_tile
+        self.tile_size = tile_size or DETECT_TILE_SIZE
+        self.overlap = DETECT_TILE_OVERLAP if overlap is None else overlap
+        if not 0 <= self.overlap < 1:
+            raise ValueError(f"Tile overlap must be in [0, 1), got {self.overlap}")
+        self.workers = max(1, workers or DETECT_TILE_WORKERS)
+        self._executor = None
+        self._executor_pid = None
+        self._lock = threading.Lock()
+
+    @property
+    def settings(self):
+        """Identifies the tiling so cached results are not reused across settings"""
+        return f"tiled{self.tile_size}-{self.overlap:g}"
+
+    def _get_executor(self):
+        # Threads do not survive fork, so each worker process gets its own pool
+        with self._lock:
+            if self._executor is None or self._executor_pid != os.getpid():
+                self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix='face-tile')
+                self._executor_pid = os.getpid()
+            return self._executor
+
+    def _detect_offset(self, image, tile):
+        x, y, w, h = tile
+        faces = self.detect_tile(image[y:y + h, x:x + w])
+        for face in faces:
+            bx, by, bw, bh = face['box']
+            face['box'] = [bx + x, by + y, bw, bh]
+            face['keypoints'] = {name: (px + x, py + y) for name, (px, py) in face.get('keypoints', {}).items()}
+        return faces
+
+    def detect(self, image):
+        """Detect faces in an RGB array, returning boxes in image coordinates"""
+        height, width = image.shape[:2]
+        tiles = tile_boxes(width, height, self.tile_size, self.overlap)
+        if len(tiles) == 1:
+            return self.detect_tile(image)
+
+        executor = self._get_executor()
+        faces = []
+        for tile_faces in executor.map(lambda tile: self._detect_offset(image, tile), tiles):
+            faces.extend(tile_faces)
+        return non_max_suppression(faces)
@@ -10,8 +10,11 @@ import 'package:path/path.dart' as p;
 import 'package:flutter_exif_rotation/flutter_exif_rotation.dart';
 import '../models/student.dart';
 import '../models/attendance.dart';
+import 'face_crop_service.dart';
 
 class ApiService {
+  final FaceCropService _faceCropService = FaceCropService();
+  
   // Cấu hình URL kết nối đến backend Flask
   // Địa chỉ IP từ kết quả lệnh ipconfig - Wi-Fi adapter của máy tính
   static String baseUrl = 'http://192.168.240.15:5001/api/student';
@@ -41,6 +44,54 @@ class ApiService {
     return prefs.getInt('student_id');
   }
   
+  // Store the signed tokens returned by /login, /refresh and /join_class
+  Future<void> _saveTokens(Map<String, dynamic> data) async {
+    if (data['access_token'] == null) {
+      return;
+    }
+    final prefs = await SharedPreferences.getInstance();
+    await prefs.setString('access_token', data['access_token']);
+    await prefs.setString('refresh_token', data['refresh_token']);
+    final expiresAt = DateTime.now().add(Duration(seconds: data['expires_in']));
+    await prefs.setInt('access_token_expires_at', expiresAt.millisecondsSinceEpoch);
+  }
+  
+  // Exchange the refresh token for new tokens; false when it is missing or rejected
+  Future<bool> _refreshTokens() async {
+    final prefs = await SharedPreferences.getInstance();
+    final refreshToken = prefs.getString('refresh_token');
+    if (refreshToken == null) {
+      return false;
+    }
+    try {
+      final response = await http.post(
+        Uri.parse('$baseUrl/refresh'),
+        headers: {'Content-Type': 'application/json'},
+        body: json.encode({'refresh_token': refreshToken}),
+      );
+      if (response.statusCode != 200) {
+        return false;
+      }
+      await _saveTokens(json.decode(response.body));
+      return true;
+    } catch (e) {
+      return false;
+    }
+  }
+  
+  // Authorization header for the student API, refreshing the access token
+  // shortly before it expires so uploads are never sent with a stale token
+  Future<Map<String, String>> _authHeaders() async {
+    final prefs = await SharedPreferences.getInstance();
+    final expiresAt = prefs.getInt('access_token_expires_at') ?? 0;
+    final refreshBy = DateTime.now().add(const Duration(seconds: 60)).millisecondsSinceEpoch;
+    if (expiresAt < refreshBy) {
+      await _refreshTokens();
+    }
+    final token = prefs.getString('access_token');
+    return token == null ? {} : {'Authorization': 'Bearer $token'};
+  }
+  
   // Helper method to compress image before uploading
   Future<File> _compressImage(
     File file, {
@@ -128,6 +179,7 @@ class ApiService {
       if (response.statusCode == 200) {
         final prefs = await SharedPreferences.getInstance();
         await prefs.setInt('student_id', data['student_id']);
+        await _saveTokens(data);
         return {
           'success': true, 
           'student': Student.fromJson(data),
@@ -151,7 +203,7 @@ class ApiService {
     try {
       final response = await http.post(
         uri,
-        headers: {'Content-Type': 'application/json'},
+        headers: {'Content-Type': 'application/json', ...await _authHeaders()},
         body: json.encode({
           'student_id': studentId,
           'class_code': classCode,
@@ -161,6 +213,7 @@ class ApiService {
       final data = json.decode(response.body);
       
       if (response.statusCode == 200) {
+        await _saveTokens(data);
         return {'success': true, 'data': data};
       } else {
         return {'success': false, 'message': data['message']};
@@ -178,40 +231,64 @@ class ApiService {
     
     final uri = Uri.parse('$baseUrl/upload_faces');
     var request = http.MultipartRequest('POST', uri);
+    request.headers.addAll(await _authHeaders());
     request.fields['student_id'] = studentId.toString();
     
     // Tối ưu request dựa trên số lượng ảnh
     final bool isSingleImage = images.length == 1;
+    
+    // Send small on-device face crops when a face is found in every photo
+    final crops = <FaceCrop>[];
+    for (final image in images) {
+      final crop = await _faceCropService.cropLargestFace(await _fixExifRotation(image));
+      if (crop == null) {
+        crops.clear();
+        break;
+      }
+      crops.add(crop);
+    }
+    
+    if (crops.isNotEmpty) {
+      for (var i = 0; i < crops.length; i++) {
+        request.files.add(http.MultipartFile.fromBytes(
+          'face_crops',
+          crops[i].bytes,
+          filename: 'face_crop_$i.jpg',
+        ));
+      }
+      request.fields['landmarks'] = json.encode(crops.map((crop) => crop.landmarks).toList());
+    } else {
       // Áp dụng mức nén khác nhau dựa trên nguồn ảnh
-    for (var i = 0; i < images.length; i++) {
-      // Sửa hướng ảnh trước khi xử lý
-      File fixedImage = await _fixExifRotation(images[i]);
+      for (var i = 0; i < images.length; i++) {
+        // Sửa hướng ảnh trước khi xử lý
+        File fixedImage = await _fixExifRotation(images[i]);
       
-      // Nén ảnh với chất lượng thấp hơn cho ảnh từ camera (nhận diện qua đường dẫn)
-      final isCamera = fixedImage.path.contains('camera') || fixedImage.path.contains('CAM');
+        // Nén ảnh với chất lượng thấp hơn cho ảnh từ camera (nhận diện qua đường dẫn)
+        final isCamera = fixedImage.path.contains('camera') || fixedImage.path.contains('CAM');
       
-      // Nén ảnh với mức nén cao hơn (quality thấp hơn) cho ảnh camera
-      final compressQuality = isCamera ? 50 : 70;
+        // Nén ảnh với mức nén cao hơn (quality thấp hơn) cho ảnh camera
+        final compressQuality = isCamera ? 50 : 70;
       
-      // Nén mạnh hơn đối với ảnh từ camera
-      final compressedFile = await _compressImage(
-        fixedImage, 
-        quality: compressQuality,
-        maxWidth: isCamera ? 640 : 800,
-        maxHeight: isCamera ? 640 : 800,
-      );
+        // Nén mạnh hơn đối với ảnh từ camera
+        final compressedFile = await _compressImage(
+          fixedImage, 
+          quality: compressQuality,
+          maxWidth: isCamera ? 640 : 800,
+          maxHeight: isCamera ? 640 : 800,
+        );
       
-      final stream = http.ByteStream(compressedFile.openRead());
-      final length = await compressedFile.length();
+        final stream = http.ByteStream(compressedFile.openRead());
+        final length = await compressedFile.length();
       
-      final multipartFile = http.MultipartFile(
-        'images',
-        stream,
-        length,
-        filename: 'face_image_$i.jpg',
-      );
+        final multipartFile = http.MultipartFile(
+          'images',
+          stream,
+          length,
+          filename: 'face_image_$i.jpg',
+        );
       
-      request.files.add(multipartFile);
+        request.files.add(multipartFile);
+      }
     }
     
     try {
@@ -253,26 +330,41 @@ class ApiService {
     
     final uri = Uri.parse('$baseUrl/submit_attendance');
     var request = http.MultipartRequest('POST', uri);
+    request.headers.addAll(await _authHeaders());
     request.fields['student_id'] = studentId.toString();
     request.fields['class_id'] = classId.toString();
-      // Sửa hướng ảnh trước
+    // Same photo, same key: repeated taps get the first result back instead of re-verifying
+    request.headers['Idempotency-Key'] = '$studentId-$classId-${image.path.hashCode}-${await image.length()}';
+    
+    // Sửa hướng ảnh trước
     File fixedImage = await _fixExifRotation(image);
     
-    // Compress the image before uploading
-    final compressedFile = await _compressImage(fixedImage);
+    // Send only the on-device face crop when a face is found, the full selfie otherwise
+    final crop = await _faceCropService.cropLargestFace(fixedImage);
+    if (crop != null) {
+      request.files.add(http.MultipartFile.fromBytes(
+        'face_crop',
+        crop.bytes,
+        filename: 'attendance_face.jpg',
+      ));
+      request.fields['landmarks'] = crop.landmarksJson;
+    } else {
+      // Compress the image before uploading
+      final compressedFile = await _compressImage(fixedImage);
     
-    // Add the compressed selfie image to the request
-    final stream = http.ByteStream(compressedFile.openRead());
-    final length = await compressedFile.length();
+      // Add the compressed selfie image to the request
+      final stream = http.ByteStream(compressedFile.openRead());
+      final length = await compressedFile.length();
     
-    final multipartFile = http.MultipartFile(
-      'image',
-      stream,
-      length,
-      filename: 'attendance_selfie.jpg',
-    );
+      final multipartFile = http.MultipartFile(
+        'image',
+        stream,
+        length,
+        filename: 'attendance_selfie.jpg',
+      );
     
-    request.files.add(multipartFile);
+      request.files.add(multipartFile);
+    }
     request.persistentConnection = true;
     
     try {
@@ -301,6 +393,9 @@ class ApiService {
     }
   }
   
+  // Records per attendance history request
+  static const int _historyPageSize = 200;
+  
   // Get attendance history
   Future<Map<String, dynamic>> getAttendanceHistory() async {
     final studentId = await _getStudentId();
@@ -308,24 +403,33 @@ class ApiService {
       return {'success': false, 'message': 'Not logged in'};
     }
     
-    final uri = Uri.parse('$baseUrl/attendance_history/$studentId');
     try {
-      final response = await http.get(uri);
-      final data = json.decode(response.body);
+      // The history comes in pages; follow next_cursor until the last one
+      final attendanceList = <Attendance>[];
+      String? studentName;
+      String? cursor;
+      do {
+        final uri = Uri.parse('$baseUrl/attendance_history/$studentId').replace(queryParameters: {
+          'limit': '$_historyPageSize',
+          if (cursor != null) 'cursor': cursor,
+        });
+        final response = await http.get(uri, headers: await _authHeaders());
+        final data = json.decode(response.body);
+        
+        if (response.statusCode != 200) {
+          return {'success': false, 'message': data['message']};
+        }
+        studentName = data['student_name'];
+        attendanceList.addAll((data['attendance'] as List)
+          .map((item) => Attendance.fromJson(item)));
+        cursor = data['next_cursor'];
+      } while (cursor != null);
       
-      if (response.statusCode == 200) {
-        final attendanceList = (data['attendance'] as List)
-          .map((item) => Attendance.fromJson(item))
-          .toList();
-          
-        return {
-          'success': true, 
-          'student_name': data['student_name'],
-          'attendance': attendanceList,
-        };
-      } else {
-        return {'success': false, 'message': data['message']};
-      }
+      return {
+        'success': true, 
+        'student_name': studentName,
+        'attendance': attendanceList,
+      };
     } catch (e) {
       return {'success': false, 'message': e.toString()};
     }
@@ -340,7 +444,7 @@ class ApiService {
     
     final uri = Uri.parse('$baseUrl/profile/$studentId');
     try {
-      final response = await http.get(uri);
+      final response = await http.get(uri, headers: await _authHeaders());
       final data = json.decode(response.body);
       
       if (response.statusCode == 200) {
@@ -360,5 +464,8 @@ class ApiService {
   Future<void> logout() async {
     final prefs = await SharedPreferences.getInstance();
     await prefs.remove('student_id');
+    await prefs.remove('access_token');
+    await prefs.remove('refresh_token');
+    await prefs.remove('access_token_expires_at');
   }
 }
\ No newline at end of file
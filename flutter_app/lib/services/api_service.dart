@@ -4,8 +4,11 @@ import 'package:http/http.dart' as http;
 import 'package:shared_preferences/shared_preferences.dart';
 import '../models/student.dart';
 import '../models/attendance.dart';
+import 'face_crop_service.dart';
 
 class ApiService {
+  final FaceCropService _faceCropService = FaceCropService();
+  
   // Base URL của API server Flask
   // Đối với máy ảo Android, sử dụng 10.0.2.2 để tham chiếu localhost của máy tính
   static const String baseUrl = 'http://10.0.2.2:5001/api/student';
@@ -16,6 +19,54 @@ class ApiService {
     return prefs.getInt('student_id');
   }
   
+  // Store the signed tokens returned by /login, /refresh and /join_class
+  Future<void> _saveTokens(Map<String, dynamic> data) async {
+    if (data['access_token'] == null) {
+      return;
+    }
+    final prefs = await SharedPreferences.getInstance();
+    await prefs.setString('access_token', data['access_token']);
+    await prefs.setString('refresh_token', data['refresh_token']);
+    final expiresAt = DateTime.now().add(Duration(seconds: data['expires_in']));
+    await prefs.setInt('access_token_expires_at', expiresAt.millisecondsSinceEpoch);
+  }
+  
+  // Exchange the refresh token for new tokens; false when it is missing or rejected
+  Future<bool> _refreshTokens() async {
+    final prefs = await SharedPreferences.getInstance();
+    final refreshToken = prefs.getString('refresh_token');
+    if (refreshToken == null) {
+      return false;
+    }
+    try {
+      final response = await http.post(
+        Uri.parse('$baseUrl/refresh'),
+        headers: {'Content-Type': 'application/json'},
+        body: json.encode({'refresh_token': refreshToken}),
+      );
+      if (response.statusCode != 200) {
+        return false;
+      }
+      await _saveTokens(json.decode(response.body));
+      return true;
+    } catch (e) {
+      return false;
+    }
+  }
+  
+  // Authorization header for the student API, refreshing the access token
+  // shortly before it expires so uploads are never sent with a stale token
+  Future<Map<String, String>> _authHeaders() async {
+    final prefs = await SharedPreferences.getInstance();
+    final expiresAt = prefs.getInt('access_token_expires_at') ?? 0;
+    final refreshBy = DateTime.now().add(const Duration(seconds: 60)).millisecondsSinceEpoch;
+    if (expiresAt < refreshBy) {
+      await _refreshTokens();
+    }
+    final token = prefs.getString('access_token');
+    return token == null ? {} : {'Authorization': 'Bearer $token'};
+  }
+  
   // Register a new student
   Future<Map<String, dynamic>> registerStudent({
     required String name, 
@@ -66,6 +117,7 @@ class ApiService {
       if (response.statusCode == 200) {
         final prefs = await SharedPreferences.getInstance();
         await prefs.setInt('student_id', data['student_id']);
+        await _saveTokens(data);
         return {
           'success': true, 
           'student': Student.fromJson(data),
@@ -89,7 +141,7 @@ class ApiService {
     try {
       final response = await http.post(
         uri,
-        headers: {'Content-Type': 'application/json'},
+        headers: {'Content-Type': 'application/json', ...await _authHeaders()},
         body: json.encode({
           'student_id': studentId,
           'class_code': classCode,
@@ -99,6 +151,7 @@ class ApiService {
       final data = json.decode(response.body);
       
       if (response.statusCode == 200) {
+        await _saveTokens(data);
         return {'success': true, 'data': data};
       } else {
         return {'success': false, 'message': data['message']};
@@ -117,22 +170,45 @@ class ApiService {
     
     final uri = Uri.parse('$baseUrl/upload_faces');
     var request = http.MultipartRequest('POST', uri);
+    request.headers.addAll(await _authHeaders());
     request.fields['student_id'] = studentId.toString();
     
-    // Add all images to the request
-    for (var i = 0; i < images.length; i++) {
-      final file = images[i];
-      final stream = http.ByteStream(file.openRead());
-      final length = await file.length();
+    // Send small on-device face crops when a face is found in every photo
+    final crops = <FaceCrop>[];
+    for (final image in images) {
+      final crop = await _faceCropService.cropLargestFace(image);
+      if (crop == null) {
+        crops.clear();
+        break;
+      }
+      crops.add(crop);
+    }
+    
+    if (crops.isNotEmpty) {
+      for (var i = 0; i < crops.length; i++) {
+        request.files.add(http.MultipartFile.fromBytes(
+          'face_crops',
+          crops[i].bytes,
+          filename: 'face_crop_$i.jpg',
+        ));
+      }
+      request.fields['landmarks'] = json.encode(crops.map((crop) => crop.landmarks).toList());
+    } else {
+      // Add all images to the request
+      for (var i = 0; i < images.length; i++) {
+        final file = images[i];
+        final stream = http.ByteStream(file.openRead());
+        final length = await file.length();
       
-      final multipartFile = http.MultipartFile(
-        'images',
-        stream,
-        length,
-        filename: 'face_image_$i.jpg',
-      );
+        final multipartFile = http.MultipartFile(
+          'images',
+          stream,
+          length,
+          filename: 'face_image_$i.jpg',
+        );
       
-      request.files.add(multipartFile);
+        request.files.add(multipartFile);
+      }
     }
     
     try {
@@ -159,21 +235,35 @@ class ApiService {
     
     final uri = Uri.parse('$baseUrl/submit_attendance');
     var request = http.MultipartRequest('POST', uri);
+    request.headers.addAll(await _authHeaders());
     request.fields['student_id'] = studentId.toString();
     request.fields['class_id'] = classId.toString();
+    // Same photo, same key: repeated taps get the first result back instead of re-verifying
+    request.headers['Idempotency-Key'] = '$studentId-$classId-${image.path.hashCode}-${await image.length()}';
     
-    // Add the selfie image to the request
-    final stream = http.ByteStream(image.openRead());
-    final length = await image.length();
+    // Send only the on-device face crop when a face is found, the full selfie otherwise
+    final crop = await _faceCropService.cropLargestFace(image);
+    if (crop != null) {
+      request.files.add(http.MultipartFile.fromBytes(
+        'face_crop',
+        crop.bytes,
+        filename: 'attendance_face.jpg',
+      ));
+      request.fields['landmarks'] = crop.landmarksJson;
+    } else {
+      // Add the selfie image to the request
+      final stream = http.ByteStream(image.openRead());
+      final length = await image.length();
     
-    final multipartFile = http.MultipartFile(
-      'image',
-      stream,
-      length,
-      filename: 'attendance_selfie.jpg',
-    );
+      final multipartFile = http.MultipartFile(
+        'image',
+        stream,
+        length,
+        filename: 'attendance_selfie.jpg',
+      );
     
-    request.files.add(multipartFile);
+      request.files.add(multipartFile);
+    }
     
     try {
       final response = await request.send();
@@ -190,6 +280,9 @@ class ApiService {
     }
   }
   
+  // Records per attendance history request
+  static const int _historyPageSize = 200;
+  
   // Get attendance history
   Future<Map<String, dynamic>> getAttendanceHistory() async {
     final studentId = await _getStudentId();
@@ -197,24 +290,33 @@ class ApiService {
       return {'success': false, 'message': 'Not logged in'};
     }
     
-    final uri = Uri.parse('$baseUrl/attendance_history/$studentId');
     try {
-      final response = await http.get(uri);
-      final data = json.decode(response.body);
+      // The history comes in pages; follow next_cursor until the last one
+      final attendanceList = <Attendance>[];
+      String? studentName;
+      String? cursor;
+      do {
+        final uri = Uri.parse('$baseUrl/attendance_history/$studentId').replace(queryParameters: {
+          'limit': '$_historyPageSize',
+          if (cursor != null) 'cursor': cursor,
+        });
+        final response = await http.get(uri, headers: await _authHeaders());
+        final data = json.decode(response.body);
+        
+        if (response.statusCode != 200) {
+          return {'success': false, 'message': data['message']};
+        }
+        studentName = data['student_name'];
+        attendanceList.addAll((data['attendance'] as List)
+          .map((item) => Attendance.fromJson(item)));
+        cursor = data['next_cursor'];
+      } while (cursor != null);
       
-      if (response.statusCode == 200) {
-        final attendanceList = (data['attendance'] as List)
-          .map((item) => Attendance.fromJson(item))
-          .toList();
-          
-        return {
-          'success': true, 
-          'student_name': data['student_name'],
-          'attendance': attendanceList,
-        };
-      } else {
-        return {'success': false, 'message': data['message']};
-      }
+      return {
+        'success': true, 
+        'student_name': studentName,
+        'attendance': attendanceList,
+      };
     } catch (e) {
       return {'success': false, 'message': e.toString()};
     }
@@ -229,7 +331,7 @@ class ApiService {
     
     final uri = Uri.parse('$baseUrl/profile/$studentId');
     try {
-      final response = await http.get(uri);
+      final response = await http.get(uri, headers: await _authHeaders());
       final data = json.decode(response.body);
       
       if (response.statusCode == 200) {
@@ -249,5 +351,8 @@ class ApiService {
   Future<void> logout() async {
     final prefs = await SharedPreferences.getInstance();
     await prefs.remove('student_id');
+    await prefs.remove('access_token');
+    await prefs.remove('refresh_token');
+    await prefs.remove('access_token_expires_at');
   }
 }
\ No newline at end of file
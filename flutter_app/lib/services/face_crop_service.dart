@@ -0,0 +1,84 @@
+import 'dart:convert';
+import 'dart:io';
+import 'dart:math' as math;
+import 'package:google_mlkit_face_detection/google_mlkit_face_detection.dart';
+import 'package:image/image.dart' as img;
+
+// A face cropped on the device, ready to send instead of the full photo
+class FaceCrop {
+  final List<int> bytes;
+  final Map<String, dynamic> landmarks;
+
+  FaceCrop(this.bytes, this.landmarks);
+
+  String get landmarksJson => json.encode(landmarks);
+}
+
+class FaceCropService {
+  // Output size and margin around the detected box; the server accepts 96-320 px crops
+  static const int cropSize = 224;
+  static const double margin = 0.3;
+  static const int jpegQuality = 90;
+
+  final FaceDetector _detector = FaceDetector(
+    options: FaceDetectorOptions(
+      enableLandmarks: true,
+      performanceMode: FaceDetectorMode.fast,
+    ),
+  );
+
+  // Detect the largest face and return a small square crop around it,
+  // or null when no face is found (callers then upload the full photo)
+  Future<FaceCrop?> cropLargestFace(File file) async {
+    try {
+      final faces = await _detector.processImage(InputImage.fromFilePath(file.path));
+      if (faces.isEmpty) {
+        return null;
+      }
+      final face = faces.reduce((a, b) =>
+          a.boundingBox.width * a.boundingBox.height >= b.boundingBox.width * b.boundingBox.height ? a : b);
+
+      final decoded = img.decodeImage(await file.readAsBytes());
+      if (decoded == null) {
+        return null;
+      }
+      final image = img.bakeOrientation(decoded);
+
+      // Square box around the face, grown by the margin and clamped to the image
+      final box = face.boundingBox;
+      final side = math.min(
+        (math.max(box.width, box.height) * (1 + 2 * margin)).round(),
+        math.min(image.width, image.height),
+      );
+      final left = (box.center.dx - side / 2).round().clamp(0, image.width - side);
+      final top = (box.center.dy - side / 2).round().clamp(0, image.height - side);
+
+      final crop = img.copyResize(
+        img.copyCrop(image, x: left, y: top, width: side, height: side),
+        width: cropSize,
+        height: cropSize,
+      );
+
+      // Eye positions in crop pixels, used by the server to sanity-check the crop
+      final scale = cropSize / side;
+      final eyes = [FaceLandmarkType.leftEye, FaceLandmarkType.rightEye]
+          .map((type) => face.landmarks[type])
+          .where((landmark) => landmark != null)
+          .map((landmark) => [
+                ((landmark!.position.x - left) * scale).round(),
+                ((landmark.position.y - top) * scale).round(),
+              ])
+          .toList();
+
+      return FaceCrop(
+        img.encodeJpg(crop, quality: jpegQuality),
+        eyes.length == 2 ? {'eyes': eyes} : {},
+      );
+    } catch (e) {
+      print('On-device face detection failed: $e');
+      return null;
+    }
+  }
+
+  Future<void> close() => _detector.close();
+}
@@ -0,0 +1,640 @@
+"""
+Class-start load test.
+
+Seeds classes, students and galleries into a scratch database, serves the app
+on a local port and replays a burst of student attendance submissions, teacher
+recognition requests and attendance-page polls against it, then reports
+throughput, latency percentiles and error rates per endpoint.
+
+With --check-query-budgets it instead seeds some attendance history, calls
+every endpoint listed in QUERY_BUDGETS in-process with app.testing set, and
+exits non-zero when one of them issues more SQL statements than its budget.
+With --check-gallery-updates it has concurrent writers each enroll one
+student into a new class and exits non-zero unless every one of them ends up
+in the class gallery. With --check-tiled-detection it detects group photos
+tile by tile both in-process and through an inference server on a local
+socket, and exits non-zero unless the server finds every small face the
+in-process detector finds.
+
+    python load_test.py --students 300 --duration 90 --curve burst
+    python load_test.py --embedder real --photos student_images/faces --server prefork --workers 4
+    python load_test.py --check-query-budgets --students 120 --classes 4
+    python load_test.py --check-gallery-updates --writers 16 --students 12 --classes 2
+    python load_test.py --check-tiled-detection [--embedder real --photos group_photos]
+"""
+import argparse
+import contextlib
+import http.cookiejar
+import io
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+
+import numpy as np
+
+TEACHER_EMAIL = 'loadtest@example.com'
+TEACHER_PASSWORD = 'loadtest-password'
+
+
+def prepare_environment(args):
+    """
+    Point the database, galleries and photo store at a scratch directory.
+    Settings are read when the app package is imported, so this must run first.
+    Returns the scratch directory.
+    """
+    scratch_dir = args.scratch_dir or tempfile.mkdtemp(prefix='attendance-loadtest-')
+    os.makedirs(scratch_dir, exist_ok=True)
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(scratch_dir, 'loadtest.db')}"
+    os.environ['EMBEDDINGS_DIR'] = os.path.join(scratch_dir, 'embeddings')
+    os.environ['PHOTO_STORE_DIR'] = os.path.join(scratch_dir, 'photo_store')
+    os.environ['FACE_CROP_CACHE_DIR'] = os.path.join(scratch_dir, 'face_crops')
+    if args.embedder == 'stub':
+        os.environ['FACE_EMBEDDER'] = 'stub'
+        os.environ['STUB_DETECT_MS'] = str(args.stub_detect_ms)
+        os.environ['STUB_EMBED_MS'] = str(args.stub_embed_ms)
+    return scratch_dir
+
+
+def arrival_times(count, duration, curve, rng):
+    """Sorted request offsets in seconds for count arrivals spread over duration"""
+    if count <= 0:
+        return []
+    if curve == 'uniform':
+        offsets = rng.uniform(0, duration, count)
+    elif curve == 'ramp':
+        # Density grows linearly towards the end
+        offsets = duration * np.sqrt(rng.uniform(0, 1, count))
+    elif curve == 'poisson':
+        offsets = np.cumsum(rng.exponential(duration / count, count))
+    elif curve == 'burst':
+        # Class start: most students arrive in the first third, with a long tail
+        offsets = duration * rng.beta(2, 5, count)
+    else:
+        raise ValueError(f"Unknown arrival curve: {curve}")
+    return sorted(float(offset) for offset in offsets)
+
+
+def _multipart(fields, files):
+    """Encode form fields and (name, filename, bytes) files as multipart/form-data"""
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    for name, filename, data in files:
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+                     f'Content-Type: image/jpeg\r\n\r\n'.encode() + data + b'\r\n')
+    parts.append(f'--{boundary}--\r\n'.encode())
+    return b''.join(parts), f'multipart/form-data; boundary={boundary}'
+
+
+class Recorder:
+    """Latency and status of every request, grouped by endpoint"""
+
+    def __init__(self):
+        self.samples = {}
+        self._lock = threading.Lock()
+
+    def record(self, endpoint, status, seconds):
+        with self._lock:
+            self.samples.setdefault(endpoint, []).append((status, seconds))
+
+    def report(self, elapsed):
+        report = {}
+        for endpoint, samples in sorted(self.samples.items()):
+            latencies = np.array([seconds for _, seconds in samples]) * 1000
+            statuses = {}
+            for status, _ in samples:
+                statuses[str(status)] = statuses.get(str(status), 0) + 1
+            # Anything but a successful 2xx: transport errors, rejections, failed verifications
+            errors = sum(1 for status, _ in samples if not (isinstance(status, int) and 200 <= status < 300))
+            report[endpoint] = {
+                'requests': len(samples),
+                'throughput_rps': round(len(samples) / elapsed, 2) if elapsed else None,
+                'p50_ms': round(float(np.percentile(latencies, 50)), 1),
+                'p95_ms': round(float(np.percentile(latencies, 95)), 1),
+                'p99_ms': round(float(np.percentile(latencies, 99)), 1),
+                'max_ms': round(float(latencies.max()), 1),
+                'error_rate': round(errors / len(samples), 4),
+                'statuses': statuses,
+            }
+        return report
+
+
+class LoadClient:
+    def __init__(self, base_url, recorder, timeout):
+        self.base_url = base_url
+        self.recorder = recorder
+        self.timeout = timeout
+
+    def request(self, endpoint, path, opener=None, data=None, content_type=None, headers=None):
+        request = urllib.request.Request(self.base_url + path, data=data, headers=dict(headers or {}))
+        if content_type:
+            request.add_header('Content-Type', content_type)
+        start = time.perf_counter()
+        try:
+            with (opener or urllib.request.build_opener()).open(request, timeout=self.timeout) as response:
+                body = response.read()
+                status = response.status
+        except urllib.error.HTTPError as e:
+            body = e.read()
+            status = e.code
+        except Exception:
+            body = b''
+            status = 'error'
+        seconds = time.perf_counter() - start
+        # Several endpoints answer failures with 200 and success: false
+        if status == 200 and body.startswith(b'{'):
+            try:
+                if json.loads(body).get('success') is False:
+                    status = '200-failed'
+            except ValueError:
+                pass
+        self.recorder.record(endpoint, status, seconds)
+        return status
+
+
+def seed(app, args, rng):
+    """
+    Create one teacher, the classes and their students with galleries.
+    Returns (teacher_id, classes) with classes as {class_id: [(student_id, token, photo), ...]}.
+    """
+    from app import db
+    from app.models import Class, Student, Teacher
+    from app.utils.face_embedder import get_shared_embedder
+    from app.utils.gallery_store import save_gallery
+    from app.utils.student_tokens import issue_tokens
+
+    embedder = get_shared_embedder()
+    photos = []
+    if args.embedder == 'real':
+        photo_dir = args.photos
+        photos = sorted(os.path.join(root, name) for root, _, names in os.walk(photo_dir)
+                        for name in names if name.lower().endswith(('.jpg', '.jpeg', '.png')))
+        if not photos:
+            raise SystemExit(f"No photos found under {photo_dir}")
+
+    with app.app_context():
+        teacher = Teacher(username='loadtest', email=TEACHER_EMAIL)
+        teacher.set_password(TEACHER_PASSWORD)
+        db.session.add(teacher)
+        db.session.commit()
+
+        # Hash once; per-student hashing would dominate seeding time
+        password_hash = teacher.password_hash
+        classes = {}
+        for c in range(args.classes):
+            class_obj = Class(name=f'Load test {c + 1}', teacher_id=teacher.id, class_code=f'LT{c + 1:04d}')
+            db.session.add(class_obj)
+            db.session.flush()
+            students = []
+            for s in range(args.students // args.classes + (c < args.students % args.classes)):
+                student = Student(name=f'Student {c + 1}-{s + 1}', email=f'student{c + 1}-{s + 1}@example.com',
+                                  class_id=class_obj.id, password_hash=password_hash, face_encoding_complete=True)
+                db.session.add(student)
+                students.append(student)
+            db.session.flush()
+            classes[class_obj.id] = students
+        db.session.commit()
+
+        seeded = {}
+        for class_id, students in classes.items():
+            gallery = {}
+            entries = []
+            for student in students:
+                if photos:
+                    with open(photos[student.id % len(photos)], 'rb') as f:
+                        photo = f.read()
+                else:
+                    from app.utils.stub_embedder import synthetic_face
+                    photo = synthetic_face(student.id)
+                embedding = embedder.compute_average_embedding([photo])
+                if embedding is None:
+                    print(f"No face found in the photo of student {student.id}; it will fail verification")
+                else:
+                    gallery[str(student.id)] = embedding
+                entries.append((student.id, issue_tokens(student)['access_token'], photo))
+            save_gallery(class_id, gallery, embedder.model_version)
+            seeded[class_id] = entries
+        return teacher.id, seeded
+
+
+def jittered(photo, seed):
+    """The same photo with light pixel noise, so repeat uploads differ in bytes"""
+    import cv2
+    image = cv2.imdecode(np.frombuffer(photo, np.uint8), cv2.IMREAD_COLOR)
+    noise = np.random.default_rng(seed).integers(-3, 4, image.shape)
+    image = np.clip(image.astype(np.int16) + noise, 0, 255).astype(np.uint8)
+    return cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, 90])[1].tobytes()
+
+
+def _free_port():
+    with contextlib.closing(socket.socket(socket.AF_INET, socket.SOCK_STREAM)) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(app, args):
+    """Serve the app on a local port; returns (base_url, stop)"""
+    port = _free_port()
+    if args.server == 'prefork':
+        from app import db
+        from app.utils.face_embedder import get_shared_embedder
+        from app.utils.prefork_server import PreforkServer
+
+        def preload():
+            get_shared_embedder()
+            with app.app_context():
+                db.engine.dispose()
+
+        server = PreforkServer(app, '127.0.0.1', port, workers=args.workers, max_requests=0, preload=preload)
+        process = multiprocessing.get_context('fork').Process(target=server.run, daemon=True)
+        process.start()
+
+        def stop():
+            os.kill(process.pid, signal.SIGTERM)
+            process.join(10)
+    else:
+        from werkzeug.serving import make_server
+        server = make_server('127.0.0.1', port, app, threaded=True)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+
+        def stop():
+            server.shutdown()
+
+    base_url = f'http://127.0.0.1:{port}'
+    deadline = time.monotonic() + 60
+    while True:
+        try:
+            urllib.request.urlopen(base_url + '/', timeout=2).read()
+            break
+        except urllib.error.HTTPError:
+            break
+        except Exception:
+            if time.monotonic() > deadline:
+                stop()
+                raise SystemExit('Server did not start')
+            time.sleep(0.2)
+    return base_url, stop
+
+
+def teacher_opener(base_url):
+    """An opener holding a logged-in teacher session"""
+    opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+    data = urllib.parse.urlencode({'email': TEACHER_EMAIL, 'password': TEACHER_PASSWORD}).encode()
+    opener.open(urllib.request.Request(base_url + '/login', data=data), timeout=30).read()
+    return opener
+
+
+def build_schedule(classes, args, rng):
+    """(offset, kind, payload) events for the whole run, sorted by offset"""
+    events = []
+    students = [(class_id, entry) for class_id, entries in classes.items() for entry in entries]
+    order = rng.permutation(len(students))
+    offsets = arrival_times(len(students), args.duration, args.curve, rng)
+    for offset, index in zip(offsets, order):
+        class_id, entry = students[index]
+        key = uuid.uuid4().hex
+        events.append((offset, 'submit', (class_id, entry, key)))
+        # Impatient students tap submit again with the same photo
+        if rng.random() < args.repeat_taps:
+            for _ in range(int(rng.integers(1, 3))):
+                events.append((offset + float(rng.uniform(0.2, 2.0)), 'submit', (class_id, entry, key)))
+
+    for class_id, entries in classes.items():
+        if args.recognize_interval > 0:
+            offset = float(rng.uniform(0, args.recognize_interval))
+            while offset < args.duration:
+                chosen = [entries[i] for i in rng.choice(len(entries), min(4, len(entries)), replace=False)]
+                events.append((offset, 'recognize', (class_id, chosen)))
+                offset += args.recognize_interval
+        if args.poll_interval > 0:
+            offset = float(rng.uniform(0, args.poll_interval))
+            while offset < args.duration:
+                events.append((offset, 'poll', (class_id,)))
+                offset += args.poll_interval
+    return sorted(events, key=lambda event: event[0])
+
+
+def run_load(client, opener, events, concurrency):
+    """Fire the events at their offsets; returns the elapsed seconds"""
+    counter = iter(range(1, 10 ** 9))
+
+    def submit(class_id, entry, key):
+        student_id, token, photo = entry
+        body, content_type = _multipart({'class_id': class_id},
+                                        [('image', 'selfie.jpg', jittered(photo, next(counter)))])
+        client.request('submit_attendance', '/api/student/submit_attendance', data=body,
+                       content_type=content_type,
+                       headers={'Authorization': f'Bearer {token}', 'Idempotency-Key': key})
+
+    def recognize(class_id, chosen):
+        files = [('image', f'photo{i}.jpg', jittered(photo, next(counter))) for i, (_, _, photo) in enumerate(chosen)]
+        body, content_type = _multipart({'class_id': class_id}, files)
+        client.request('recognize', '/api/recognize', opener=opener, data=body, content_type=content_type)
+
+    def poll(class_id):
+        client.request('attendance_poll', f'/classes/{class_id}/attendance-data', opener=opener)
+
+    handlers = {'submit': submit, 'recognize': recognize, 'poll': poll}
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for offset, kind, payload in events:
+            delay = start + offset - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(handlers[kind], *payload)
+    return time.monotonic() - start
+
+
+def seed_history(app, classes, days, rng):
+    """Attendance for the past days, most students present, so history and reports have rows to read"""
+    from app import db
+    from app.models import Attendance, AttendanceDailySummary
+
+    with app.app_context():
+        for offset in range(1, days + 1):
+            day = date.today() - timedelta(days=offset)
+            marks = [(student_id, class_id, day, datetime.combine(day, datetime.min.time()) + timedelta(hours=9))
+                     for class_id, entries in classes.items()
+                     for student_id, _, _ in entries if rng.random() < 0.8]
+            _, newly_present = Attendance.mark_present(marks)
+            for (class_id, marked_day), count in newly_present.items():
+                AttendanceDailySummary.add_present(class_id, marked_day, count)
+            db.session.commit()
+
+
+def check_query_budgets(app, classes, days):
+    """
+    Call each endpoint in QUERY_BUDGETS with the test client and compare its
+    X-Query-Count with the budget. Returns the number of failed checks.
+    """
+    budgets = app.config['QUERY_BUDGETS']
+    app.testing = True
+    client = app.test_client()
+    client.post('/login', data={'email': TEACHER_EMAIL, 'password': TEACHER_PASSWORD})
+
+    class_ids = list(classes)
+    student_id, token, photo = classes[class_ids[0]][0]
+    photos = [entry[2] for entry in classes[class_ids[0]][:4]]
+    start = (date.today() - timedelta(days=days)).isoformat()
+    auth = {'Authorization': f'Bearer {token}'}
+    checks = [
+        ('api.recognize_face', 'recognize, one photo',
+         lambda: client.post('/api/recognize', data={'class_id': class_ids[0],
+                                                     'image': [(io.BytesIO(photo), 'photo.jpg')]})),
+        ('api.recognize_face', f'recognize, {len(photos)} photos',
+         lambda: client.post('/api/recognize', data={
+             'class_id': class_ids[0],
+             'image': [(io.BytesIO(data), f'photo{i}.jpg') for i, data in enumerate(photos)]})),
+        ('student_api.attendance_history', 'history, whole',
+         lambda: client.get(f'/api/student/attendance_history/{student_id}', headers=auth)),
+        ('student_api.attendance_history', 'history, paged',
+         lambda: client.get(f'/api/student/attendance_history/{student_id}?limit=3', headers=auth)),
+        ('api.attendance_report', f'report, {len(class_ids)} classes',
+         lambda: client.get(f'/api/attendance-report?start={start}')),
+        ('api.attendance_report', f'report, {len(class_ids)} classes with students',
+         lambda: client.get(f'/api/attendance-report?start={start}&students=1')),
+    ]
+
+    missing = sorted(set(budgets) - {endpoint for endpoint, _, _ in checks})
+    failures = len(missing)
+    for endpoint in missing:
+        print(f"{endpoint}: in QUERY_BUDGETS but not exercised by this check")
+
+    print(f"{'endpoint':<34}{'case':<32}{'queries':>8}{'budget':>8}  result")
+    for endpoint, case, call in checks:
+        budget = budgets.get(endpoint)
+        try:
+            # Keep the app's prints out of the table
+            with contextlib.redirect_stdout(io.StringIO()):
+                response = call()
+        except AssertionError as e:
+            # Raised by the query counter when the budget is exceeded
+            failures += 1
+            print(f"{endpoint:<34}{case:<32}{'-':>8}{budget:>8}  FAIL {e}")
+            continue
+        count = response.headers.get('X-Query-Count')
+        body = response.get_json(silent=True) or {}
+        if response.status_code != 200 or body.get('success') is False:
+            failures += 1
+            print(f"{endpoint:<34}{case:<32}{count or '-':>8}{budget:>8}  FAIL status {response.status_code} "
+                  f"{body.get('message', '')}")
+        else:
+            print(f"{endpoint:<34}{case:<32}{count:>8}{budget:>8}  ok")
+    return failures
+
+
+def check_gallery_updates(app, teacher_id, writers, rounds):
+    """
+    Enroll one student per writer thread into a class with no gallery yet, all
+    at once through update_gallery, and check that every one of them is in the
+    saved gallery and its catalog count. Returns the number of failed checks.
+    """
+    from app import db
+    from app.models import Class
+    from app.utils.gallery_store import GalleryConflict, get_gallery_entry, load_gallery, update_gallery
+
+    failures = 0
+    for round_number in range(rounds):
+        with app.app_context():
+            class_obj = Class(name=f'Gallery check {round_number + 1}', teacher_id=teacher_id,
+                              class_code=f'GC{uuid.uuid4().hex[:8].upper()}')
+            db.session.add(class_obj)
+            db.session.commit()
+            class_id = class_obj.id
+
+        barrier = threading.Barrier(writers)
+        errors = []
+
+        def enroll(index):
+            embedding = np.random.default_rng(index).normal(size=128).astype(np.float32)
+            with app.app_context():
+                barrier.wait()
+                try:
+                    update_gallery(class_id, lambda gallery: gallery.update({f'writer-{index}': embedding}))
+                except GalleryConflict as e:
+                    errors.append(str(e))
+
+        threads = [threading.Thread(target=enroll, args=(index,)) for index in range(writers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        with app.app_context():
+            gallery = load_gallery(class_id)
+            count = get_gallery_entry(class_id).student_count
+        missing = sorted(f'writer-{index}' for index in range(writers) if f'writer-{index}' not in gallery)
+        ok = not missing and not errors and count == writers
+        failures += not ok
+        print(f"round {round_number + 1}: {len(gallery)}/{writers} in gallery, catalog count {count}, "
+              f"{len(errors)} gave up  {'ok' if ok else 'FAIL missing ' + ', '.join(missing)}")
+    return failures
+
+
+def check_tiled_detection(args, scratch_dir):
+    """
+    Small-face recall of group-photo detection through the inference server,
+    against the same tiling run in-process. With the stub embedder the photo
+    is cut into tiles so small that their faces are below the default minimum
+    face size and only found with DETECT_TILE_MIN_FACE. Returns the number of
+    failed checks.
+    """
+    from app.utils.face_embedder import get_shared_embedder
+    from app.utils.inference_client import RemoteFaceEmbedder
+    from app.utils.inference_server import InferenceServer
+    from app.utils.tiled_detection import TiledDetector
+
+    local = get_shared_embedder()
+    socket_path = os.path.join(scratch_dir, 'inference.sock')
+    server = InferenceServer(socket_path, local)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    remote = RemoteFaceEmbedder(socket_path, model_version=local.model_version)
+
+    if args.embedder == 'stub':
+        from app.utils.stub_embedder import synthetic_face
+        photos = [('synthetic 128px, 32px tiles', synthetic_face(1, size=128))]
+        tile_size, overlap = 32, 0.0
+    else:
+        paths = sorted(os.path.join(root, name) for root, _, names in os.walk(args.photos)
+                       for name in names if name.lower().endswith(('.jpg', '.jpeg', '.png')))
+        photos = []
+        for path in paths:
+            with open(path, 'rb') as f:
+                photos.append((os.path.relpath(path, args.photos), f.read()))
+        tile_size, overlap = None, None
+
+    failures = 0
+    try:
+        for name, photo in photos:
+            image = local.load_image(photo)
+            expected = TiledDetector(local.detect_tile, tile_size, overlap).detect(image)
+            found = TiledDetector(remote.detect_tile, tile_size, overlap).detect(image)
+            expected_boxes = {tuple(int(v) for v in face['box']) for face in expected}
+            found_boxes = {tuple(int(v) for v in face['box']) for face in found}
+            recalled = len(expected_boxes & found_boxes)
+            ok = bool(expected_boxes) and recalled == len(expected_boxes)
+            failures += not ok
+            print(f"{name}: in-process {len(expected_boxes)} faces, inference server {len(found_boxes)}, "
+                  f"recall {recalled}/{len(expected_boxes)}  {'ok' if ok else 'FAIL'}")
+    finally:
+        server.shutdown()
+        server.server_close()
+    return failures
+
+
+def print_report(report, elapsed):
+    print(f"\nLoad test finished in {elapsed:.1f}s\n")
+    print(f"{'endpoint':<20}{'requests':>9}{'rps':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'max ms':>9}{'errors':>8}  statuses")
+    for endpoint, stats in report.items():
+        print(f"{endpoint:<20}{stats['requests']:>9}{stats['throughput_rps']:>8}{stats['p50_ms']:>9}"
+              f"{stats['p95_ms']:>9}{stats['p99_ms']:>9}{stats['max_ms']:>9}{stats['error_rate']:>8.1%}  "
+              f"{stats['statuses']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Simulate a class-start burst against a scratch copy of the app')
+    parser.add_argument('--students', type=int, default=300, help='Students in total, spread over the classes')
+    parser.add_argument('--classes', type=int, default=6, help='Number of classes')
+    parser.add_argument('--duration', type=float, default=90, help='Seconds over which students arrive')
+    parser.add_argument('--curve', choices=['burst', 'uniform', 'ramp', 'poisson'], default='burst',
+                        help='Arrival curve of student submissions')
+    parser.add_argument('--repeat-taps', type=float, default=0.2,
+                        help='Fraction of students who resubmit with the same idempotency key')
+    parser.add_argument('--recognize-interval', type=float, default=15,
+                        help='Seconds between recognition requests per class (0 = none)')
+    parser.add_argument('--poll-interval', type=float, default=5,
+                        help='Seconds between attendance-page polls per class (0 = none)')
+    parser.add_argument('--concurrency', type=int, default=64, help='Client threads')
+    parser.add_argument('--timeout', type=float, default=60, help='Per-request timeout in seconds')
+    parser.add_argument('--embedder', choices=['stub', 'real'], default='stub',
+                        help='stub: deterministic model-free embedder; real: FaceNet and MTCNN')
+    parser.add_argument('--photos', help='Directory of face photos for --embedder real, assigned round-robin')
+    parser.add_argument('--stub-detect-ms', type=float, default=40, help='Simulated detection time of the stub')
+    parser.add_argument('--stub-embed-ms', type=float, default=15, help='Simulated embedding time of the stub')
+    parser.add_argument('--server', choices=['thread', 'prefork'], default='thread',
+                        help='thread: threaded server in this process; prefork: PreforkServer in a child process')
+    parser.add_argument('--workers', type=int, default=2, help='Worker processes for --server prefork')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed for arrivals and traffic mix')
+    parser.add_argument('--scratch-dir', help='Where to put the scratch database and galleries (default: a temp dir)')
+    parser.add_argument('--json', dest='json_path', help='Also write the report as JSON to this file')
+    parser.add_argument('--server-output', action='store_true', help='Show request logs and prints of the app')
+    parser.add_argument('--check-query-budgets', action='store_true',
+                        help='Check the endpoints in QUERY_BUDGETS against their budgets instead of load testing')
+    parser.add_argument('--history-days', type=int, default=20,
+                        help='Days of past attendance seeded for --check-query-budgets')
+    parser.add_argument('--check-gallery-updates', action='store_true',
+                        help='Check that concurrent enrollments into one class all reach its gallery')
+    parser.add_argument('--writers', type=int, default=16, help='Concurrent writers for --check-gallery-updates')
+    parser.add_argument('--rounds', type=int, default=4, help='Classes enrolled into by --check-gallery-updates')
+    parser.add_argument('--check-tiled-detection', action='store_true',
+                        help='Check that group-photo tiles detected by the inference server keep their small faces')
+    args = parser.parse_args()
+
+    if args.embedder == 'real' and not args.photos:
+        parser.error('--embedder real needs --photos')
+    scratch_dir = prepare_environment(args)
+    if not args.server_output:
+        logging.getLogger('attendance-app').setLevel(logging.WARNING)
+        logging.getLogger('werkzeug').setLevel(logging.ERROR)
+
+    from app import create_app
+    app = create_app()
+    app.config['WTF_CSRF_ENABLED'] = False
+
+    if args.check_tiled_detection:
+        failures = check_tiled_detection(args, scratch_dir)
+        print(f"\nScratch data left in {scratch_dir}")
+        return 1 if failures else 0
+
+    rng = np.random.default_rng(args.seed)
+    print(f"Seeding {args.students} students in {args.classes} classes into {scratch_dir}")
+    teacher_id, classes = seed(app, args, rng)
+
+    if args.check_gallery_updates:
+        failures = check_gallery_updates(app, teacher_id, args.writers, args.rounds)
+        print(f"\nScratch data left in {scratch_dir}")
+        return 1 if failures else 0
+
+    if args.check_query_budgets:
+        seed_history(app, classes, args.history_days, rng)
+        failures = check_query_budgets(app, classes, args.history_days)
+        print(f"\nScratch data left in {scratch_dir}")
+        return 1 if failures else 0
+
+    base_url, stop = start_server(app, args)
+    try:
+        client = LoadClient(base_url, Recorder(), args.timeout)
+        opener = teacher_opener(base_url)
+        events = build_schedule(classes, args, rng)
+        print(f"Sending {len(events)} requests over {args.duration:.0f}s ({args.curve} arrivals) to {base_url}")
+        with open(os.devnull, 'w') as devnull, \
+                (contextlib.nullcontext() if args.server_output else contextlib.redirect_stdout(devnull)):
+            elapsed = run_load(client, opener, events, args.concurrency)
+    finally:
+        stop()
+
+    report = client.recorder.report(elapsed)
+    print_report(report, elapsed)
+    if args.json_path:
+        with open(args.json_path, 'w') as f:
+            json.dump({'elapsed_s': round(elapsed, 2), 'args': vars(args), 'endpoints': report}, f, indent=2)
+    print(f"\nScratch data left in {scratch_dir}")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
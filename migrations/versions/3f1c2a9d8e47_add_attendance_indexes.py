@@ -0,0 +1,45 @@
+"""Add composite indexes to attendance
+
+Revision ID: 3f1c2a9d8e47
+Revises: 0726675f13b2
+Create Date: 2026-10-19 09:12:04.518230
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.engine.reflection import Inspector
+
+
+# revision identifiers, used by Alembic.
+revision = '3f1c2a9d8e47'
+down_revision = '0726675f13b2'
+branch_labels = None
+depends_on = None
+
+
+ATTENDANCE_INDEXES = {
+    'ix_attendance_class_id_date': ['class_id', 'date'],
+    'ix_attendance_student_id_date': ['student_id', 'date'],
+    'ix_attendance_student_id_status_timestamp': ['student_id', 'status', 'timestamp'],
+}
+
+
+def upgrade():
+    conn = op.get_bind()
+    inspector = Inspector.from_engine(conn)
+
+    # db.create_all() may already have created these on a fresh database
+    existing = {index['name'] for index in inspector.get_indexes('attendance')}
+    for name, columns in ATTENDANCE_INDEXES.items():
+        if name not in existing:
+            op.create_index(name, 'attendance', columns, unique=False)
+
+
+def downgrade():
+    conn = op.get_bind()
+    inspector = Inspector.from_engine(conn)
+
+    existing = {index['name'] for index in inspector.get_indexes('attendance')}
+    for name in ATTENDANCE_INDEXES:
+        if name in existing:
+            op.drop_index(name, table_name='attendance')
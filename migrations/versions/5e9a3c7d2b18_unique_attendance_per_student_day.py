@@ -0,0 +1,58 @@
+"""Make attendance unique per student, class and date
+
+Revision ID: 5e9a3c7d2b18
+Revises: c4e7a1f90b2d
+Create Date: 2026-10-19 21:05:37.118402
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.engine.reflection import Inspector
+
+
+# revision identifiers, used by Alembic.
+revision = '5e9a3c7d2b18'
+down_revision = 'c4e7a1f90b2d'
+branch_labels = None
+depends_on = None
+
+
+INDEX_NAME = 'uq_attendance_student_class_date'
+
+
+def upgrade():
+    conn = op.get_bind()
+    inspector = Inspector.from_engine(conn)
+
+    # db.create_all() may already have created the index on a fresh database
+    if INDEX_NAME in {index['name'] for index in inspector.get_indexes('attendance')}:
+        return
+
+    # Concurrent submissions could insert the same day twice; keep one row per
+    # key, preferring a Present row and then the newest
+    op.execute("""
+        DELETE FROM attendance WHERE id IN (
+            SELECT a.id FROM attendance a
+            JOIN attendance b
+              ON b.student_id = a.student_id AND b.class_id = a.class_id AND b.date = a.date
+            WHERE (CASE WHEN b.status THEN 1 ELSE 0 END) > (CASE WHEN a.status THEN 1 ELSE 0 END)
+               OR ((CASE WHEN b.status THEN 1 ELSE 0 END) = (CASE WHEN a.status THEN 1 ELSE 0 END)
+                   AND b.id > a.id)
+        )
+    """)
+
+    # Duplicates were counted in the daily summary; recount what is left
+    op.execute("""
+        UPDATE attendance_daily_summary SET present_count = (
+            SELECT COUNT(*) FROM attendance a
+            WHERE a.class_id = attendance_daily_summary.class_id
+              AND a.date = attendance_daily_summary.date
+              AND a.status
+        )
+    """)
+
+    op.create_index(INDEX_NAME, 'attendance', ['student_id', 'class_id', 'date'], unique=True)
+
+
+def downgrade():
+    op.drop_index(INDEX_NAME, table_name='attendance')
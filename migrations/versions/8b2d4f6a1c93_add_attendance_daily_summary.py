@@ -0,0 +1,53 @@
+"""Add attendance_daily_summary
+
+Revision ID: 8b2d4f6a1c93
+Revises: 3f1c2a9d8e47
+Create Date: 2026-10-19 19:40:12.204117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.engine.reflection import Inspector
+
+
+# revision identifiers, used by Alembic.
+revision = '8b2d4f6a1c93'
+down_revision = '3f1c2a9d8e47'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    conn = op.get_bind()
+    inspector = Inspector.from_engine(conn)
+
+    # db.create_all() may already have created the table on a fresh database
+    if 'attendance_daily_summary' not in inspector.get_table_names():
+        op.create_table('attendance_daily_summary',
+            sa.Column('class_id', sa.Integer(), nullable=False),
+            sa.Column('date', sa.Date(), nullable=False),
+            sa.Column('present_count', sa.Integer(), nullable=False),
+            sa.Column('enrolled_count', sa.Integer(), nullable=False),
+            sa.Column('updated_at', sa.DateTime(), nullable=True),
+            sa.ForeignKeyConstraint(['class_id'], ['class.id'], ),
+            sa.PrimaryKeyConstraint('class_id', 'date')
+        )
+
+    # Backfill from existing attendance; enrolled is the current roster size
+    op.execute("""
+        INSERT INTO attendance_daily_summary (class_id, date, present_count, enrolled_count, updated_at)
+        SELECT a.class_id, a.date,
+               SUM(CASE WHEN a.status THEN 1 ELSE 0 END),
+               (SELECT COUNT(*) FROM student s WHERE s.class_id = a.class_id),
+               CURRENT_TIMESTAMP
+        FROM attendance a
+        WHERE NOT EXISTS (
+            SELECT 1 FROM attendance_daily_summary d
+            WHERE d.class_id = a.class_id AND d.date = a.date
+        )
+        GROUP BY a.class_id, a.date
+    """)
+
+
+def downgrade():
+    op.drop_table('attendance_daily_summary')
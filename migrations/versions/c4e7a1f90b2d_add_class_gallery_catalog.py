@@ -0,0 +1,43 @@
+"""Add class_gallery catalog
+
+Revision ID: c4e7a1f90b2d
+Revises: 8b2d4f6a1c93
+Create Date: 2026-10-19 20:05:41.771302
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.engine.reflection import Inspector
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4e7a1f90b2d'
+down_revision = '8b2d4f6a1c93'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    conn = op.get_bind()
+    inspector = Inspector.from_engine(conn)
+
+    # db.create_all() may already have created the table on a fresh database.
+    # Existing gallery files are registered by the app on start
+    # (or `flask embeddings catalog`).
+    if 'class_gallery' not in inspector.get_table_names():
+        op.create_table('class_gallery',
+            sa.Column('class_id', sa.Integer(), nullable=False),
+            sa.Column('path', sa.String(length=255), nullable=False),
+            sa.Column('student_count', sa.Integer(), nullable=False),
+            sa.Column('embedding_dim', sa.Integer(), nullable=True),
+            sa.Column('model_version', sa.String(length=64), nullable=True),
+            sa.Column('byte_size', sa.Integer(), nullable=False),
+            sa.Column('version', sa.Integer(), nullable=False),
+            sa.Column('updated_at', sa.DateTime(), nullable=True),
+            sa.ForeignKeyConstraint(['class_id'], ['class.id'], ),
+            sa.PrimaryKeyConstraint('class_id')
+        )
+
+
+def downgrade():
+    op.drop_table('class_gallery')
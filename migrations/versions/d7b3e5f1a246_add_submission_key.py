@@ -0,0 +1,39 @@
+"""Add submission_key
+
+Revision ID: d7b3e5f1a246
+Revises: 5e9a3c7d2b18
+Create Date: 2026-10-19 21:48:09.531276
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.engine.reflection import Inspector
+
+
+# revision identifiers, used by Alembic.
+revision = 'd7b3e5f1a246'
+down_revision = '5e9a3c7d2b18'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    conn = op.get_bind()
+    inspector = Inspector.from_engine(conn)
+
+    # db.create_all() may already have created the table on a fresh database
+    if 'submission_key' not in inspector.get_table_names():
+        op.create_table('submission_key',
+            sa.Column('student_id', sa.String(length=64), nullable=False),
+            sa.Column('key_hash', sa.String(length=64), nullable=False),
+            sa.Column('status_code', sa.Integer(), nullable=True),
+            sa.Column('response', sa.LargeBinary(), nullable=True),
+            sa.Column('expires_at', sa.DateTime(), nullable=False),
+            sa.PrimaryKeyConstraint('student_id', 'key_hash')
+        )
+        op.create_index('ix_submission_key_expires_at', 'submission_key', ['expires_at'])
+
+
+def downgrade():
+    op.drop_index('ix_submission_key_expires_at', table_name='submission_key')
+    op.drop_table('submission_key')
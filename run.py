@@ -1,12 +1,10 @@
-from app import create_app
+from app import create_app, db
 import argparse
 import os
 import subprocess
 import sys
 import shutil
 
-app = create_app()
-
 def check_facenet_model():
     """
     Check if the David Sandberg FaceNet model exists in the correct location.
@@ -29,11 +27,29 @@ def check_facenet_model():
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Run the Attendance System with Face Recognition')
+    parser.add_argument('command', nargs='?', default='serve',
+                        choices=['serve', 'inference-server', 'rebuild-embeddings'],
+                        help='serve: run the web app (default); inference-server: run the local inference daemon; '
+                             'rebuild-embeddings: recompute class galleries from stored photos')
+    parser.add_argument('--socket', default=os.environ.get('INFERENCE_SOCKET', '/tmp/attendance-inference.sock'),
+                        help='Unix socket path for the inference server')
     parser.add_argument('--host', default='0.0.0.0', help='Host to run the app on')
     parser.add_argument('--port', type=int, default=5001, help='Port to run the app on')
     parser.add_argument('--debug', action='store_true', help='Run in debug mode')
+    parser.add_argument('--workers', type=int, default=0,
+                        help='Serve with N pre-forked worker processes sharing one copy of the model (0 = development server); '
+                             'for rebuild-embeddings, the number of detection processes')
+    parser.add_argument('--max-requests', type=int, default=1000,
+                        help='Recycle a worker after this many requests (0 = never)')
+    parser.add_argument('--class-id', type=int, action='append', dest='class_ids',
+                        help='Class to rebuild embeddings for (repeatable; default all)')
+    parser.add_argument('--restart', action='store_true', help='Ignore the checkpoint of an interrupted rebuild')
     args = parser.parse_args()
     
+    # Built here, not at import: spawned rebuild workers re-import this module as __mp_main__
+    # and must not create the app (and with it the embedder and the database tables)
+    app = create_app()
+    
     # Check if FaceNet model exists
     if not check_facenet_model():
         sys.exit(1)
@@ -42,5 +58,27 @@ if __name__ == '__main__':
     os.makedirs(os.path.join(os.path.dirname(__file__), 'embeddings'), exist_ok=True)
     os.makedirs(os.path.join(os.path.dirname(__file__), 'student_images'), exist_ok=True)
     
-    # Run the Flask app
-    app.run(host=args.host, port=args.port, debug=args.debug)
\ No newline at end of file
+    if args.command == 'rebuild-embeddings':
+        from app.utils.gallery_rebuild import rebuild_galleries
+        with app.app_context():
+            rebuild_galleries(args.class_ids, workers=args.workers or None, restart=args.restart)
+    elif args.command == 'inference-server':
+        from app.utils.inference_server import run_inference_server
+        run_inference_server(args.socket)
+    elif args.workers > 0:
+        from app.utils.face_embedder import get_shared_embedder
+        from app.utils.prefork_server import PreforkServer
+        
+        def preload():
+            # Load the FaceNet graph once in the master so workers share it copy-on-write;
+            # sessions and MTCNN are created in each worker, as TensorFlow state does not survive fork
+            get_shared_embedder()
+            # Pooled connections must not be shared across fork
+            with app.app_context():
+                db.engine.dispose()
+        
+        PreforkServer(app, args.host, args.port, workers=args.workers,
+                      max_requests=args.max_requests, preload=preload).run()
+    else:
+        # Run the Flask app
+        app.run(host=args.host, port=args.port, debug=args.debug)
\ No newline at end of file